@@ -0,0 +1,326 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+End-to-end du.py latency benchmark against stand-in backends.
+
+Runs "du.py -l -s" for 1/10/50 supplementary groups and "du.py -g b" for
+10/100/1000 group members in-process with every backend faked:
+    rquota      bench/fakes/quota, or bench/fakes/rquotad with -R
+    lquota      fcntl.ioctl shim answering LL_IOC_QUOTACTL
+    bquota      bench/fakes/beegfs-ctl
+    lgq         bench/fakes/lgq
+The /lustre and /common mount points are temporary directories, the
+snapshot and per-user cache are bypassed and the node state holding hung
+mounts and circuit breakers, and the usage history, are private to the
+run.
+
+Reports p50/p95/p99 wall time per phase and overall, and writes the same
+as JSON (-o) for comparing across commits.
+
+    bench/bench.py [-n runs] [-l backend=seconds ...] [-f backend=prob ...]
+                   [-R] [-o results.json]
+
+Backends for -l/-f: quota, rquotad, lustre, beegfs, lgq.
+"""
+
+import errno
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FAKES = os.path.join(BENCH_DIR, "fakes")
+sys.path.insert(0, REPO_DIR)
+
+import du
+import lquota
+import rquota
+import bquota
+import nodestate
+import duagent
+import history
+import nsscache
+import probe
+
+GROUP_COUNTS = [ 1, 10, 50 ]
+MEMBER_COUNTS = [ 10, 100, 1000 ]
+
+# environment variable of each fake's latency and failure knobs
+LATENCY_ENV = {
+    "quota":   "FAKE_QUOTA_RTT",
+    "rquotad": "FAKE_RQUOTAD_RTT",
+    "beegfs":  "FAKE_BEEGFS_LATENCY",
+    "lgq":     "FAKE_LGQ_LATENCY",
+}
+FAIL_ENV = {
+    "quota":   "FAKE_QUOTA_FAIL",
+    "rquotad": "FAKE_RQUOTAD_FAIL",
+    "beegfs":  "FAKE_BEEGFS_FAIL",
+    "lgq":     "FAKE_LGQ_FAIL",
+}
+
+class ioctl_shim(object):
+    """Stands in for the fcntl module in lquota, answering LL_IOC_QUOTACTL
+       after latency seconds, failing with EIO with probability fail"""
+
+    def __init__(self, latency = 0.0, fail = 0.0):
+        self.latency = latency
+        self.fail = fail
+
+    def ioctl(self, fd, request, arg, mutate = True):
+        time.sleep(self.latency)
+        if random.random() < self.fail:
+            raise IOError(errno.EIO, "Input/output error")
+        q = list(lquota.struct.unpack(lquota.fmt_if_quotactl, bytes(arg)))
+        id = q[2]
+        # dqb_bhardlimit, dqb_bsoftlimit, dqb_curspace, dqb_ihardlimit,
+        # dqb_isoftlimit, dqb_curinodes
+        q[10:16] = [ 100 << 20, 90 << 20, ((id * 7919) % 100) << 30,
+                     1 << 20, 1 << 19, (id * 104729) % (1 << 20) ]
+        data = lquota.struct.pack(lquota.fmt_if_quotactl, *q)
+        if isinstance(arg, bytearray) and mutate:
+            arg[:] = data
+            return 0
+        return data
+
+class fake_pw(object):
+    def __init__(self, uid):
+        self.pw_name = "u{0}".format(uid)
+        self.pw_uid = uid
+        self.pw_gid = uid
+        self.pw_dir = "/"
+
+class fake_gr(object):
+    def __init__(self, gid):
+        self.gr_name = "g{0}".format(gid)
+        self.gr_gid = gid
+
+def fallback(real, fake):
+    """real NSS lookup, fake entry for the benchmark's made up ids"""
+    def lookup(id):
+        try:
+            return real(id)
+        except KeyError:
+            return fake(id)
+    return lookup
+
+class options(object):
+    """du.py's parsed options"""
+    color = "a"
+    fill = False
+    format = "text"
+    group = None
+    login = True
+    cache = False
+    reverse = False
+    sup = True
+    top = None
+    verbose = False
+    walk = None
+    watch = False
+
+class phase_timer(object):
+    """Wraps du module functions to record their wall time per run"""
+
+    def __init__(self):
+        self.times = {}
+
+    def wrap(self, module, name, phase):
+        func = getattr(module, name)
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.times[phase] = self.times.get(phase, 0.0) + \
+                                    time.time() - start
+        setattr(module, name, timed)
+
+def percentiles(samples):
+    """returns p50/p95/p99 of samples, nearest rank, in milliseconds"""
+    s = sorted(samples)
+    ret = {}
+    for p in (50, 95, 99):
+        ret["p{0}".format(p)] = \
+            round(1000.0 * s[max(0, int(len(s) * p / 100.0 + 0.5) - 1)], 3)
+    return ret
+
+def run(func, timer, runs):
+    """runs func() runs times with stdout discarded, returns per-phase and
+       total percentiles"""
+    samples = {}
+    for i in range(runs):
+        timer.times = {}
+        stdout = sys.stdout
+        # main_group() closes stdout when it's done
+        sys.stdout = open(os.devnull, "w")
+        start = time.time()
+        try:
+            func()
+        except SystemExit:
+            pass
+        finally:
+            total = time.time() - start
+            sys.stdout.close()
+            sys.stdout = stdout
+        for phase, t in timer.times.items():
+            samples.setdefault(phase, []).append(t)
+        samples.setdefault("total", []).append(total)
+    return dict([ (phase, percentiles(s)) for phase, s in samples.items() ])
+
+def git_head():
+    try:
+        return subprocess.Popen([ "git", "-C", REPO_DIR, "rev-parse", "HEAD" ],
+                                stdout = subprocess.PIPE,
+                                stderr = open(os.devnull, "w")) \
+                         .communicate()[0].strip() or None
+    except OSError:
+        return None
+
+def parse_knobs(values, choices):
+    """parses backend=value options into a dictionary of floats"""
+    ret = {}
+    for v in values:
+        k, x = v.split("=", 1)
+        if k not in choices:
+            raise SystemExit("unknown backend {0}".format(k))
+        ret[k] = float(x)
+    return ret
+
+def main():
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("-n", "--runs", type = "int", default = 20,
+                      help = "runs per configuration, default 20")
+    parser.add_option("-l", "--latency", action = "append", default = [],
+                      metavar = "BACKEND=SECONDS",
+                      help = "latency of a fake backend, repeatable")
+    parser.add_option("-f", "--fail", action = "append", default = [],
+                      metavar = "BACKEND=PROBABILITY",
+                      help = "failure probability of a fake backend, "
+                      "repeatable")
+    parser.add_option("-R", "--rquotad", action = "store_true",
+                      default = False,
+                      help = "use the native RPC client against the fake "
+                      "rquotad instead of the fake quota binary")
+    parser.add_option("-o", "--output", action = "store",
+                      help = "write JSON results here, default stdout")
+    (opts, args) = parser.parse_args()
+
+    backends = [ "quota", "rquotad", "lustre", "beegfs", "lgq" ]
+    latency = parse_knobs(opts.latency, backends)
+    fail = parse_knobs(opts.fail, backends)
+    for k, v in latency.items():
+        if k in LATENCY_ENV:
+            os.environ[LATENCY_ENV[k]] = str(v)
+    for k, v in fail.items():
+        if k in FAIL_ENV:
+            os.environ[FAIL_ENV[k]] = str(v)
+
+    tmp = tempfile.mkdtemp(prefix = "du-bench.")
+    server = None
+    try:
+        for d in ("lustre", "common"):
+            os.mkdir(os.path.join(tmp, d))
+
+        # hung mounts and circuit breakers stay private to the benchmark
+        nodestate.NODESTATE_PATH = os.path.join(tmp, "state")
+        # never a node's real du agent
+        duagent.AGENT_SOCKET = os.path.join(tmp, "agent.sock")
+        # nor the user's usage history
+        history.HISTORY_DIR = os.path.join(tmp, "history-{0}")
+        du.LUSTRE_MOUNT_POINT = os.path.join(tmp, "lustre")
+        du.BEEGFS_MOUNT_POINT = os.path.join(tmp, "common")
+        du.GROUP_QUOTA_BINARY = os.path.join(FAKES, "lgq")
+        nsscache.getpwuid = fallback(nsscache.getpwuid, fake_pw)
+        nsscache.getgrgid = fallback(nsscache.getgrgid, fake_gr)
+        # the NSS name cache starts out empty
+        os.environ["XDG_RUNTIME_DIR"] = tmp
+        lopts = options()
+        rquota.QUOTA_BINARY = os.path.join(FAKES, "quota")
+        bquota.BEEGFS_CTL = os.path.join(FAKES, "beegfs-ctl")
+        lquota.fcntl = ioctl_shim(latency.get("lustre", 0.0),
+                                  fail.get("lustre", 0.0))
+
+        if opts.rquotad:
+            server = subprocess.Popen([ os.path.join(FAKES, "rquotad") ],
+                                      stdout = subprocess.PIPE)
+            rquota.RQUOTA_PORT = int(server.stdout.readline())
+            rquota.rquota_mount_device = lambda path: "127.0.0.1:/home"
+
+        timer = phase_timer()
+        timer.wrap(du, "home_probe", "home_mount")
+        # du.py imports these where used, wrap them at the source
+        timer.wrap(probe, "probe_mount", "statvfs")
+        timer.wrap(du, "home_rquota", "rquota")
+        timer.wrap(lquota, "lquota_get", "lquota")
+        timer.wrap(bquota, "bquota_get", "bquota")
+        timer.wrap(du, "display_default", "render")
+        timer.wrap(du, "group_lquota", "lgq")
+        timer.wrap(du, "group_quota_display", "render")
+
+        results = []
+        uid = os.getuid()
+        gid = os.getgid()
+        real_getgroups = os.getgroups
+        for n in GROUP_COUNTS:
+            grps = [ gid ] + [ 200000 + i for i in range(n) ]
+            os.getgroups = du.getgroups = lambda: list(grps)
+            os.environ["FAKE_QUOTA_GROUPS"] = \
+                ",".join([ str(g) for g in grps ])
+            phases = run(lambda: du.main_default(lopts), timer, opts.runs)
+            results.append({ "mode": "login", "groups": n,
+                             "phases": phases })
+        os.getgroups = du.getgroups = real_getgroups
+
+        gopts = options()
+        gopts.group = "b"
+        for n in MEMBER_COUNTS:
+            os.environ["FAKE_LGQ_MEMBERS"] = str(n)
+            phases = run(lambda: du.main_group(gopts), timer, opts.runs)
+            results.append({ "mode": "group", "members": n,
+                             "phases": phases })
+    finally:
+        if server is not None:
+            server.kill()
+        shutil.rmtree(tmp)
+
+    report = {
+        "commit": git_head(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "runs": opts.runs,
+        "latency": latency,
+        "fail": fail,
+        "rquota": "rquotad" if opts.rquotad else "quota",
+        "results": results,
+    }
+
+    for r in results:
+        what = "login -s, {0} groups".format(r["groups"]) \
+               if r["mode"] == "login" else \
+               "group, {0} members".format(r["members"])
+        print >>sys.stderr, what
+        for phase in sorted(r["phases"].keys()):
+            p = r["phases"][phase]
+            print >>sys.stderr, "  {0:<12}{1:>10.3f}{2:>10.3f}{3:>10.3f} ms" \
+                                .format(phase, p["p50"], p["p95"], p["p99"])
+
+    if opts.output:
+        f = open(opts.output, "w")
+        json.dump(report, f, indent = 1, sort_keys = True)
+        f.close()
+    else:
+        json.dump(report, sys.stdout, indent = 1, sort_keys = True)
+        print
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Compare beegfs-ctl invocations and wall time for bquota_get against a
+query per id, using the stand-in bench/fakes/beegfs-ctl.
+
+    bench/bquota_bench.py [group count ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import bquota
+
+def per_id_get(path, uid, grps):
+    """bquota_get as it was, one beegfs-ctl per id"""
+    uql = [ bquota.call_beegfs_ctl(bquota.USRQUOTA, path, [ uid ]).get(uid) ]
+    for g in grps:
+        uql.append(bquota.call_beegfs_ctl(bquota.GRPQUOTA, path, [ g ]).get(g))
+    return uql
+
+def run(func, log):
+    """returns (seconds, invocations) for func()"""
+    open(log, "w").close()
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    return (elapsed, len(open(log).readlines()))
+
+def main(counts):
+    bquota.BEEGFS_CTL = os.path.join(BENCH_DIR, "fakes", "beegfs-ctl")
+    fd, log = tempfile.mkstemp(prefix = "bquota_bench.")
+    os.close(fd)
+    os.environ["FAKE_CALL_LOG"] = log
+
+    uid = os.getuid()
+    gid = os.getgid()
+
+    print "{0:>8}{1:>12}{2:>12}{3:>12}{4:>12}".format(
+        "groups", "per-id fork", "per-id s", "batch fork", "batch s")
+    for n in counts:
+        grps = [ gid ] + [ 100000 + i for i in range(n) ]
+        os.getgroups = lambda: list(grps)
+
+        pt, pf = run(lambda: per_id_get("/common", uid, grps), log)
+        bt, bf = run(lambda: bquota.bquota_get("/common", True), log)
+
+        print "{0:>8}{1:>12}{2:>12.3f}{3:>12}{4:>12.3f}".format(
+            n, pf, pt, bf, bt)
+
+    os.unlink(log)
+
+if __name__ == "__main__":
+    main([ int(a) for a in sys.argv[1:] ] or [ 0, 1, 5, 15, 50 ])
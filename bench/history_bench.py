@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Time du.py's usage history read and growth fit with a full ring of hourly
+samples, as a login showing cached usage (read only) and one showing
+fresh usage (appending) would.
+
+    bench/history_bench.py [-e entities] [-n runs]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import history
+from du import ds_t
+
+def fill(entities):
+    """fills the history ring with hourly samples of entities growing
+       usages, returns their (mount, type, id) keys"""
+    keys = [ (i % 3, 1, 1000 + i) for i in range(entities) ]
+    fd, map = history.history_open()
+    try:
+        now = int(time.time())
+        n = history.HISTORY_RECORDS
+        for r in range(n):
+            k = keys[r % entities]
+            t = now - (n - r) / entities * history.HISTORY_INTERVAL
+            off = history.hist_header.size + r * history.hist_record.size
+            map[off:off + history.hist_record.size] = \
+                history.hist_record.pack(history.history_key(*k), t,
+                                         (1 << 30) + r * 4096, 1 << 30,
+                                         r, 1 << 20)
+        history.hist_header.pack_into(map, 0, history.HISTORY_MAGIC,
+                                      history.HISTORY_VERSION,
+                                      history.hist_record.size,
+                                      history.HISTORY_RECORDS, n)
+    finally:
+        map.close()
+        os.close(fd)
+    return keys
+
+def best(func, runs):
+    """returns (min seconds, result) of runs calls of func()"""
+    times = []
+    for i in range(runs):
+        start = time.time()
+        ret = func()
+        times.append(time.time() - start)
+    return (min(times), ret)
+
+def main():
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("-e", "--entities", type = "int", default = 12,
+                      help = "usages sampled, default 12")
+    parser.add_option("-n", "--runs", type = "int", default = 20,
+                      help = "runs per measurement, default 20")
+    (opts, args) = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix = "history-bench.")
+    try:
+        history.HISTORY_DIR = os.path.join(tmp, "history-{0}")
+        keys = fill(opts.entities)
+        samples = dict([ (k, ds_t(1 << 31, 1 << 30, 1 << 10, 1 << 20))
+                         for k in keys ])
+
+        rt, growth = best(lambda: history.history_update(samples, False),
+                          opts.runs)
+        # the first appends, the rest find a sample under an hour old
+        at, x = best(lambda: history.history_update(samples, True), 1)
+        print "{0} records, {1} usages, {2} with growth".format(
+            history.HISTORY_RECORDS, len(keys), len(growth))
+        print "  read only  {0:8.2f} ms".format(1000 * rt)
+        print "  append     {0:8.2f} ms".format(1000 * at)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Import time of du.py's entry points, the python 2 equivalent of
+"python -X importtime".
+
+    bench/import_time.py [-n runs] [-t] [module|zipapp ...]
+
+For each module (default du) runs fresh interpreters importing it and
+reports the wall time from interpreter start to the end of the import,
+min/p50 over the runs, along with the number of modules loaded.  -t also
+prints one run's import tree, self and cumulative microseconds per module
+as -X importtime does.  A path ending in .pyz is timed as a zipapp built
+by mkpyz.py, importing its entry point from the archive with python -S as
+its #! line runs it.
+"""
+
+import os
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# run in the child interpreter, argv: path module tree
+CHILD = r"""
+import sys
+t0 = __import__("time").time()
+path, module, tree = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+sys.path.insert(0, path)
+if tree:
+    import __builtin__
+    real_import = __builtin__.__import__
+    stack = []
+    lines = []
+    clock = __import__("time").time
+    def timed_import(name, *args, **kwargs):
+        fresh = name not in sys.modules
+        start = clock()
+        stack.append(0.0)
+        try:
+            return real_import(name, *args, **kwargs)
+        finally:
+            inner = stack.pop()
+            total = clock() - start
+            if stack:
+                stack[-1] += total
+            if fresh and name in sys.modules:
+                lines.append((len(stack), name, total - inner, total))
+    __builtin__.__import__ = timed_import
+before = len(sys.modules)
+__import__(module)
+t1 = __import__("time").time()
+sys.stdout.write("{0} {1}\n".format(t1, len(sys.modules) - before))
+if tree:
+    for depth, name, self, cumulative in lines:
+        sys.stdout.write("import time: {0:>9} | {1:>11} | {2}{3}\n".format(
+            int(self * 1e6), int(cumulative * 1e6), "  " * depth, name))
+"""
+
+def run(path, module, tree, nosite = False):
+    """returns (seconds from exec to imported, modules loaded, tree lines)"""
+    start = time.time()
+    out = subprocess.Popen([ sys.executable ] + ([ "-S" ] if nosite else []) +
+                           [ "-c", CHILD, path, module, "1" if tree else "0" ],
+                           stdout = subprocess.PIPE).communicate()[0]
+    lines = out.splitlines()
+    end, count = lines[0].split()
+    return (float(end) - start, int(count), lines[1:])
+
+def main():
+    parser = OptionParser(usage = "%prog [options] [module|zipapp ...]")
+    parser.add_option("-n", "--runs", type = "int", default = 30,
+                      help = "interpreter starts per module, default 30")
+    parser.add_option("-t", "--tree", action = "store_true", default = False,
+                      help = "print an import tree like -X importtime")
+    (opts, args) = parser.parse_args()
+
+    for target in args or [ "du" ]:
+        if target.endswith(".pyz"):
+            # a zipapp's __main__ would run dulogin, time importing it
+            path, module, nosite = os.path.abspath(target), "dulogin", True
+        else:
+            path, module, nosite = REPO_DIR, target, False
+
+        times = []
+        for i in range(opts.runs):
+            t, count, lines = run(path, module, False, nosite)
+            times.append(t)
+        times.sort()
+        print "{0:<24} min {1:7.2f} ms  p50 {2:7.2f} ms  {3} modules" \
+              .format(target, 1000 * times[0],
+                      1000 * times[len(times) / 2], count)
+
+        if opts.tree:
+            print "import time: self [us] | cumulative | imported package"
+            for l in run(path, module, True, nosite)[2]:
+                print l
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/bin/sh
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+# Times lgq group member enumeration against synthetic passwd and group
+# databases of growing size, served through nss_wrapper
+# (https://cwrap.org/nss_wrapper.html), using the lgq-test build.
+#
+#   bench/lgq_scale.sh [user count ...]
+#
+# Each run has users/10 groups, 10 users with each as their primary group
+# and 5 explicit members per group.  lgq-test is given 20 of the groups.
+# Run as root to also time the primary GID index, which lgq only trusts
+# when root owned.
+
+set -e
+
+BENCH_DIR=$(cd "$(dirname "$0")" && pwd)
+LGQ_DIR="$BENCH_DIR/../lgq"
+NSS_WRAPPER=${NSS_WRAPPER:-$(ls /usr/lib*/libnss_wrapper.so \
+                                /usr/lib/*/libnss_wrapper.so 2>/dev/null |
+                             head -n 1)}
+
+if [ ! -f "$NSS_WRAPPER" ]; then
+    echo "libnss_wrapper.so not found, set NSS_WRAPPER" >&2
+    exit 1
+fi
+
+TMP=$(mktemp -d)
+trap 'rm -rf "$TMP"' EXIT
+
+cc -Wall -O2 -DLGQ_TEST -DPRIMARY_GID_INDEX="\"$TMP/primary_gid\"" \
+   -o "$TMP/lgq-test" "$LGQ_DIR/lgq.c" -lpthread
+
+run() {
+    start=$(date +%s%N)
+    LD_PRELOAD="$NSS_WRAPPER" \
+    NSS_WRAPPER_PASSWD="$TMP/passwd" NSS_WRAPPER_GROUP="$TMP/group" \
+        "$TMP/lgq-test" $GIDS > "$TMP/out" || true
+    end=$(date +%s%N)
+    # 12 byte header, 60 byte records
+    echo "$(( ($(wc -c < "$TMP/out") - 12) / 60 )) $(( (end - start) / 1000000 ))"
+}
+
+printf "%10s%10s%12s%12s%12s\n" users groups members "passwd ms" "index ms"
+for USERS in ${@:-1000 10000 100000}; do
+    awk -v n="$USERS" 'BEGIN {
+        for (u = 0; u < n; u++)
+            printf "u%d:x:%d:%d::/home/g%d/u%d:/bin/sh\n",
+                   u, 100000 + u, 200000 + int(u / 10), int(u / 10), u
+    }' > "$TMP/passwd"
+    awk -v n="$USERS" 'BEGIN {
+        for (g = 0; g < n / 10; g++) {
+            m = ""
+            for (i = 1; i <= 5; i++)
+                m = m (i > 1 ? "," : "") "u" (g * 10 + i * 37) % n
+            printf "g%d:x:%d:%s\n", g, 200000 + g, m
+        }
+    }' > "$TMP/group"
+    GIDS=$(awk -v n="$USERS" 'BEGIN {
+        for (i = 0; i < 20; i++) printf "%d ", 200000 + (i * 7919) % (n / 10)
+    }')
+
+    rm -f "$TMP/primary_gid"
+    set -- $(run)
+    members=$1 passwd_ms=$2
+
+    index_ms=-
+    if [ "$(id -u)" = 0 ]; then
+        awk -F: '{ print $4, $3 }' "$TMP/passwd" | sort -n > "$TMP/primary_gid"
+        chmod 644 "$TMP/primary_gid"
+        set -- $(run)
+        members=$1 index_ms=$2
+    fi
+
+    printf "%10s%10s%12s%12s%12s\n" "$USERS" $((USERS / 10)) \
+           "$members" "$passwd_ms" "$index_ms"
+done
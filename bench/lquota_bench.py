@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Compare lquota_get_many against an ioctl and if_quotactl per id, through
+bench.py's ioctl shim standing in for LL_IOC_QUOTACTL.
+
+    bench/lquota_bench.py [id count ...]
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import lquota
+from bench import ioctl_shim
+
+def per_id_get(path, qtype, ids):
+    """lquota_get_ids as it was, a fresh request and if_quotactl per id"""
+    ret = []
+    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK | os.O_DIRECTORY)
+    try:
+        for i in ids:
+            req = struct.pack(lquota.fmt_if_quotactl, lquota.LUSTRE_Q_GETQUOTA,
+                              qtype, i, 0, 0, 0,
+                              *(([0] * 4) + ([0] * 10) +
+                               (['\0'] * 16) + (['\0'] * 40)))
+            q = lquota.fcntl.ioctl(fd, lquota.LL_IOC_QUOTACTL, req)
+            ret.append(lquota.lquota_if_quotactl(
+                struct.unpack(lquota.fmt_if_quotactl, q)))
+    finally:
+        os.close(fd)
+    return ret
+
+def best(func, runs = 3):
+    """returns (min seconds, result) of runs calls of func()"""
+    times = []
+    for i in range(runs):
+        start = time.time()
+        ret = func()
+        times.append(time.time() - start)
+    return (min(times), ret)
+
+def main(counts):
+    lquota.fcntl = ioctl_shim()
+    path = tempfile.mkdtemp(prefix = "lquota_bench.")
+    try:
+        print "{0:>8}{1:>14}{2:>14}{3:>10}".format(
+            "ids", "per-id ms", "many ms", "same")
+        for n in counts:
+            ids = range(10000, 10000 + n)
+            pt, pq = best(lambda: per_id_get(path, lquota.GRPQUOTA, ids))
+            mt, mq = best(lambda: lquota.lquota_get_many(path,
+                                                        lquota.GRPQUOTA, ids))
+            print "{0:>8}{1:>14.1f}{2:>14.1f}{3:>10}".format(
+                n, 1000 * pt, 1000 * mt, str(pq == list(mq)))
+    finally:
+        os.rmdir(path)
+
+if __name__ == "__main__":
+    main([ int(a) for a in sys.argv[1:] ] or [ 100, 1000, 10000, 50000 ])
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Time qscan.py's load, threshold check and report over a synthetic
+snapshot, against a qcheck() per record.
+
+    bench/qscan_bench.py [-i ids] [-n runs]
+
+ids are split 4:1 between users and groups, each with a record on three
+mounts, about 1 in 10 over its warning percentage.
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import du
+import qscan
+import snapshot
+from collect import statvfs_t, stat_t
+from rquota import USRQUOTA, GRPQUOTA
+
+MOUNTS = [ ("/home", snapshot.KIND_RQUOTA), ("/lustre", snapshot.KIND_LQUOTA),
+           ("/common", snapshot.KIND_BQUOTA) ]
+
+def synthetic(path, ids):
+    """writes a snapshot of ids made up users and groups to path"""
+    random.seed(ids)
+    mounts = [ (mp, kind, statvfs_t(4096, 1 << 30, 1 << 29, 1 << 24, 1 << 23),
+                stat_t(0, 0)) for mp, kind in MOUNTS ]
+    records = []
+    for i in range(ids):
+        qtype = USRQUOTA if i % 5 else GRPQUOTA
+        for m in range(len(mounts)):
+            bh = random.choice([ 0, 10 << 20, 100 << 20, 1 << 30 ])
+            ih = random.choice([ 0, 1 << 20, 10 << 20 ])
+            over = random.random() < 0.1
+            bc = int((bh << 10) * random.uniform(0.8 if over else 0.0,
+                                                 1.0 if over else 0.7))
+            ic = int(ih * random.uniform(0.0, 0.7))
+            records.append((m, qtype, 10000 + i, bc, 0, bh, 0, ic, 0, ih, 0))
+    snapshot.snapshot_write(path, mounts, records)
+
+def per_record(cols):
+    """du.py's check, one qcheck() per record"""
+    ret = []
+    for i in range(len(cols["id"])):
+        ds = du.ds_t(cols["bc"][i], cols["bh"][i], cols["ic"][i],
+                     cols["ih"][i])
+        if du.qcheck(cols["type"][i], ds, ds, ds):
+            ret.append(i)
+    return ret
+
+def best(func, runs):
+    """returns (min seconds, result) of runs calls of func()"""
+    times = []
+    for i in range(runs):
+        start = time.time()
+        ret = func()
+        times.append(time.time() - start)
+    return (min(times), ret)
+
+def main():
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("-i", "--ids", type = "int", default = 50000,
+                      help = "users and groups in the snapshot, default 50000")
+    parser.add_option("-n", "--runs", type = "int", default = 5,
+                      help = "runs per measurement, default 5")
+    (opts, args) = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix = "qscan-bench.")
+    try:
+        path = os.path.join(tmp, "quota.snap")
+        synthetic(path, opts.ids)
+        wp = dict([ (t, du.QCHECK_TABLE[t][:2])
+                    for t in (USRQUOTA, GRPQUOTA) ])
+
+        lt, (mounts, cols) = best(lambda: qscan.scan_snapshot(path),
+                                  opts.runs)
+        ct, (rows, bp, ip) = best(lambda: qscan.scan_offenders(cols, wp),
+                                  opts.runs)
+        null = open(os.devnull, "w")
+        rt, x = best(lambda: qscan.scan_report(null, mounts, cols,
+                                               rows, bp, ip), opts.runs)
+        null.close()
+        pt, prow = best(lambda: per_record(cols), 1)
+
+        print "{0} ids, {1} records, {2} offenders".format(
+            opts.ids, len(cols["id"]), len(rows))
+        print "  load     {0:8.1f} ms".format(1000 * lt)
+        print "  check    {0:8.1f} ms".format(1000 * ct)
+        print "  report   {0:8.1f} ms".format(1000 * rt)
+        print "  total    {0:8.1f} ms".format(1000 * (lt + ct + rt))
+        print "  qcheck() per record {0:8.1f} ms, {1} offenders".format(
+            1000 * pt, len(prow))
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
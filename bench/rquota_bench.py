@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Compare rquota's native RPC client against forking the quota binary,
+using the stand-ins bench/fakes/rquotad and bench/fakes/quota with the
+same per-request round trip time.
+
+    bench/rquota_bench.py [-r rtt] [-p udp|tcp] [group count ...]
+"""
+
+import os
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import rquota
+
+def best(func, n = 5):
+    """returns the fastest of n runs of func() in seconds"""
+    ret = float("inf")
+    for i in range(n):
+        start = time.time()
+        func()
+        ret = min(ret, time.time() - start)
+    return ret
+
+def main():
+    parser = OptionParser(usage = "%prog [options] [group count ...]")
+    parser.add_option("-r", "--rtt", type = "float", default = 0.002,
+                      help = "seconds per rquotad round trip, default 0.002")
+    parser.add_option("-p", "--proto", choices = [ "udp", "tcp" ],
+                      default = "udp", help = "RPC transport, default udp")
+    (opts, args) = parser.parse_args()
+    counts = [ int(a) for a in args ] or [ 1, 10, 50 ]
+
+    os.environ["FAKE_RQUOTAD_RTT"] = str(opts.rtt)
+    os.environ["FAKE_QUOTA_RTT"] = str(opts.rtt)
+    server = subprocess.Popen([ os.path.join(BENCH_DIR, "fakes", "rquotad") ],
+                              stdout = subprocess.PIPE)
+    try:
+        rquota.RQUOTA_PORT = int(server.stdout.readline())
+        rquota.RQUOTA_PROTO = opts.proto
+        rquota.QUOTA_BINARY = os.path.join(BENCH_DIR, "fakes", "quota")
+
+        uid = os.getuid()
+        gid = os.getgid()
+
+        print "{0:>8}{1:>14}{2:>14}".format("groups", "fork+parse s",
+                                             "native s")
+        for n in counts:
+            grps = [ 100000 + i for i in range(n) ]
+            os.environ["FAKE_QUOTA_GROUPS"] = \
+                ",".join([ str(g) for g in [ gid ] + grps ])
+            queries = [ (rquota.USRQUOTA, uid), (rquota.GRPQUOTA, gid) ] + \
+                      [ (rquota.GRPQUOTA, g) for g in grps ]
+
+            ft = best(lambda: rquota.rquota_get_binary("/home", True))
+            nt = best(lambda: rquota.rquota_rpc("127.0.0.1", "/home",
+                                                queries))
+
+            print "{0:>8}{1:>14.4f}{2:>14.4f}".format(n, ft, nt)
+    finally:
+        server.kill()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Time du.py -w's walk of a synthetic tree, first with an empty index and
+then rerun on the unchanged tree, with lstat(2) and listdir standing in
+for Lustre MDS round trips by sleeping -l seconds each.
+
+    bench/walk_bench.py [-d dirs] [-f files] [-l seconds] [-w workers ...]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import walk
+
+class slow_os(object):
+    """os, with lstat and listdir taking latency seconds longer"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def __getattr__(self, name):
+        return getattr(os, name)
+
+    def lstat(self, path):
+        time.sleep(self.latency)
+        return os.lstat(path)
+
+    def listdir(self, path):
+        time.sleep(self.latency)
+        return os.listdir(path)
+
+def synthetic(root, dirs, files):
+    """makes dirs directories of files small files each under root, 32
+       directories to a parent"""
+    for i in range(dirs):
+        d = os.path.join(root, "d{0}".format(i / 32), "d{0}".format(i))
+        os.makedirs(d)
+        for j in range(files):
+            f = open(os.path.join(d, "f{0}".format(j)), "w")
+            f.write("x" * (j * 512))
+            f.close()
+    # older than walk.WALK_RACY, so the first walk's entries are reusable
+    old = time.time() - 60
+    for path, subdirs, names in os.walk(root):
+        os.utime(path, (old, old))
+
+def main():
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("-d", "--dirs", type = "int", default = 1000,
+                      help = "directories in the tree, default 1000")
+    parser.add_option("-f", "--files", type = "int", default = 20,
+                      help = "files per directory, default 20")
+    parser.add_option("-l", "--latency", type = "float", default = 0.0002,
+                      help = "seconds added to every lstat and listdir, "
+                      "default 0.0002")
+    parser.add_option("-w", "--workers", type = "int", action = "append",
+                      help = "worker threads, repeatable, default 1 and "
+                      "{0}".format(walk.WALK_WORKERS))
+    (opts, args) = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix = "walk-bench.")
+    try:
+        root = os.path.join(tmp, "tree")
+        synthetic(root, opts.dirs, opts.files)
+        os.environ["XDG_RUNTIME_DIR"] = tmp
+        os.chmod(tmp, 0700)
+        walk.os = slow_os(opts.latency)
+        null = open(os.devnull, "w")
+        stdout = sys.stdout
+
+        print "{0} directories, {1} files, {2} ms per call".format(
+            opts.dirs + opts.dirs / 32 + 1, opts.dirs * opts.files,
+            1000 * opts.latency)
+        for workers in opts.workers or [ 1, walk.WALK_WORKERS ]:
+            times = []
+            for use_index in (False, True):
+                sys.stdout = null
+                start = time.time()
+                try:
+                    ret = walk.walk(root, 10, use_index, workers)
+                finally:
+                    sys.stdout = stdout
+                times.append((time.time() - start, ret[1]))
+            print "  {0:>2} workers  first {1:8.1f} ms  rerun {2:8.1f} ms, " \
+                  "{3} reused".format(workers, 1000 * times[0][0],
+                                      1000 * times[1][0], times[1][1])
+        null.close()
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,11 @@
 import collections
 import operator
 import os
-import subprocess
 import sys
 import pwd
 
+from timings import timings_begin, timings_end
+
 # used in bquota_t.type
 USRQUOTA = 0
 GRPQUOTA = 1
@@ -30,25 +31,36 @@ bquota_t = collections.namedtuple("bquota_t",
                                      "dqb_itime"
                                   ])
 
-def call_beegfs_ctl(qtype, path, id):
-    """Calls out to the beegfs-ctl binary to collect user/group
-       info on path for id.  Returns a bquota_t object."""
+BEEGFS_CTL = "/usr/bin/beegfs-ctl"
+
+def beegfs_ctl_start(qtype, path, ids):
+    """Starts the beegfs-ctl binary to collect user/group info on path for
+       every id in ids with a single invocation.  Returns the Popen
+       object, or None if it could not be started."""
+    # not imported up front, du.py logins answered from its caches never
+    # start beegfs-ctl
+    import subprocess
+
     # see "beegfs-ctl --getquota --help"
-    if qtype == USRQUOTA:
-        QUOTA = "/usr/bin/beegfs-ctl --getquota --csv --mount={0} --{1} {2}" \
-                .format(path, "uid", id).split()
+    QUOTA = [ BEEGFS_CTL, "--getquota", "--csv", "--mount={0}".format(path),
+              "--uid" if qtype == USRQUOTA else "--gid" ]
+    if len(ids) == 1:
+        QUOTA.append(str(ids[0]))
     else:
-        QUOTA = "/usr/bin/beegfs-ctl --getquota --csv --mount={0} --{1} {2}" \
-                .format(path, "gid", id).split()
+        QUOTA += [ "--list", ",".join([str(i) for i in ids]) ]
 
-    # quota standard output read into string
     try:
-        qstdout = subprocess.Popen(QUOTA,
-                                   stdout = subprocess.PIPE,
-                                   stderr = subprocess.STDOUT).communicate()[0]
+        return subprocess.Popen(QUOTA,
+                                stdout = subprocess.PIPE,
+                                stderr = subprocess.STDOUT)
     except:
         return
 
+def beegfs_ctl_parse(qtype, qstdout):
+    """Parses beegfs-ctl --csv output, one row per id.  Returns a
+       dictionary of id: bquota_t object."""
+    ret = {}
+
     # split string blob into a list of lines
     qlines = qstdout.split("\n")
 
@@ -59,37 +71,53 @@ def call_beegfs_ctl(qtype, path, id):
     hk[3] = "size_hard"
     hk[5] = "files_hard"
 
-    # and the values
-    qv = qlines[1].split(",")
-
-    # quota dictionary
-    qd = dict(zip(hk, qv))
-
-    return bquota_t(qtype,
-                    int(qd["id"]),
-                    int(qd["size"].split()[0]),
-                    0 if qd["size_hard"] == "unlimited"
-                      else int(qd["size_hard"].split()[0]) / (1 << 10),
-                    0 if qd["size_hard"] == "unlimited"
-                      else int(qd["size_hard"].split()[0]) / (1 << 10),
-                    0,
-                    int(qd["files"]),
-                    0 if qd["files_hard"] == "unlimited"
-                      else int(qd["files_hard"]),
-                    0 if qd["files_hard"] == "unlimited"
-                      else int(qd["files_hard"]),
-                    0)
+    # and the values, one line per id
+    for l in qlines[1:]:
+        if not l:
+            continue
+
+        # quota dictionary
+        qd = dict(zip(hk, l.split(",")))
+
+        q = bquota_t(qtype,
+                     int(qd["id"]),
+                     int(qd["size"].split()[0]),
+                     0 if qd["size_hard"] == "unlimited"
+                       else int(qd["size_hard"].split()[0]) / (1 << 10),
+                     0 if qd["size_hard"] == "unlimited"
+                       else int(qd["size_hard"].split()[0]) / (1 << 10),
+                     0,
+                     int(qd["files"]),
+                     0 if qd["files_hard"] == "unlimited"
+                       else int(qd["files_hard"]),
+                     0 if qd["files_hard"] == "unlimited"
+                       else int(qd["files_hard"]),
+                     0)
+        ret[q.id] = q
+
+    return ret
+
+def call_beegfs_ctl(qtype, path, ids):
+    """Calls out to the beegfs-ctl binary to collect user/group
+       info on path for ids.  Returns a dictionary of id: bquota_t
+       object."""
+    t = timings_begin("beegfs-ctl")
+    proc = beegfs_ctl_start(qtype, path, ids)
+    if proc is None:
+        timings_end(t)
+        return {}
+
+    # quota standard output read into string
+    qstdout = proc.communicate()[0]
+    timings_end(t)
+    return beegfs_ctl_parse(qtype, qstdout)
 
 def bquota_get(path, query_supplementary = False):
     """Returns a list of bquota_t objects in order UID, GID, followed
        by supplemental GID(s) of the calling user."""
-    # user quota list
-    uql = []
-
     if type(path) is not str:
-        return uql
+        return []
 
-    uid = os.getuid()
     # place primary GID at the start of the list
     gid = os.getgid()
     if query_supplementary:
@@ -100,12 +128,48 @@ def bquota_get(path, query_supplementary = False):
         grps = list()
     grps.insert(0, gid)
 
+    return bquota_get_user(path, os.getuid(), grps)
+
+def bquota_get_user(path, uid, grps):
+    """Returns a list of bquota_t objects on path in order uid, followed
+       by every GID in grps, primary first."""
+    # user quota list
+    uql = []
+
+    # One beegfs-ctl for the UID and one for every GID, both started before
+    # either is read so they run side by side.
+    ut = timings_begin("beegfs-ctl uid")
+    uproc = beegfs_ctl_start(USRQUOTA, path, [ uid ])
+    gt = timings_begin("beegfs-ctl gid")
+    gproc = beegfs_ctl_start(GRPQUOTA, path, grps)
+    if uproc is None or gproc is None:
+        # the one that did start is no use alone, but mustn't be left a
+        # zombie or blocked on a pipe nobody reads
+        for proc in (uproc, gproc):
+            if proc is not None:
+                try:
+                    proc.kill()
+                except OSError:
+                    pass
+                proc.communicate()
+        timings_end(ut)
+        timings_end(gt)
+        return uql
+
+    # both read before either is parsed, which may raise
+    uout = uproc.communicate()[0]
+    timings_end(ut)
+    gout = gproc.communicate()[0]
+    timings_end(gt)
+    uqd = beegfs_ctl_parse(USRQUOTA, uout)
+    gqd = beegfs_ctl_parse(GRPQUOTA, gout)
+
     # index 0 reserved for primary user quota
-    uql.append(call_beegfs_ctl(USRQUOTA, path, uid))
+    uql.append(uqd.get(uid))
 
     # index 1 reserved for primary group quota, followed by supplementary groups
     for g in grps:
-        uql.append(call_beegfs_ctl(GRPQUOTA, path, g))
+        uql.append(gqd.get(g))
 
     return [] if ((uql[0] is None) or (uql[1] is None)) else uql
 
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Per-backend circuit breakers shared by every du.py run on a node.
+
+A breaker is closed while its backend answers.  BREAKER_FAILURES failures
+in a row, from any run on the node, open it and the backend is skipped
+without being called.  After BREAKER_COOLDOWN seconds it is half-open:
+the next run gets to call the backend, holding a lease for
+BREAKER_LEASE seconds while the others keep skipping it.  Success closes
+the breaker and failure opens it for another cooldown.
+
+Breakers live in the node state (nodestate.py) as
+    "breaker": { name: { "state": ..., "failures": n, "until": t } }
+where until is the end of the cooldown or of the half-open lease.  Any
+user can write the node state, so an until further off than a breaker
+could have set, or a negative failure count, is taken for a closed
+breaker, and failures beyond BREAKER_FAILURES count as that many.
+"""
+
+import time
+
+from nodestate import nodestate_read, nodestate_update
+
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN = 60
+BREAKER_LEASE = 15
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+class breaker_open_t(list):
+    """Empty quota list standing in for a backend skipped by its open
+       breaker, see BREAKER_OPEN"""
+
+# displayed as temporarily unavailable rather than cached or retried
+BREAKER_OPEN = breaker_open_t()
+
+def breaker_entry(state, name):
+    """returns name's breaker from state, a new closed one if it is
+       missing, malformed or forged"""
+    b = state.get("breaker")
+    if isinstance(b, dict):
+        b = b.get(name)
+    if not isinstance(b, dict) or \
+       b.get("state") not in (CLOSED, OPEN, HALF_OPEN) or \
+       not isinstance(b.get("failures"), int) or b["failures"] < 0 or \
+       not isinstance(b.get("until"), (int, long, float)) or \
+       b["until"] > time.time() + max(BREAKER_COOLDOWN, BREAKER_LEASE):
+        return { "state": CLOSED, "failures": 0, "until": 0 }
+    b["failures"] = min(b["failures"], BREAKER_FAILURES)
+    return b
+
+def breaker_store(state, name, b):
+    if not isinstance(state.get("breaker"), dict):
+        state["breaker"] = {}
+    state["breaker"][name] = b
+
+def breaker_allow(name):
+    """Returns True if backend name may be called now, which must then be
+       followed by breaker_result().  Taking a half-open breaker's lease
+       is what lets only one run at a time probe the backend."""
+    b = breaker_entry(nodestate_read(), name)
+    if b["state"] == CLOSED:
+        return True
+    if b["until"] > time.time():
+        return False
+
+    allowed = []
+    def update(state):
+        b = breaker_entry(state, name)
+        now = time.time()
+        # someone may have taken the lease or closed it since
+        if b["state"] == CLOSED or b["until"] <= now:
+            if b["state"] != CLOSED:
+                b["state"] = HALF_OPEN
+                b["until"] = now + BREAKER_LEASE
+                breaker_store(state, name, b)
+            allowed.append(True)
+    nodestate_update(update)
+    return bool(allowed)
+
+def breaker_result(name, ok):
+    """records the outcome of a call of backend name"""
+    b = breaker_entry(nodestate_read(), name)
+    # the common case, nothing to write
+    if ok and b["state"] == CLOSED and not b["failures"]:
+        return
+
+    def update(state):
+        b = breaker_entry(state, name)
+        if ok:
+            b = { "state": CLOSED, "failures": 0, "until": 0 }
+        else:
+            b["failures"] += 1
+            if b["state"] != CLOSED or b["failures"] >= BREAKER_FAILURES:
+                b["state"] = OPEN
+                b["until"] = time.time() + BREAKER_COOLDOWN
+        breaker_store(state, name, b)
+    nodestate_update(update)
+
+def breaker_call(name, func, *args):
+    """returns func(*args), recording its outcome in backend name's
+       breaker, which breaker_allow() must have allowed"""
+    try:
+        ret = func(*args)
+    except Exception:
+        breaker_result(name, False)
+        raise
+    breaker_result(name, True)
+    return ret
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Node-wide token buckets limiting how fast du.py runs query each backend.
+
+After an outage every user logs back in at once, and every login would
+otherwise hit rpc.rquotad, beegfs and the Lustre MDS at the same moment.
+Each backend's bucket holds up to burst tokens and refills at rate tokens
+per second.  A run takes a token before querying the backend.  Runs that
+can wait reserve the next token and sleep until it is due.  Runs that
+can't, du.py logins, go without and show cached or pending output.
+
+Buckets live in the node state (nodestate.py) as
+    "bucket": { name: { "tokens": n, "time": t } }
+with tokens as of time t, negative while tokens are reserved.
+"""
+
+import time
+
+from nodestate import nodestate_update
+
+class bucket_empty_t(list):
+    """Empty quota list standing in for a backend skipped for want of a
+       token, see BUCKET_EMPTY"""
+
+# displayed as pending rather than cached
+BUCKET_EMPTY = bucket_empty_t()
+
+def bucket_entry(state, name, burst, now):
+    """returns name's bucket from state as (tokens, time), a full one if it
+       is missing or malformed"""
+    b = state.get("bucket")
+    if isinstance(b, dict):
+        b = b.get(name)
+    if not isinstance(b, dict) or \
+       not isinstance(b.get("tokens"), (int, long, float)) or \
+       not isinstance(b.get("time"), (int, long, float)):
+        return (float(burst), now)
+    # anyone can write the state, keep it within what we could have written
+    return (max(-float(burst), min(float(burst), b["tokens"])),
+            min(now, b["time"]))
+
+def bucket_take(limits, queue = 0.0):
+    """Takes a token for every backend in the dictionary limits of name:
+       (rate, burst), rate None meaning unlimited.  Returns a dictionary
+       of name: 0.0 if a token was taken, the seconds until a reserved
+       token is due, at most queue, or None if there was none to take."""
+    # without the shared state to limit with, don't hold anything up
+    ret = dict.fromkeys(limits.keys(), 0.0)
+    limited = dict([ (name, l) for name, l in limits.items()
+                     if l[0] is not None ])
+    if not limited:
+        return ret
+
+    def update(state):
+        now = time.time()
+        if not isinstance(state.get("bucket"), dict):
+            state["bucket"] = {}
+        for name, (rate, burst) in limited.items():
+            tokens, t = bucket_entry(state, name, burst, now)
+            tokens = min(float(burst), tokens + (now - t) * rate)
+            wait = max(0.0, (1.0 - tokens) / rate)
+            if wait <= queue:
+                tokens -= 1.0
+                ret[name] = wait
+            else:
+                ret[name] = None
+            state["bucket"][name] = { "tokens": tokens, "time": now }
+    nodestate_update(update)
+    return ret
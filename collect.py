@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Run independent quota backend and mount probe calls concurrently, each
+with its own deadline.  A task which raises or misses its deadline is
+reported as None so the caller can display it as unavailable rather than
+waiting on it.
+
+threading is imported by collect() itself, as the namedtuples here are
+needed by du.py runs answered from the snapshot or cache without it.
+"""
+
+import collections
+import os
+import select
+import time
+
+from timings import timings_call
+
+# statvfs_t/stat_t namedtuples
+# The subset of os.statvfs()/os.stat() results used by du.py's disk_stats.
+statvfs_t = collections.namedtuple("statvfs_t",
+                                   [
+                                      "f_bsize",
+                                      "f_blocks",
+                                      "f_bavail",
+                                      "f_files",
+                                      "f_favail"
+                                   ])
+
+stat_t = collections.namedtuple("stat_t",
+                                [
+                                   "st_uid",
+                                   "st_gid"
+                                ])
+
+# task_t namedtuple
+# deadline: seconds from the start of collect() the task may take
+# func/args: called as func(*args) in its own thread
+task_t = collections.namedtuple("task_t",
+                                [
+                                   "deadline",
+                                   "func",
+                                   "args"
+                                ])
+
+def probe_mount(path):
+    """returns (statvfs_t, stat_t) for the mount point at path"""
+    svfs = timings_call("statvfs " + path, os.statvfs, path)
+    st = timings_call("stat " + path, os.stat, path)
+    return (statvfs_t(svfs.f_bsize, svfs.f_blocks, svfs.f_bavail,
+                      svfs.f_files, svfs.f_favail),
+            stat_t(st.st_uid, st.st_gid))
+
+class collect_signal(object):
+    """Completion pipe shared by a collect() call and its threads"""
+
+    def __init__(self):
+        import threading
+
+        self.rfd, self.wfd = os.pipe()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def notify(self):
+        self.lock.acquire()
+        try:
+            if not self.closed:
+                os.write(self.wfd, "x")
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.closed = True
+            os.close(self.rfd)
+            os.close(self.wfd)
+        finally:
+            self.lock.release()
+
+class collect_thread(object):
+    """Calls task.func(*task.args), stores the result and signals
+       completion, run in its own thread by collect()"""
+
+    def __init__(self, task, sig):
+        self.task = task
+        self.sig = sig
+        self.result = None
+        self.done = False
+
+    def run(self):
+        try:
+            self.result = self.task.func(*self.task.args)
+        except Exception:
+            self.result = None
+        self.done = True
+        self.sig.notify()
+
+def collect(tasks, missed = None):
+    """Starts every task_t in the tasks dictionary at once and waits until
+       each has finished or passed its deadline.  Returns a dictionary of
+       the same keys with the task results, None for tasks which raised or
+       did not finish in time.  The keys of the latter are also appended
+       to the list missed, if given."""
+    import threading
+
+    ret = {}
+    if not tasks:
+        return ret
+
+    # Completion is signalled through a pipe so waiting is a single
+    # select() instead of python 2's polling Thread.join(timeout).
+    sig = collect_signal()
+
+    start = time.time()
+    pending = {}
+    for name, task in tasks.items():
+        t = collect_thread(task, sig)
+        th = threading.Thread(target = t.run)
+        # abandoned threads must not hold up interpreter exit
+        th.daemon = True
+        th.start()
+        pending[name] = t
+
+    while pending:
+        now = time.time() - start
+        for name in pending.keys():
+            t = pending[name]
+            if t.done:
+                ret[name] = t.result
+                del pending[name]
+            elif now >= t.task.deadline:
+                ret[name] = None
+                del pending[name]
+                if missed is not None:
+                    missed.append(name)
+        if not pending:
+            break
+        wait = min([t.task.deadline for t in pending.values()]) - now
+        try:
+            if select.select([sig.rfd], [], [], max(wait, 0))[0]:
+                os.read(sig.rfd, 512)
+        except select.error:
+            pass
+
+    # late finishers see the closed flag and skip notifying
+    sig.close()
+
+    return ret
@@ -25,119 +25,88 @@ WARNING_MESSAGE    = \
 
 LUSTRE_MOUNT_POINT = "/lustre"
 GROUP_QUOTA_BINARY = "/util/opt/bin/hcc/du/lgq/lgq"
+# member quotas lgq queries at once
+GROUP_QUOTA_CONCURRENCY = 8
+# -g flushes its first GROUP_QUOTA_FIRST rows, about a screenful, then
+# writes the rest GROUP_QUOTA_CHUNK rows at a time
+GROUP_QUOTA_FIRST = 50
+GROUP_QUOTA_CHUNK = 512
+# directories du.py -w displays by blocks and by inodes, unless --top
+WALK_TOP = 10
 
 BEEGFS_MOUNT_POINT = "/common"
 
+# Collection deadlines in seconds, backends and mount probes run concurrently
+# and any which miss their deadline are displayed as unavailable.
+RQUOTA_DEADLINE    = 5.0
+LQUOTA_DEADLINE    = 5.0
+BQUOTA_DEADLINE    = 5.0
+MOUNT_DEADLINE     = 5.0
+# Mount probes run in helper processes killed after PROBE_DEADLINE, short of
+# MOUNT_DEADLINE so a hung mount is recorded for later logins to skip.
+PROBE_DEADLINE     = 4.0
+
+# Per-user quota cache, in seconds.  Login mode displays cached results up
+# to CACHE_MAX_AGE old immediately, refreshing them in the background once
+# older than CACHE_TTL.  Other modes always query and update the cache.
+CACHE_TTL          = 300
+CACHE_MAX_AGE      = 86400
+
+# Cluster-wide quota snapshot written by snapshot.py from cron, used instead
+# of querying the backends while no older than SNAPSHOT_MAX_AGE seconds.
+SNAPSHOT_PATH      = "/util/opt/bin/hcc/du/snapshot/quota.snap"
+SNAPSHOT_MAX_AGE   = 900
+
+# Node-wide query rates of each backend, (tokens per second, burst) or
+# (None, None) for no limit, see bucket.py.  Logins finding no token show
+# cached or pending output, other runs wait up to BACKEND_QUEUE seconds.
+BACKEND_RATES      = {
+    "rquota": (20.0, 40),
+    "lquota": (50.0, 100),
+    "bquota": (10.0, 20),
+}
+BACKEND_QUEUE      = 2.0
+# Logins wait a random 0 to LOGIN_JITTER seconds before querying backends,
+# spreading out a storm of logins, 0 to go at once.
+LOGIN_JITTER       = 0.0
+
+# Usage growth is shown for anything it would fill within GROWTH_HORIZON
+# seconds, for everything growing with -v, see history.py.
+GROWTH_HORIZON     = 30 * 86400
+
+# --watch polls WATCH_MIN_INTERVAL seconds apart while usage changes, and
+# WATCH_BACKOFF times further apart after each poll finding it unchanged,
+# up to WATCH_MAX_INTERVAL, see watch.py.  Never less, whatever is asked.
+WATCH_MIN_INTERVAL = 10.0
+WATCH_MAX_INTERVAL = 300.0
+WATCH_BACKOFF      = 1.5
+
+# Login mode appends a per-phase timing record to this environment
+# variable's value, "syslog" or the path of a log file, when it is set.
+TIMINGS_ENV        = "HCC_DU_TIMINGS"
+
+# Only what every run needs is imported here.  du.py -l runs in every login
+# shell and is usually answered from the snapshot or per-user cache, so
+# the backends, their probes and breakers (gather()), the caches, NSS name
+# resolution, subprocess, json and optparse are imported where used.
 import collections
+import itertools
 import sys
 import math
 import operator
-import subprocess
-from colors import color
-from os import getuid, stat, statvfs
-from rquota import USRQUOTA, GRPQUOTA, rquota_t, rquota_get, \
-                   rquota_find_home_mount
-from lquota import if_quotactl, lquota_get
-from bquota import bquota_t, bquota_get
+import time
+from render import bar_render
+from breaker import BREAKER_OPEN
+from bucket import BUCKET_EMPTY
+from snapshot import KIND_RQUOTA, KIND_LQUOTA, KIND_BQUOTA, snapshot_open
+from timings import timings_enable, timings_begin, timings_end, \
+                    timings_call, timings_record, timings_log
+from os import getuid, getgid, getgroups, read, _exit, environ
+from rquota import USRQUOTA, GRPQUOTA
+from lquota import if_quotactl, \
+                   LGQ_MAGIC, LGQ_VERSION, lgq_header, lgq_record
 from pwd import getpwuid
 from grp import getgrgid
-from optparse import OptionParser
-
-def get_bar(
-        opts,
-        txt = None,
-        used = 0,
-        total = 100,
-        length = 30,
-        order = 30,
-    ):
-    """Return a bar graphic indicating disk usage"""
-
-    # Consider no quota as positive infinity
-    if total is None:
-        total = float("inf")
-
-    try:
-        percent = 100.0 * used / total
-    except ZeroDivisionError:
-        percent = 0.0
-
-    # If percent usage is <= val, use color/style for bar background
-    colors = [
-        { 'val':           65, 'color': 'green',
-          'style': 'negative+underline' },
-        { 'val':           85, 'color': 'yellow',
-          'style': 'bold+negative+underline' },
-        { 'val': float("inf"), 'color': 'red',
-          'style': 'blink+bold+negative+underline' },
-    ]
-
-    bar_color = ''
-    bar_style = 'underline'
-    for k in colors:
-        if percent <= k['val']:
-            if opts.color == "a":
-                bar_color = k['color']
-            if opts.reverse:
-                bar_style = k['style']
-            break
-
-    # The remainder is filled with the following style
-    fill_style = ''
-    if opts.color == "a" or opts.reverse:
-        fill_style = 'underline'
-        
-    # Reduce the length to account for the two brackets on the ends
-    length = length - 2
-
-    # Num chars in bar which are marked used
-    try:
-        used_len = int(math.ceil(1.0 * length * used / total))
-    except ZeroDivisionError:
-        used_len = 0
-
-    # Space usage description
-    # Example: 10% (10 / 100GB)
-    if txt is None:
-        if order == 30:
-            bi_units = ["GB", "TB", "PB", "EB", "ZB", "YB"]
-            ui = 0
-            ti = 0
-            while used >= 1024:
-                used = used / 1024
-                ui = ui + 1
-            while total >= 1024:
-                total = total / 1024
-                ti = ti + 1
-            txt = "{percent:.1f}% ({used:g}{uu}/{total:g}{tu})".format(
-                percent = percent,
-                used = round(used, 1),
-                uu = bi_units[ui],
-                total = round(total, 1),
-                tu = bi_units[ti],
-            )
-        else:
-            txt = "{percent:.1f}% ({used:g}/{total:g})".format(
-                percent = percent,
-                used = round(used, 1),
-                total = round(total, 1),
-            )
-
-    # Pad description to bar length
-    txt = txt.ljust(length)[:length]
-
-    ret = ''
-    ret += color('[')
-    if opts.fill:
-        ret += color(txt[:used_len].replace(' ', '='),
-                     bg = bar_color, style = bar_style)
-        ret += color(txt[used_len:].replace(' ', '-'), style = fill_style)
-    else:
-        ret += color(txt[:used_len], bg = bar_color, style = bar_style)
-        ret += color(txt[used_len:],                 style = fill_style)
-    ret += color(']')
-
-    return ret
 
 def get_window_size():
     """Return window size as rows, columns"""
@@ -168,51 +137,152 @@ def equal_split(length, count):
 
     return pieces
 
+def group_lquota_read(fd):
+    """Decodes lgq's header and record stream from fd as records arrive.
+       Returns a list of if_quotactl and a list of member UIDs whose quota
+       lgq couldn't collect, None if the stream is malformed or ends
+       early."""
+    hdr = ""
+    while len(hdr) < lgq_header.size:
+        data = read(fd, lgq_header.size - len(hdr))
+        if not data:
+            return None
+        hdr += data
+    magic, version, rsize, count = lgq_header.unpack(hdr)
+    if magic != LGQ_MAGIC or version != LGQ_VERSION or \
+       rsize != lgq_record.size:
+        return None
+
+    gq = []
+    failed = []
+    buf = bytearray(count * rsize)
+    mv = memoryview(buf)
+    have = 0
+    while have < len(buf):
+        data = read(fd, min(len(buf) - have, 1 << 16))
+        if not data:
+            return None
+        mv[have:have + len(data)] = data
+        have += len(data)
+        # decode every record now complete
+        for off in range((len(gq) + len(failed)) * rsize,
+                         have - rsize + 1, rsize):
+            r = lgq_record.unpack_from(buf, off)
+            if r[2]:
+                failed.append(r[1])
+            else:
+                gq.append(if_quotactl(r[0], r[1], *r[3:]))
+    return (gq, failed)
+
 def group_lquota():
     """Calls out to suid-root binary to collect all group member UIDs' quota
-       that the calling process is a member of"""
-    proc = subprocess.Popen([ GROUP_QUOTA_BINARY ],
+       that the calling process is a member of.  Returns a list of
+       if_quotactl and a list of member UIDs whose quota isn't available."""
+    import subprocess
+    from breaker import breaker_result
+
+    t = timings_begin("lgq")
+    proc = subprocess.Popen([ GROUP_QUOTA_BINARY,
+                              "-j", str(GROUP_QUOTA_CONCURRENCY) ],
                             stdout = subprocess.PIPE)
     output = proc.stdout
-    lgq = output.read()
+    gq = group_lquota_read(output.fileno())
     output.close()
+    proc.wait()
+    timings_end(t)
 
-    if proc.wait() != 0:
+    breaker_result("lgq", proc.returncode == 0 and gq is not None)
+    if proc.returncode != 0 or gq is None:
         print "Group quota not available, please try again later."
-        sys.exit(proc.returncode)
+        sys.exit(proc.returncode or 1)
+
+    return gq
+
+# -g sort keys, most used first: (primary, tie break) if_quotactl fields
+GROUP_SORT_KEYS = {
+    "b": ("dqb_curspace", "dqb_curinodes"),
+    "i": ("dqb_curinodes", "dqb_curspace"),
+}
+
+GROUP_HEADER = "{0}{1}{2}{3}\n".format("Group ID".rjust(20, " "),
+                                       "User ID".rjust(20, " "),
+                                       "Disk Usage".rjust(16, " "),
+                                       "File Count".rjust(16, " "))
+GROUP_ROW = "{0:>20}{1:>20}{2:>13} GB{3:>16}\n"
+
+def group_quota_sort(opts, gq):
+    """returns gq sorted by opts.group's keys, most used first, only the
+       first opts.top if given"""
+    key = operator.attrgetter(*GROUP_SORT_KEYS[opts.group or "b"])
+    if opts.top is not None and opts.top < len(gq):
+        import heapq
+
+        # a partial selection, no need to order the whole group
+        return heapq.nlargest(opts.top, gq, key = key)
+    return sorted(gq, key = key, reverse = True)
+
+def group_quota_rows(gq):
+    """yields the display rows of gq's members"""
+    from nsscache import nss_resolve
+
+    # nss_resolve() loads its whole cache each call, so resolve once
+    users, groups = nss_resolve([ u.qc_id for u in gq ], [])
+    for u in gq:
+        # members without a passwd/group entry are shown by ID
+        name, gid = users.get(u.qc_id, (str(u.qc_id), ""))
+        yield GROUP_ROW.format(groups.get(gid, str(gid)), name,
+                               u.dqb_curspace / 2 ** 30, u.dqb_curinodes)
 
-    # TODO, import the data without eval
-    return eval(lgq)
-    
 def group_quota_display(opts, gq):
-    """Display group usage, sorted by blocks or inodes"""
-    if opts.group == "b":
-        sort_idx = 4
-    elif opts.group == "i":
-        sort_idx = 7
-    else:
-        sort_idx = 4
-        
-    gq = sorted(gq, key = operator.itemgetter(sort_idx), reverse = True)
-
-    print "{0}{1}{2}{3}" \
-          .format("Group ID".rjust(20, " "),
-          "User ID".rjust(20, " "),
-          "Disk Usage".rjust(16, " "),
-          "File Count".rjust(16, " "))
-    for u in gq:
-        pwe = getpwuid(u.qc_id)
-        gre = getgrgid(pwe.pw_gid)
-        print "{0}{1}{2} GB{3}" \
-              .format(gre.gr_name.rjust(20, " "),
-              pwe.pw_name.rjust(20, " "),
-              str(u.dqb_curspace / 2 ** 30).rjust(16 - len(" GB"), " "),
-              str(u.dqb_curinodes).rjust(16, " "))
+    """Display group usage, sorted by blocks or inodes, the heaviest
+       members flushed first and the rest written in buffered chunks"""
+    total = len(gq)
+    gq = group_quota_sort(opts, gq)
+    rows = group_quota_rows(gq)
+
+    out = sys.stdout
+    out.write(GROUP_HEADER)
+    out.write("".join(itertools.islice(rows, GROUP_QUOTA_FIRST)))
+    out.flush()
+    while True:
+        chunk = "".join(itertools.islice(rows, GROUP_QUOTA_CHUNK))
+        if not chunk:
+            break
+        out.write(chunk)
+    if total > len(gq):
+        out.write("{0} more members not shown\n".format(total - len(gq)))
+
+def main_walk(opts):
+    """display the directories under opts.walk using the most blocks and
+       inodes, returning 1 if it can't be walked"""
+    from walk import walk
+
+    try:
+        timings_call("walk", walk, opts.walk, opts.top or WALK_TOP,
+                     opts.cache)
+    except OSError, e:
+        print >>sys.stderr, "du.py: {0}: {1}".format(opts.walk, e.strerror)
+        return 1
+    return 0
+
+def main_watch(opts):
+    """du.py --watch, see watch.py"""
+    from watch import watch
+
+    return watch(opts)
 
 def main_group(opts):
     """display sorted group member disk usage"""
-    gq = group_lquota()
-    group_quota_display(opts, gq)
+    from breaker import breaker_allow
+
+    if not breaker_allow("lgq"):
+        print "Group quota temporarily unavailable, please try again later."
+        sys.exit(1)
+    gq, failed = group_lquota()
+    timings_call("render", group_quota_display, opts, gq)
+    if failed:
+        print "Quota not available for UID(s): {0}" \
+              .format(", ".join([str(u) for u in sorted(failed)]))
     try:
         sys.stdout.close()
     except:
@@ -251,6 +321,16 @@ def disk_stats(type, ts, pwe, gre, quota, svfs, stat):
     # inodes/files hard limit
     ih = 0
 
+    # backend or mount probe missed its deadline
+    if svfs is None:
+        return (ts + " unavailable", ds_t(bc, bh, ic, ih))
+    if quota is BREAKER_OPEN and type >= USRQUOTA:
+        return (ts + " temporarily unavailable", ds_t(bc, bh, ic, ih))
+    if quota is BUCKET_EMPTY and type >= USRQUOTA:
+        return (ts + " pending", ds_t(bc, bh, ic, ih))
+    if quota is None and type >= USRQUOTA:
+        return (ts + " unavailable", ds_t(bc, bh, ic, ih))
+
     # blocks
     used = svfs.f_bsize * (svfs.f_blocks - svfs.f_bavail)
     size = svfs.f_bsize *  svfs.f_blocks / (2 ** 10)
@@ -307,7 +387,7 @@ def disk_stats(type, ts, pwe, gre, quota, svfs, stat):
     # quota info for supplementary group
     elif type > GRPQUOTA:
         # Do we have quota data?
-        if len(quota):
+        if len(quota) > type and quota[type] is not None:
             # Calling supplementary group's used space
             bc = quota[type].dqb_curspace
             ic = quota[type].dqb_curinodes
@@ -416,50 +496,33 @@ MCG  = 0x0c0000
 MCF  = 0x300000
 MCA  = 0xff0000
 
+# Warning percentages (blocks, inodes) by the type qcheck() is given, any
+# type above GRPQUOTA being a supplementary group and below USRQUOTA the
+# file system, and the flags of the home, work and common block warnings,
+# each inode warning being the next bit up.
+QCHECK_TABLE = {
+    USRQUOTA: (WP_UB, WP_UI, (WHUB, WWUB, WCUB)),
+    GRPQUOTA: (WP_GB, WP_GI, (WHGB, WWGB, WCGB)),
+    -1:       (WP_FB, WP_FI, (WHFB, WWFB, WCFB)),
+}
+
+def qcheck_flags(ds, wp_b, wp_i, flag):
+    """flag if ds' block usage is over wp_b, flag << 1 if its inode usage
+       is over wp_i, or both"""
+    ret = 0
+    if ds.bh and 1.0 * ds.bc / (ds.bh * (2 ** 10)) > wp_b:
+        ret |= flag
+    if ds.ih and 1.0 * ds.ic / ds.ih > wp_i:
+        ret |= flag << 1
+    return ret
+
 def qcheck(type, hds, wds, cds):
     """Check the state of the calling users quota and return a number"""
-    ret = 0
     # check the WP_ or "warning percentages"
-    if type == USRQUOTA:
-        if hds.bh and 1.0 * hds.bc / (hds.bh * (2 ** 10)) > WP_UB:
-            ret |= WHUB
-        if hds.ih and 1.0 * hds.ic / hds.ih > WP_UI:
-            ret |= WHUI
-        if wds.bh and 1.0 * wds.bc / (wds.bh * (2 ** 10)) > WP_UB:
-            ret |= WWUB
-        if wds.ih and 1.0 * wds.ic / wds.ih > WP_UI:
-            ret |= WWUI
-        if cds.bh and 1.0 * cds.bc / (cds.bh * (2 ** 10)) > WP_UB:
-            ret |= WCUB
-        if cds.ih and 1.0 * cds.ic / cds.ih > WP_UI:
-            ret |= WCUI
-    elif type >= GRPQUOTA:
-        if hds.bh and 1.0 * hds.bc / (hds.bh * (2 ** 10)) > WP_GB:
-            ret |= WHGB
-        if hds.ih and 1.0 * hds.ic / hds.ih > WP_GI:
-            ret |= WHGI
-        if wds.bh and 1.0 * wds.bc / (wds.bh * (2 ** 10)) > WP_GB:
-            ret |= WWGB
-        if wds.ih and 1.0 * wds.ic / wds.ih > WP_GI:
-            ret |= WWGI
-        if cds.bh and 1.0 * cds.bc / (cds.bh * (2 ** 10)) > WP_GB:
-            ret |= WCGB
-        if cds.ih and 1.0 * cds.ic / cds.ih > WP_GI:
-            ret |= WCGI
-    else:
-        if hds.bh and 1.0 * hds.bc / (hds.bh * (2 ** 10)) > WP_FB:
-            ret |= WHFB
-        if hds.ih and 1.0 * hds.ic / hds.ih > WP_FI:
-            ret |= WHFI
-        if wds.bh and 1.0 * wds.bc / (wds.bh * (2 ** 10)) > WP_FB:
-            ret |= WWFB
-        if wds.ih and 1.0 * wds.ic / wds.ih > WP_FI:
-            ret |= WWFI
-        if cds.bh and 1.0 * cds.bc / (cds.bh * (2 ** 10)) > WP_FB:
-            ret |= WCFB
-        if cds.ih and 1.0 * cds.ic / cds.ih > WP_FI:
-            ret |= WCFI
-    return ret
+    wp_b, wp_i, flags = QCHECK_TABLE[max(-1, min(type, GRPQUOTA))]
+    return qcheck_flags(hds, wp_b, wp_i, flags[0]) | \
+           qcheck_flags(wds, wp_b, wp_i, flags[1]) | \
+           qcheck_flags(cds, wp_b, wp_i, flags[2])
 
 def display_usage(rows, columns,
                   type, pwe, gre,
@@ -491,99 +554,150 @@ def display_usage(rows, columns,
 
     return qcheck(type, hds, wds, cds), (hds, wds, cds), (ts, tn), (ht, wt, ct)
 
-def display_default(rows, columns,
+def display_growth(opts, names, usage, width, fresh):
+    """Returns the lines of growth rates and time to full of usage, a list
+       of (label, type, id, ds_t per mount, bars per mount), each label
+       padded to width.  Records the usage in the history if it was freshly
+       collected."""
+    from history import HISTORY_FS, history_update
+
+    # the entire filesystem's type is -1 here, the history's are unsigned
+    usage = [ (label, HISTORY_FS if qtype < 0 else qtype, id, ds, bars)
+              for label, qtype, id, ds, bars in usage ]
+    samples = {}
+    for label, qtype, id, ds, bars in usage:
+        for m in range(len(names)):
+            # nothing to record of usage not shown or without a limit
+            if bars[m][0] is None and ds[m].bh:
+                samples[(m, qtype, id)] = ds[m]
+    growth = history_update(samples, fresh)
+
+    out = []
+    for label, qtype, id, ds, bars in usage:
+        for m in range(len(names)):
+            g = growth.get((m, qtype, id))
+            if g is None:
+                continue
+            full = min([ (t, what) for t, what in ((g.bfull, "blocks"),
+                                                   (g.ifull, "inodes"))
+                         if t is not None ] or [ (None, None) ])
+            if full[0] is None or full[0] > GROWTH_HORIZON:
+                if not opts.verbose or (g.brate <= 0 and g.irate <= 0):
+                    continue
+            line = "{0:<{width}.{width}}  {1:<8}{2:>+10.1f} GB/day" \
+                   "{3:>+12.0f} files/day".format(label, names[m],
+                                                  g.brate * 86400 / 2 ** 30,
+                                                  g.irate * 86400,
+                                                  width = width)
+            if full[0] is not None:
+                if full[0] < 86400:
+                    line += ", {0} full within a day".format(full[1])
+                else:
+                    line += ", {0} full in ~{1:.0f} days" \
+                            .format(full[1], full[0] / 86400)
+            out.append(line + "\n")
+    return out
+
+def display_lines(opts, rows, columns,
+                  pwe, gre,
+                  hquota, hsvfs, hstat,
+                  wquota, wsvfs, wstat,
+                  cquota, csvfs, cstat):
+    """Returns (label, type, id, display_usage() result) of each bar line,
+       the primary user and group, supplementary groups with opts.sup and
+       the entire filesystem"""
+    stats = (hquota, hsvfs, hstat,
+             wquota, wsvfs, wstat,
+             cquota, csvfs, cstat)
+
+    lines = list()
+    u = display_usage(rows, columns, USRQUOTA, pwe, gre, *stats)
+    lines.append(("{0}{1}".format(*u[2]), USRQUOTA, pwe.pw_uid, u))
+    g = display_usage(rows, columns, GRPQUOTA, pwe, gre, *stats)
+    lines.append(("{0}{1}".format(*g[2]), GRPQUOTA, pwe.pw_gid, g))
+    if opts.sup:
+        from nsscache import nss_resolve, group_t
+
+        sup = (wquota or [])[2:]
+        groups = nss_resolve([], [ q.qc_id for q in sup ])[1]
+        for i, q in enumerate(sup):
+            sgre = group_t(groups.get(q.qc_id, str(q.qc_id)), q.qc_id)
+            s = display_usage(rows, columns, 2 + i, pwe, sgre, *stats)
+            lines.append(("{0}{1}".format(*s[2]), GRPQUOTA, q.qc_id, s))
+    f = display_usage(rows, columns, -1, pwe, gre, *stats)
+    lines.append(("{0}{1}".format(*f[2]), -1, 0, f))
+    return lines
+
+# column names of home, work and common
+DISPLAY_MOUNTS = [ "/home", "/work", "/common" ]
+
+def display_header(names, wm, p3cw):
+    """returns the line naming the mounts names over bars p3cw wide, after
+       labels wm wide"""
+    out = [ " {0:^{width}.{width}} ".format("", width = wm) ]
+    for l in range(0, len(names)):
+        out.append('[{0: ^{width}.{width}}]'.format(names[l],
+                                                   width = p3cw[l] - 2))
+    out.append("\n")
+    return "".join(out)
+
+def display_default(opts, rows, columns,
                     pwe, gre,
                     hquota, hsvfs, hstat,
                     wquota, wsvfs, wstat,
-                    cquota, csvfs, cstat):
-    """display primary user, primary group and global filesystem stats"""
-
-    uret, ut, upt, ubs, = display_usage(rows, columns,
-                                        USRQUOTA, pwe, gre,
-                                        hquota, hsvfs, hstat,
-                                        wquota, wsvfs, wstat,
-                                        cquota, csvfs, cstat)
-    gret, gt, gpt, gbs = display_usage(rows, columns,
-                                       GRPQUOTA, pwe, gre,
-                                       hquota, hsvfs, hstat,
-                                       wquota, wsvfs, wstat,
-                                       cquota, csvfs, cstat)
-    fret, ft, fpt, fbs = display_usage(rows, columns,
-                                       -1      , pwe, gre,
-                                       hquota, hsvfs, hstat,
-                                       wquota, wsvfs, wstat,
-                                       cquota, csvfs, cstat)
-
-    whom = list()
-    whom.append("{0}{1}".format(upt[0], upt[1]))
-    whom.append("{0}{1}".format(gpt[0], gpt[1]))
-    if opts.sup:
-        sup = list()
-        i = 2
-        for g in wquota[2:]:
-            gre = getgrgid(g.qc_id)
-            sret, st, spt, sbs = display_usage(rows, columns,
-                                               i, pwe, gre,
-                                               hquota, hsvfs, hstat,
-                                               wquota, wsvfs, wstat,
-                                               cquota, csvfs, cstat)
-            sup.append((sret, st, spt, sbs))
-            whom.append("{0}{1}".format(spt[0], spt[1]))
-            i += 1
-
-    whom.append("{0}{1}".format(fpt[0], fpt[1]))
+                    cquota, csvfs, cstat, fresh = False):
+    """display primary user, primary group and global filesystem stats,
+       with their growth, recorded if fresh"""
+
+    lines = display_lines(opts, rows, columns,
+                          pwe, gre,
+                          hquota, hsvfs, hstat,
+                          wquota, wsvfs, wstat,
+                          cquota, csvfs, cstat)
+    whom = [ l[0] for l in lines ]
 
     wm = len(max(whom, key=len))
 
     # Column widths for home, work and common
     p3cw = equal_split(columns - wm - 2, 3)
 
-    # print usage line
-    pu = " {0:^{width}.{width}} ".format("", width = wm)
-
-    n = [ "/home", "/work", "/common"]
+    # the whole frame is built here and written at once
+    out = []
+    br = bar_render(opts)
 
-    for l in range(0, len(n)):
-        pu += '[{0: ^{width}.{width}}]'.format(n[l], width = p3cw[l] - 2)
-    print pu
+    # usage line
+    n = DISPLAY_MOUNTS
+    out.append(display_header(n, wm, p3cw))
 
-    pu = "{0:-<{width}.{width}}>".format(whom[0], width = wm + 1)
-    pu += get_bar(opts, *ubs[0], length = p3cw[0] )
-    pu += get_bar(opts, *ubs[1], length = p3cw[1] )
-    pu += get_bar(opts, *ubs[2], length = p3cw[2] )
-    print pu
+    for label, type, id, (ret, ds, pt, bars) in lines:
+        out.append("{0:-<{width}.{width}}>".format(label, width = wm + 1))
+        br.bar(out, *bars[0], length = p3cw[0])
+        br.bar(out, *bars[1], length = p3cw[1])
+        br.bar(out, *bars[2], length = p3cw[2])
+        out.append("\n")
 
-    pu = "{0:-<{width}.{width}}>".format(whom[1], width = wm + 1)
-    pu += get_bar(opts, *gbs[0], length = p3cw[0] )
-    pu += get_bar(opts, *gbs[1], length = p3cw[1] )
-    pu += get_bar(opts, *gbs[2], length = p3cw[2] )
-    print pu
-
-    if opts.sup:
-        for l in range(0, len(wquota[2:])):
-            pu = "{0:-<{width}.{width}}>".format(whom[2 + l], width = wm + 1)
-            pu += get_bar(opts, *sup[l][3][0], length = p3cw[0] )
-            pu += get_bar(opts, *sup[l][3][1], length = p3cw[1] )
-            pu += get_bar(opts, *sup[l][3][2], length = p3cw[2] )
-            print pu
-
-    pu = "{0:-<{width}.{width}}>".format(whom[-1], width = wm + 1)
-    pu += get_bar(opts, *fbs[0], length = p3cw[0] )
-    pu += get_bar(opts, *fbs[1], length = p3cw[1] )
-    pu += get_bar(opts, *fbs[2], length = p3cw[2] )
-    print pu
+    # label, type, id, ds_t and bars per mount of each bar line
+    usage = [ (label, type, id, ds, bars)
+              for label, type, id, (ret, ds, pt, bars) in lines ]
+    out += timings_call("growth", display_growth, opts, n, usage, wm + 1,
+                        fresh)
 
     if opts.verbose:
         key = "key: (U)ser, (G)roup, {0}(E)ntire system" \
               .format("(S)upplementary group, " if opts.sup else "");
-        print "{0:{width}.{width}}".format(key, width = columns)
+        out.append("{0:{width}.{width}}\n".format(key, width = columns))
+
+    sys.stdout.write("".join(out))
 
-    return (uret | gret | fret, [ut, gt, ft])
+    u, g, f = [ lines[i][3] for i in (0, 1, -1) ]
+    return (u[0] | g[0] | f[0], [ u[1], g[1], f[1] ])
 
 def work_scold(rows, columns, pwe, gre, reason):
     """Make it clear that blocks or inodes should be freed on work.
        Returns a number for whichever group quota is over, 0 for none,
        1 for block, 2 for inode or 3 for both."""
+    from colors import color
+
     rc = 0
     if reason[0] & (MWU | MWG):
         print "\nTwo quotas exist on /work, block (used space) and inode " \
@@ -615,6 +729,8 @@ def work_scold(rows, columns, pwe, gre, reason):
                                                       100.0 *
                                                       reason[1][0][1].ic /
                                                       reason[1][1][1].ic)
+        print "  Run \"du.py -w DIR\" to find the directories under DIR " \
+              "using the most."
 
     if reason[0] & MWF:
         if reason[0] & (WWFB):
@@ -622,68 +738,358 @@ def work_scold(rows, columns, pwe, gre, reason):
 
     return rc
 
+def home_probe(home, shared = None):
+    """statvfs and stat info for the mount holding the calling user's home,
+       probed once per list shared, see probe_home()"""
+    from probe import probe_home
+
+    return timings_call("home mount", probe_home, home, PROBE_DEADLINE,
+                        shared)[1:]
+
+def home_rquota(home, query_supplementary, source = None, shared = None):
+    """RPC/remote quota info for the mount holding the calling user's home"""
+    from probe import probe_home
+    from rquota import rquota_get
+
+    path = timings_call("home mount", probe_home, home, PROBE_DEADLINE,
+                        shared)[0]
+    return backend("rquota", rquota_get, path, query_supplementary, source)
+
+def backend(name, func, path, query_supplementary, source = None):
+    """returns func(path, query_supplementary) as the timed phase name,
+       asking the node's du agent first, and records the outcome in
+       backend name's circuit breaker"""
+    from breaker import breaker_call
+
+    return timings_call(name, breaker_call, name, agent_backend,
+                        name, func, path, query_supplementary, source)
+
+def agent_backend(name, func, path, query_supplementary, source = None):
+    """backend name's quota list for the calling user from the node's du
+       agent, or func(path, query_supplementary) if it can't answer.
+       source answers instead if given, called with the same arguments,
+       see duapi.py."""
+    from duagent import agent_query
+
+    if source is not None:
+        return source(name, func, path, query_supplementary)
+
+    # place primary GID at the start of the list
+    gid = getgid()
+    if query_supplementary:
+        grps = sorted(set(getgroups()) - set([ gid ]))
+    else:
+        grps = list()
+
+    ql = agent_query(name, path, [ gid ] + grps)
+    if ql is None:
+        return func(path, query_supplementary)
+    return ql
+
+def after(delay, func, *args):
+    """returns func(*args) once delay seconds have passed"""
+    time.sleep(delay)
+    return func(*args)
+
+def gather(pwe, query_supplementary, shed = False, source = None):
+    """get statvfs and stat info on mount points along with RPC/remote,
+       lustre and beegfs quota info, all at once.  Backends without a
+       token are skipped if shed, waited for otherwise.  Quotas are asked
+       of source instead of the du agent if given, see agent_backend()."""
+    from collect import task_t, collect
+    from probe import probe_mount, probe_hung
+    from breaker import breaker_allow, breaker_result
+    from bucket import bucket_take
+    from lquota import lquota_get
+    from bquota import bquota_get
+
+    # the home mount is probed afresh by every gather(), once
+    home = []
+    tasks = {
+        "hmount": task_t(MOUNT_DEADLINE, home_probe, (pwe.pw_dir, home)),
+        "wmount": task_t(MOUNT_DEADLINE, timings_call,
+                         ("probe " + LUSTRE_MOUNT_POINT, probe_mount,
+                          LUSTRE_MOUNT_POINT, PROBE_DEADLINE)),
+        "cmount": task_t(MOUNT_DEADLINE, timings_call,
+                         ("probe " + BEEGFS_MOUNT_POINT, probe_mount,
+                          BEEGFS_MOUNT_POINT, PROBE_DEADLINE)),
+        "hquota": task_t(RQUOTA_DEADLINE, home_rquota,
+                         (pwe.pw_dir, query_supplementary, source, home)),
+        "wquota": task_t(LQUOTA_DEADLINE, backend,
+                         ("lquota", lquota_get,
+                          LUSTRE_MOUNT_POINT, query_supplementary, source)),
+        "cquota": task_t(BQUOTA_DEADLINE, backend,
+                         ("bquota", bquota_get,
+                          BEEGFS_MOUNT_POINT, query_supplementary, source)),
+    }
+    breakers = { "hquota": "rquota", "wquota": "lquota", "cquota": "bquota" }
+
+    # backends on a mount recently found hung would only hang the same way
+    ret = dict.fromkeys(tasks.keys())
+    if probe_hung(LUSTRE_MOUNT_POINT):
+        del tasks["wquota"]
+    if probe_hung(BEEGFS_MOUNT_POINT):
+        del tasks["cquota"]
+    # and ones which keep failing are left alone for a while
+    for key, name in breakers.items():
+        if key in tasks and not breaker_allow(name):
+            del tasks[key]
+            ret[key] = BREAKER_OPEN
+
+    # spread out a storm of logins, then take a token for each backend
+    if shed and LOGIN_JITTER > 0:
+        import random
+
+        time.sleep(random.uniform(0, LOGIN_JITTER))
+    limits = dict([ (name, BACKEND_RATES.get(name, (None, None)))
+                    for key, name in breakers.items() if key in tasks ])
+    waits = bucket_take(limits, 0.0 if shed else BACKEND_QUEUE)
+    for key, name in breakers.items():
+        if key not in tasks:
+            continue
+        if waits[name] is None:
+            del tasks[key]
+            ret[key] = BUCKET_EMPTY
+        elif waits[name] > 0:
+            t = tasks[key]
+            tasks[key] = task_t(t.deadline, after,
+                                (waits[name], t.func) + tuple(t.args))
+
+    missed = []
+    ret.update(collect(tasks, missed))
+    # A backend past its deadline has failed as far as this run goes.  If
+    # it finishes later it records its own outcome too.
+    for key in missed:
+        if key in breakers:
+            breaker_result(breakers[key], False)
+    return ret
+
+def gather_stats(c):
+    """returns the quota, statvfs and stat info of home, work and common in
+       the gather() shaped results c, as display_default() takes them"""
+    ret = []
+    for key in ("h", "w", "c"):
+        svfs, stat = c[key + "mount"] or (None, None)
+        ret += [ c[key + "quota"], svfs, stat ]
+    return ret
+
+def snapshot_gather(pwe, query_supplementary, gids = None, created = None):
+    """gather() shaped results for the calling user, or pwe and gids, the
+       primary GID first, from the cluster-wide snapshot, or None if it is
+       missing, too old or lacks the user.  Appends the snapshot's creation
+       time to the list created, if given, when returning results."""
+    snap = snapshot_open(SNAPSHOT_PATH)
+    if snap is None:
+        return None
+
+    try:
+        if time.time() - snap.created > SNAPSHOT_MAX_AGE:
+            return None
+
+        hm = snap.mount_of(pwe.pw_dir, KIND_RQUOTA)
+        wm = snap.mount(LUSTRE_MOUNT_POINT)
+        cm = snap.mount(BEEGFS_MOUNT_POINT)
+        if hm is None or wm is None or cm is None:
+            return None
+
+        if gids is not None:
+            gid, grps = gids[0], list(gids[1:])
+        # place primary GID at the start of the list
+        else:
+            gid = getgid()
+            if query_supplementary:
+                grps = sorted(set(getgroups()) - set([gid]))
+            else:
+                grps = list()
+
+        ret = {
+            "hmount": (hm.svfs, hm.stat),
+            "wmount": (wm.svfs, wm.stat),
+            "cmount": (cm.svfs, cm.stat),
+            "hquota": snap.get(hm, pwe.pw_uid, gid, grps),
+            "wquota": snap.get(wm, pwe.pw_uid, gid, grps),
+            "cquota": snap.get(cm, pwe.pw_uid, gid, grps),
+        }
+        if None in (ret["hquota"], ret["wquota"], ret["cquota"]):
+            return None
+        if created is not None:
+            created.append(snap.created)
+        return ret
+    finally:
+        snap.close()
+
 def main_default(opts):
     """HCC Disk Usage default output"""
 
     rows, columns = get_window_size()
 
     # get pwd/grp entries for calling user
-    pwe = getpwuid(getuid())
-    gre = getgrgid(pwe.pw_gid)
-
-    # find the filesystem that contains calling user's pw_dir
-    home_mount = rquota_find_home_mount()
+    pwe = timings_call("getpwuid", getpwuid, getuid())
+    gre = timings_call("getgrgid", getgrgid, pwe.pw_gid)
+
+    c = None
+    cached = None
+    # usage shown from the per-user cache isn't recorded in the history
+    fresh = True
+    # when the usage was collected, if not just now
+    created = []
+    if opts.cache:
+        c = timings_call("snapshot", snapshot_gather, pwe, opts.sup, None,
+                         created)
+    if c is None and opts.login and opts.cache:
+        from qcache import qcache_read, qcache_write, qcache_detach
+
+        cached = timings_call("qcache", qcache_read, opts.sup)
+        if cached is not None and cached[0] <= CACHE_MAX_AGE:
+            c = cached[1]
+            fresh = False
+            created.append(time.time() - cached[0])
+            if cached[0] > CACHE_TTL and qcache_detach():
+                try:
+                    qcache_write(gather(pwe, opts.sup), opts.sup)
+                finally:
+                    _exit(0)
+    if c is None:
+        c = gather(pwe, opts.sup, opts.login)
+        if opts.cache:
+            from qcache import qcache_write
+
+            qcache_write(c, opts.sup)
+        # backends shed for want of a token are shown from the cache,
+        # however old, if it has them
+        if cached is not None:
+            for key in ("hquota", "wquota", "cquota"):
+                if c[key] is BUCKET_EMPTY:
+                    c[key] = cached[1][key]
+                    fresh = False
+                    created = [ time.time() - cached[0] ]
+
+    # data for other programs, the bar graph isn't rendered at all
+    if opts.format == "json":
+        from duapi import query_gids, usage_report, report_json
+
+        # snapshot usage is recorded in the history, but isn't current
+        report = usage_report(pwe, gre, query_gids(pwe, opts.sup), c,
+                              fresh and not created,
+                              created[0] if created else None)
+        sys.stdout.write(report_json(report) + "\n")
+        return 0
+
+    hsvfs, hstat = c["hmount"] or (None, None)
+    wsvfs, wstat = c["wmount"] or (None, None)
+    csvfs, cstat = c["cmount"] or (None, None)
+
+    hquota = c["hquota"]
+    wquota = c["wquota"]
+    cquota = c["cquota"]
+
+    ret = timings_call("render", display_default, opts, rows, columns,
+                       pwe, gre,
+                       hquota, hsvfs, hstat,
+                       wquota, wsvfs, wstat,
+                       cquota, csvfs, cstat, fresh)
 
-    # get statvfs and stat info on mount points
-    hsvfs = statvfs(home_mount)
-    wsvfs = statvfs(LUSTRE_MOUNT_POINT)
-    csvfs = statvfs(BEEGFS_MOUNT_POINT)
+    if opts.login and ret[0]:
+        return timings_call("render scold", work_scold,
+                            rows, columns, pwe, gre, ret)
 
-    hstat = stat(home_mount)
-    wstat = stat(LUSTRE_MOUNT_POINT)
-    cstat = stat(BEEGFS_MOUNT_POINT)
+    return 0
 
-    # get RPC/remote and lustre quota info
-    hquota = rquota_get(home_mount, opts.sup)
-    wquota = lquota_get(LUSTRE_MOUNT_POINT, opts.sup)
-    cquota = bquota_get(BEEGFS_MOUNT_POINT, opts.sup)
+def run(opts):
+    """runs du.py with parsed options, returning its exit status"""
 
+    # nothing to style when the output isn't going to a terminal
+    if opts.color is None:
+        opts.color = "a" if sys.stdout.isatty() else "n"
 
-    ret = display_default(rows, columns,
-                          pwe, gre,
-                          hquota, hsvfs, hstat,
-                          wquota, wsvfs, wstat,
-                          cquota, csvfs, cstat)
+    tlog = environ.get(TIMINGS_ENV) if opts.login else None
+    if opts.timings or tlog:
+        timings_enable()
 
-    if opts.login and ret[0]:
-        return work_scold(rows, columns, pwe, gre, ret)
+    rc = 0
+    try:
+        if opts.group:
+            main_group(opts)
+        elif opts.walk:
+            rc = main_walk(opts)
+        elif opts.watch:
+            rc = main_watch(opts)
+        else:
+            rc = main_default(opts)
+    finally:
+        if opts.timings or tlog:
+            record = timings_record("group" if opts.group else
+                                    "walk" if opts.walk else
+                                    "watch" if opts.watch else
+                                    "login" if opts.login else "default")
+            if opts.timings:
+                import json
+
+                json.dump(record, sys.stderr, sort_keys = True)
+                sys.stderr.write("\n")
+            if tlog:
+                timings_log(tlog, record)
+    return rc
 
-    return 0
+def main(args = None):
+    """parses du.py's command line, args defaulting to sys.argv[1:]"""
+    from optparse import OptionParser
 
-if __name__ == "__main__":
     parser = OptionParser()
     parser.add_option("-c", "--color", action = "store", 
-                      metavar = "[a|n]", choices = ["a", "n"], default = "a",
+                      metavar = "[a|n]", choices = ["a", "n"],
                       help = "utilized bar graph has colored background "
-                      "'a'/always or 'n'/never, default 'a'")
+                      "'a'/always or 'n'/never, default 'a' on a terminal "
+                      "and 'n' otherwise")
     parser.add_option("-f", "--fill", action = "store_true", default = False,
                       help = "bar graph is filled with the following " \
                              "characters: '='/utilized '-'/available")
+    parser.add_option("--format", action = "store", type = "choice",
+                      metavar = "[text|json]", choices = ["text", "json"],
+                      default = "text",
+                      help = "display usage as 'text'/bar graphs or write "
+                      "it as a 'json' object, see duapi.py, default 'text'")
     parser.add_option("-g", "--group", action = "store", type = "choice",
                       metavar = "[b|i]", choices = ["b", "i"],
                       help = "display all member user quotas from your "
                       "group(s) sorted by 'b'/blocks used or 'i'/files used")
+    parser.add_option("--top", action = "store", type = "int", metavar = "N",
+                      help = "with -g, display only the N members using the "
+                      "most, with -w, the N directories using the most "
+                      "instead of {0}".format(WALK_TOP))
     parser.add_option("-l", "--login", action = "store_true", default = False,
                       help = "use with system login profile")
+    parser.add_option("--no-cache", action = "store_false", dest = "cache",
+                      default = True,
+                      help = "query every backend directly, bypassing the "
+                      "quota snapshot and per-user cache")
     parser.add_option("-r", "--reverse", action = "store_true", default = False,
                       help = "utilized bar graph is reverse video")
     parser.add_option("-s", "--sup", action = "store_true", default = False,
                       help = "display supplementary group usage")
+    parser.add_option("--timings", action = "store_true", default = False,
+                      help = "write per-phase timings as JSON to stderr")
     parser.add_option("-v", "--verbose", action = "store_true", default = False,
                       help = "be more verbose, includes header key definitions")
-    (opts, args) = parser.parse_args()
+    parser.add_option("-w", "--walk", action = "store", metavar = "DIR",
+                      help = "walk DIR and display the directories using the "
+                      "most blocks and inodes, rerunning faster on an "
+                      "unchanged tree")
+    parser.add_option("--watch", action = "store_true", default = False,
+                      help = "keep the display up to date until interrupted, "
+                      "polling every {0:g}s while usage changes and less "
+                      "often while it doesn't".format(WATCH_MIN_INTERVAL))
+    (opts, args) = parser.parse_args(args)
+    if opts.top is not None and opts.top < 1:
+        parser.error("--top must be at least 1")
+    if opts.format != "text" and (opts.group or opts.walk):
+        parser.error("--format only applies to the default display")
+    if opts.watch:
+        if opts.group or opts.walk or opts.login or opts.format != "text":
+            parser.error("--watch only applies to the default display")
+        if not sys.stdout.isatty():
+            parser.error("--watch needs a terminal")
+    return run(opts)
 
-    if opts.group:
-        main_group(opts)
-    else:
-        sys.exit(main_default(opts))
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Node-local du agent, answering du.py's quota queries over a Unix socket.
+
+When a job array or a login storm starts many du.py runs on one node,
+each would otherwise ask rpc.rquotad, the Lustre MDS and beegfs for the
+same IDs.  The agent runs as root and keeps the Lustre directory open for
+lquota_ioctl() and its rpc.rquotad connections up.  Identical queries
+that arrive while one is in flight wait for its answer instead of making
+their own.
+
+    duagent.py [-s socket] [-l /lustre] [-b /common]
+
+Listens on AGENT_SOCKET, or on the socket passed by systemd socket
+activation, after creating du.py's node state (see nodestate.py).  A
+client sends one JSON request line and reads one JSON reply:
+    { "version": 1, "backend": "rquota"|"lquota"|"bquota",
+      "path": mount, "gids": [ primary gid, supplementary gids... ] }
+    { "version": 1, "quota": [ record fields or null, ... ] }
+    { "version": 1, "error": message }
+    { "version": 1, "unsupported": true }
+The UID queried is the client's, from SO_PEERCRED, and every GID must be
+one of the client's, so the root agent can't be used to query or load
+the backends on another user's behalf.  This isn't a privacy guarantee:
+quota data is public on these clusters, see snapshot.py.  du.py queries
+the backends itself when there is no agent or it can't answer.
+"""
+
+import errno
+import os
+import socket
+import struct
+import sys
+import threading
+
+from rquota import rquota_t, rquota_mount_device, rquota_split_device, \
+                   rquota_get_export
+from lquota import if_quotactl, lquota_get_user
+from bquota import bquota_t, bquota_get_user
+
+AGENT_VERSION = 1
+AGENT_SOCKET = "/run/hcc-du/agent.sock"
+
+# seconds a client waits for an answer, short of du.py's backend deadlines
+AGENT_TIMEOUT = 4.0
+# seconds the agent waits for a client's request
+AGENT_REQUEST_TIMEOUT = 1.0
+AGENT_MAX_REQUEST = 1 << 16
+AGENT_MAX_GIDS = 1024
+# clients served at once, further ones wait in the listen backlog and
+# query the backends themselves once AGENT_TIMEOUT passes
+AGENT_MAX_CLIENTS = 64
+
+# quota record type of each backend
+AGENT_BACKENDS = {
+    "rquota": rquota_t,
+    "lquota": if_quotactl,
+    "bquota": bquota_t,
+}
+
+# struct ucred
+SO_PEERCRED = getattr(socket, "SO_PEERCRED", 17)
+ucred = struct.Struct("=iII")
+
+# systemd socket activation, sd_listen_fds(3)
+SD_LISTEN_FDS_START = 3
+
+class agent_error(Exception):
+    """The agent answered, but its backend query failed"""
+
+def agent_query(backend, path, gids):
+    """Returns the quota list of backend on path for the calling user and
+       gids from the node's du agent, None if there is no agent or it
+       can't answer.  Raises agent_error if the backend query failed."""
+    # most nodes won't run one, skip importing json
+    if not os.path.exists(AGENT_SOCKET):
+        return None
+    import json
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(AGENT_TIMEOUT)
+    try:
+        try:
+            s.connect(AGENT_SOCKET)
+            # only trust an agent run by root or ourselves
+            pid, uid, gid = ucred.unpack(
+                s.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, ucred.size))
+            if uid not in (0, os.getuid()):
+                return None
+            s.sendall(json.dumps({ "version": AGENT_VERSION,
+                                   "backend": backend,
+                                   "path": path,
+                                   "gids": gids }) + "\n")
+            reply = []
+            while True:
+                data = s.recv(1 << 16)
+                if not data:
+                    break
+                reply.append(data)
+        except socket.error:
+            return None
+    finally:
+        s.close()
+
+    try:
+        d = json.loads("".join(reply))
+        if d["version"] != AGENT_VERSION or d.get("unsupported"):
+            return None
+        if "error" in d:
+            raise agent_error(d["error"])
+        qtype = AGENT_BACKENDS[backend]
+        return [ None if q is None else qtype(*q) for q in d["quota"] ]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def agent_peer_groups(pid, uid):
+    """returns the set of GIDs of process pid, if it is still run by uid"""
+    ret = set()
+    try:
+        f = open("/proc/{0}/status".format(pid))
+        try:
+            status = dict([ l.split(":", 1) for l in f if ":" in l ])
+        finally:
+            f.close()
+        # the pid may have been reused by someone else
+        if int(status["Uid"].split()[0]) != uid:
+            return ret
+        ret.update([ int(g) for g in status["Groups"].split() ])
+        ret.add(int(status["Gid"].split()[0]))
+    except (IOError, KeyError, ValueError):
+        pass
+    return ret
+
+class agent_flight(object):
+    """One backend query, shared by every identical request made while it
+       runs"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class du_agent(object):
+    """Answers quota queries for clients, coalescing identical ones"""
+
+    def __init__(self, lustre = None, beegfs = None):
+        self.lock = threading.Lock()
+        # (backend, path, uid, gids): agent_flight
+        self.flights = {}
+
+        self.lustre = lustre
+        self.lfd = None
+        if lustre:
+            self.lfd = os.open(lustre, os.O_RDONLY | os.O_NONBLOCK |
+                                       os.O_DIRECTORY)
+        self.beegfs = beegfs
+
+        # rpc.rquotad connections, one call at a time per host
+        self.clients = {}
+        self.rlocks = {}
+
+    def close(self):
+        """closes the Lustre directory and rpc.rquotad connections"""
+        if self.lfd is not None:
+            os.close(self.lfd)
+            self.lfd = None
+        for c in self.clients.values():
+            # None marks a host known not to serve a version
+            if c is not None:
+                c.close()
+        self.clients.clear()
+
+    def coalesce(self, key, func, *args):
+        """returns func(*args), or the result of the identical call key
+           already in flight"""
+        self.lock.acquire()
+        try:
+            f = self.flights.get(key)
+            leader = f is None
+            if leader:
+                f = self.flights[key] = agent_flight()
+        finally:
+            self.lock.release()
+
+        if leader:
+            try:
+                f.result = func(*args)
+            except Exception, e:
+                f.error = e
+            self.lock.acquire()
+            try:
+                del self.flights[key]
+            finally:
+                self.lock.release()
+            f.done.set()
+        # a leader stuck in its backend can't hold everyone up for good
+        elif not f.done.wait(AGENT_TIMEOUT):
+            raise agent_error("timed out waiting for the backend")
+
+        if f.error is not None:
+            raise f.error
+        return f.result
+
+    def rquota(self, path, uid, gids):
+        device = rquota_mount_device(path)
+        if device is None or ":" not in device:
+            return None
+        host, export = rquota_split_device(device)
+
+        # rpc_client isn't safe to share between threads, and clients are
+        # kept per host, so is the lock
+        self.lock.acquire()
+        try:
+            rlock = self.rlocks.setdefault(host, threading.Lock())
+        finally:
+            self.lock.release()
+        rlock.acquire()
+        try:
+            return rquota_get_export(host, export, uid, gids, self.clients)
+        finally:
+            rlock.release()
+
+    def query(self, backend, path, uid, gids):
+        """returns backend's quota list on path for uid and gids, None if
+           the agent doesn't serve it"""
+        if backend == "rquota":
+            func = self.rquota
+        elif backend == "lquota" and self.lfd is not None and \
+             path == self.lustre:
+            func = lambda path, uid, gids: \
+                   lquota_get_user(self.lfd, uid, gids)
+        elif backend == "bquota" and self.beegfs and path == self.beegfs:
+            func = bquota_get_user
+        else:
+            return None
+        return self.coalesce((backend, path, uid, tuple(gids)),
+                             func, path, uid, gids)
+
+    def serve(self, conn):
+        """answers one client connection"""
+        import json
+
+        try:
+            conn.settimeout(AGENT_REQUEST_TIMEOUT)
+            pid, uid, gid = ucred.unpack(
+                conn.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, ucred.size))
+
+            request = ""
+            while "\n" not in request and len(request) < AGENT_MAX_REQUEST:
+                data = conn.recv(AGENT_MAX_REQUEST)
+                if not data:
+                    break
+                request += data
+
+            reply = { "version": AGENT_VERSION }
+            try:
+                d = json.loads(request)
+                backend = str(d["backend"])
+                path = str(d["path"])
+                gids = [ int(g) for g in d["gids"] ]
+                if d["version"] != AGENT_VERSION or not gids or \
+                   len(gids) > AGENT_MAX_GIDS:
+                    raise ValueError
+            except (ValueError, KeyError, TypeError):
+                reply["unsupported"] = True
+                gids = None
+
+            if gids is not None:
+                if not set(gids) <= agent_peer_groups(pid, uid):
+                    reply["error"] = "not a group of the caller"
+                else:
+                    try:
+                        ql = self.query(backend, path, uid, gids)
+                        if ql is None:
+                            reply["unsupported"] = True
+                        else:
+                            reply["quota"] = [ None if q is None
+                                               else list(q) for q in ql ]
+                    except Exception, e:
+                        reply["error"] = str(e) or e.__class__.__name__
+
+            conn.settimeout(AGENT_TIMEOUT)
+            conn.sendall(json.dumps(reply) + "\n")
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def run(self, sock):
+        """accepts clients on the listening socket sock forever, each
+           answered in its own thread, AGENT_MAX_CLIENTS at a time"""
+        slots = threading.Semaphore(AGENT_MAX_CLIENTS)
+
+        def serve(conn):
+            try:
+                self.serve(conn)
+            finally:
+                slots.release()
+
+        while True:
+            slots.acquire()
+            try:
+                conn, addr = sock.accept()
+            except socket.error, e:
+                slots.release()
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            t = threading.Thread(target = serve, args = (conn,))
+            t.daemon = True
+            t.start()
+
+def agent_listen(path):
+    """returns the listening socket passed by systemd, or one bound to
+       path and open to every user"""
+    if os.environ.get("LISTEN_PID") == str(os.getpid()) and \
+       os.environ.get("LISTEN_FDS") == "1":
+        return socket.fromfd(SD_LISTEN_FDS_START,
+                             socket.AF_UNIX, socket.SOCK_STREAM)
+
+    dir = os.path.dirname(path)
+    if dir and not os.path.isdir(dir):
+        os.makedirs(dir, 0755)
+    try:
+        os.unlink(path)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    # clients are told apart by their credentials, not the socket mode
+    os.chmod(path, 0666)
+    sock.listen(128)
+    return sock
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    from nodestate import nodestate_create
+
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("-s", "--socket", action = "store",
+                      default = AGENT_SOCKET,
+                      help = "Unix socket to listen on, unless passed by "
+                      "systemd, default " + AGENT_SOCKET)
+    parser.add_option("-l", "--lustre", action = "store", default = "/lustre",
+                      help = "lustre mount point, '' to skip, "
+                      "default /lustre")
+    parser.add_option("-b", "--beegfs", action = "store", default = "/common",
+                      help = "beegfs mount point, '' to skip, "
+                      "default /common")
+    (opts, args) = parser.parse_args()
+
+    try:
+        # the agent starts at boot, as root, set up du.py's node state
+        nodestate_create()
+    except OSError, e:
+        print >>sys.stderr, "duagent.py: {0}".format(e)
+    try:
+        agent = du_agent(opts.lustre, opts.beegfs)
+        sock = agent_listen(opts.socket)
+    except (OSError, socket.error), e:
+        print >>sys.stderr, "duagent.py: {0}".format(e)
+        sys.exit(1)
+    try:
+        agent.run(sock)
+    except KeyboardInterrupt:
+        pass
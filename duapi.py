@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+In-process query API of du.py, for the portal, MOTD generator, job submit
+filter and anything else wanting a user's usage as data rather than as
+du.py's bar graph.
+
+    import duapi
+
+    report = duapi.query()
+
+    session = duapi.du_session()
+    try:
+        for user in users:
+            report = session.query(user, True)
+    finally:
+        session.close()
+
+Usage is collected as du.py collects it, from the cluster-wide snapshot
+or by gather() with its deadlines, circuit breakers and rate limits, and
+judged by the same disk_stats() and qcheck().  Each report_t holds a
+usage_t for every user, group, supplementary group and filesystem on
+home, work and common, in bytes and inodes.  Usage that couldn't be
+collected or isn't tracked has a status instead, as du.py would display
+in its place.  Nothing is written to stdout and nothing exits.
+
+A du_session answers its backend queries in-process through a du_agent
+(see duagent.py), keeping the Lustre directory open and rpc.rquotad
+connections up from one query to the next.  Run as root, it can query
+any user.
+"""
+
+import collections
+import os
+import time
+from grp import getgrall, getgrgid
+from pwd import getpwnam, getpwuid
+
+import du
+from rquota import USRQUOTA, GRPQUOTA
+
+API_VERSION = 1
+
+# mount names in du.py's column order
+API_MOUNTS = [ "home", "work", "common" ]
+
+# usage_t namedtuple
+# One entity's usage of one mount.  type is "user", "group",
+# "supplementary" or "filesystem" and id 0 for the filesystem.  Limits are
+# the ones the entity would run into first, the filesystem's size if it
+# has no quota.  status is None, or why there is no usage, e.g.
+# "unavailable", in which case the numbers are 0.  The warnings are set
+# once usage is over du.py's warning percentages of the limits.
+usage_t = collections.namedtuple("usage_t",
+                                 [
+                                     "mount",
+                                     "path",
+                                     "type",
+                                     "name",
+                                     "id",
+                                     "used_bytes",
+                                     "limit_bytes",
+                                     "used_inodes",
+                                     "limit_inodes",
+                                     "status",
+                                     "warn_blocks",
+                                     "warn_inodes"
+                                 ])
+
+# report_t namedtuple
+# A user's usage, as of time, when it was collected.  fresh is False if
+# it was read from the snapshot or du.py's per-user cache.  flags are
+# qcheck()'s warning bits for every usage, du.py's WHUB through WCFI.
+report_t = collections.namedtuple("report_t",
+                                  [
+                                      "user",
+                                      "uid",
+                                      "group",
+                                      "gid",
+                                      "time",
+                                      "fresh",
+                                      "flags",
+                                      "usage"
+                                  ])
+
+def query_gids(pwe, query_supplementary):
+    """returns the GIDs pwe's quotas are queried for, primary first.  Those
+       of the calling process for the calling user, otherwise pwe's primary
+       group and, if asked for, every group listing pwe as a member."""
+    if pwe.pw_uid == os.getuid():
+        gid = os.getgid()
+        grps = set(os.getgroups()) if query_supplementary else set()
+    else:
+        gid = pwe.pw_gid
+        grps = set()
+        if query_supplementary:
+            grps = set([ g.gr_gid for g in getgrall()
+                         if pwe.pw_name in g.gr_mem ])
+    return [ gid ] + sorted(grps - set([ gid ]))
+
+def usage_report(pwe, gre, gids, c, fresh = True, collected = None):
+    """Returns the report_t of pwe, whose primary group is gre, from the
+       gather() shaped results c of querying gids, collected at that time,
+       just now by default"""
+    from nsscache import nss_resolve, group_t
+
+    paths = [ pwe.pw_dir, du.LUSTRE_MOUNT_POINT, du.BEEGFS_MOUNT_POINT ]
+    args = du.gather_stats(c)
+
+    # type passed to get_stats(), type name and group entry of each entity
+    entities = [ (USRQUOTA, "user", gre), (GRPQUOTA, "group", gre) ]
+    if len(gids) > 1:
+        names = nss_resolve([], gids[1:])[1]
+        entities += [ (GRPQUOTA + 1 + i, "supplementary",
+                       group_t(names.get(g, str(g)), g))
+                      for i, g in enumerate(gids[1:]) ]
+    entities.append((-1, "filesystem", gre))
+
+    flags = 0
+    usage = []
+    for type, tname, g in entities:
+        stats = du.get_stats(None, None, type, pwe, g, *args)
+        ts = stats[0]
+        f = du.qcheck(type, *stats[3::2])
+        flags |= f
+        wflags = du.QCHECK_TABLE[max(-1, min(type, GRPQUOTA))][2]
+        if type == USRQUOTA:
+            name, id = pwe.pw_name, pwe.pw_uid
+        elif type == -1:
+            name, id = "", 0
+        else:
+            name, id = g.gr_name, g.gr_gid
+        for m in range(len(API_MOUNTS)):
+            txt, ds = stats[2 + 2 * m:4 + 2 * m]
+            # without disk_stats()' "U: " style prefix
+            if txt is not None and txt.startswith(ts + " "):
+                txt = txt[len(ts) + 1:]
+            usage.append(usage_t(API_MOUNTS[m], paths[m], tname, name, id,
+                                 ds.bc, ds.bh << 10, ds.ic, ds.ih, txt,
+                                 bool(f & wflags[m]),
+                                 bool(f & (wflags[m] << 1))))
+
+    if collected is None:
+        collected = time.time()
+    return report_t(pwe.pw_name, pwe.pw_uid, gre.gr_name, gre.gr_gid,
+                    collected, fresh, flags, usage)
+
+def report_json(report):
+    """returns report as a JSON object"""
+    import json
+
+    d = collections.OrderedDict([ ("version", API_VERSION) ])
+    d.update(report._asdict())
+    d["usage"] = [ u._asdict() for u in report.usage ]
+    return json.dumps(d)
+
+class du_session(object):
+    """Answers repeated usage queries, keeping backend resources open
+       between them"""
+
+    def __init__(self, use_snapshot = True):
+        from duagent import du_agent
+
+        self.use_snapshot = use_snapshot
+        try:
+            self.agent = du_agent(du.LUSTRE_MOUNT_POINT,
+                                  du.BEEGFS_MOUNT_POINT)
+        except OSError:
+            # no Lustre here, its usage is reported unavailable
+            self.agent = du_agent(None, du.BEEGFS_MOUNT_POINT)
+
+    def close(self):
+        """releases the session's backend resources"""
+        self.agent.close()
+
+    def backend(self, pwe, gids, name, func, path, query_supplementary):
+        """backend name's quota list on path for pwe and gids, asked of the
+           session's agent, or func(path, query_supplementary) for the
+           calling user if it can't answer"""
+        ql = None
+        # a hung home mount has no path
+        if type(path) is str:
+            ql = self.agent.query(name, path, pwe.pw_uid, gids)
+        if ql is None and pwe.pw_uid == os.getuid():
+            return func(path, query_supplementary)
+        return ql
+
+    def collect(self, pwe, gids, query_supplementary = False, created = None):
+        """returns gather() shaped results for pwe and gids, from the
+           snapshot if the session uses it and it has them, appending its
+           creation time to the list created if given"""
+        import functools
+
+        c = None
+        if self.use_snapshot:
+            c = du.snapshot_gather(pwe, query_supplementary, gids, created)
+        if c is None:
+            c = du.gather(pwe, query_supplementary, False,
+                          functools.partial(self.backend, pwe, gids))
+        return c
+
+    def query(self, user = None, query_supplementary = False):
+        """Returns the report_t of user, a name or UID, the calling user by
+           default.  Raises KeyError if there is no such user."""
+        if user is None:
+            pwe = getpwuid(os.getuid())
+        elif isinstance(user, (int, long)):
+            pwe = getpwuid(user)
+        else:
+            pwe = getpwnam(user)
+        try:
+            gre = getgrgid(pwe.pw_gid)
+        except KeyError:
+            from nsscache import group_t
+
+            gre = group_t(str(pwe.pw_gid), pwe.pw_gid)
+        gids = query_gids(pwe, query_supplementary)
+        created = []
+        c = self.collect(pwe, gids, query_supplementary, created)
+        return usage_report(pwe, gre, gids, c, not created,
+                            created[0] if created else None)
+
+def query(user = None, query_supplementary = False, use_snapshot = True):
+    """Returns the report_t of user, a name or UID, the calling user by
+       default, from a session of its own"""
+    session = du_session(use_snapshot)
+    try:
+        return session.query(user, query_supplementary)
+    finally:
+        session.close()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+du.py's login shell entry point, "dulogin.py [-s] [-r] [-f] [-v] [-c a|n]
+[--no-cache] [--timings]" being "du.py -l ...".
+
+Runs in every interactive login, so it parses the options a login profile
+passes by hand instead of importing optparse, and du.py imports the
+backends only if its snapshot and per-user cache can't answer.  Anything
+else is handed to du.py's own option parser.  mkpyz.py bundles it, with
+du.py and precompiled bytecode, into a zipapp run with python -S.
+"""
+
+import sys
+
+import du
+
+# option: (attribute, value) of the flags a login profile may pass
+LOGIN_FLAGS = {
+    "-f":         ("fill", True),
+    "--fill":     ("fill", True),
+    "-r":         ("reverse", True),
+    "--reverse":  ("reverse", True),
+    "-s":         ("sup", True),
+    "--sup":      ("sup", True),
+    "-v":         ("verbose", True),
+    "--verbose":  ("verbose", True),
+    "--no-cache": ("cache", False),
+    "--timings":  ("timings", True),
+}
+
+LOGIN_COLORS = [ "a", "n" ]
+
+class login_options(object):
+    """du.py's parsed options, defaulting as its option parser does with -l"""
+    color = None
+    fill = False
+    format = "text"
+    group = None
+    login = True
+    cache = True
+    reverse = False
+    sup = False
+    timings = False
+    top = None
+    verbose = False
+    walk = None
+    watch = False
+
+def login_parse(args):
+    """returns login_options for args, None if they are not a login's"""
+    opts = login_options()
+    args = list(args)
+    while args:
+        a = args.pop(0)
+        if a in LOGIN_FLAGS:
+            setattr(opts, *LOGIN_FLAGS[a])
+        elif a in ("-c", "--color") and args and args[0] in LOGIN_COLORS:
+            opts.color = args.pop(0)
+        elif a[:2] == "-c" and a[2:] in LOGIN_COLORS:
+            opts.color = a[2:]
+        elif a[:8] == "--color=" and a[8:] in LOGIN_COLORS:
+            opts.color = a[8:]
+        elif a in ("-l", "--login"):
+            pass
+        else:
+            return None
+    return opts
+
+def main(args = None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = login_parse(args)
+    if opts is None:
+        return du.main([ "-l" ] + args)
+    return du.run(opts)
+
+if __name__ == "__main__":
+    sys.exit(main())
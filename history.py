@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Per-user usage history, from which du.py estimates how fast usage grows
+and when it will reach its hard limit.
+
+du.py appends a sample of every usage it displays, at most one per
+(mount, type, id) every HISTORY_INTERVAL seconds, to a fixed size ring
+of records in HISTORY_FILE, on local disk so it outlives the session:
+    header      hist_header
+    records     hist_record * header.capacity
+Record number header.next % capacity is written next, so an append is a
+single record write and the file never grows.  The whole file is read
+through mmap as columns of 64-bit words, like qscan.py reads a snapshot,
+and the growth of every entity is fitted in one pass over them.
+
+Only samples of freshly collected usage are appended, never ones shown
+from du.py's per-user cache.
+"""
+
+import array
+import collections
+import errno
+import fcntl
+import mmap
+import operator
+import os
+import stat
+import struct
+import sys
+import time
+
+HISTORY_DIR = "/var/tmp/hcc-du-{0}"
+HISTORY_FILE = "hcc-du.hist"
+HISTORY_MAGIC = "HCCDUHST"
+HISTORY_VERSION = 1
+# 8192 records of 48 bytes, a few weeks of hourly samples of every usage
+HISTORY_RECORDS = 8192
+HISTORY_INTERVAL = 3600
+# growth is fitted over the last HISTORY_WINDOW seconds of samples, and
+# only once they span HISTORY_MIN_SPAN
+HISTORY_WINDOW = 7 * 86400
+HISTORY_MIN_SPAN = 6 * 3600
+HISTORY_MIN_SAMPLES = 3
+
+# type of the entire filesystem's usage, next to USRQUOTA and GRPQUOTA
+HISTORY_FS = 2
+
+# magic, version, record size, capacity, next, padded to 64 bytes
+hist_header = struct.Struct("<8sHHIQ40x")
+# key (mount | type << 16 | id << 32), time, bc, bh, ic, ih as in ds_t
+hist_record = struct.Struct("<6Q")
+
+# growth_t namedtuple
+# Fitted growth in bytes and inodes per second, and seconds until the
+# block and inode hard limits are reached at that rate, None if never.
+growth_t = collections.namedtuple("growth_t",
+                                  [
+                                      "brate",
+                                      "irate",
+                                      "bfull",
+                                      "ifull"
+                                  ])
+
+def history_key(mount, qtype, id):
+    """returns the record key word of id's usage of type qtype on mount"""
+    return mount | (qtype << 16) | (id << 32)
+
+def history_dir():
+    """returns the calling user's history directory, creating it if
+       needed, or None if it is unsafe to use"""
+    path = HISTORY_DIR.format(os.getuid())
+    try:
+        os.mkdir(path, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            return None
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    # /var/tmp is shared, as in qcache.qcache_dir()
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+       st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return None
+    return path
+
+def history_valid(fd, size):
+    """returns whether fd holds a history of the current layout"""
+    if os.fstat(fd).st_size != size:
+        return False
+    os.lseek(fd, 0, os.SEEK_SET)
+    return hist_header.unpack(os.read(fd, hist_header.size))[:4] == \
+           (HISTORY_MAGIC, HISTORY_VERSION, hist_record.size, HISTORY_RECORDS)
+
+def history_open():
+    """returns (fd, mmap) of the calling user's history, created or reset
+       if missing or of another layout, or None"""
+    dir = history_dir()
+    if dir is None:
+        return None
+    size = hist_header.size + HISTORY_RECORDS * hist_record.size
+    try:
+        fd = os.open(os.path.join(dir, HISTORY_FILE),
+                     os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0600)
+    except OSError:
+        return None
+    try:
+        if not history_valid(fd, size):
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # another du.py may have set it up while we waited
+            if not history_valid(fd, size):
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, hist_header.pack(HISTORY_MAGIC, HISTORY_VERSION,
+                                              hist_record.size,
+                                              HISTORY_RECORDS, 0))
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        return (fd, mmap.mmap(fd, size))
+    except (OSError, IOError, mmap.error, struct.error):
+        os.close(fd)
+        return None
+
+def history_columns(map):
+    """returns the number of records ever appended to the history map and
+       the (key, time, bc, bh, ic, ih) columns of those still in it"""
+    next = hist_header.unpack_from(map, 0)[4]
+    count = min(next, HISTORY_RECORDS)
+    data = map[hist_header.size:hist_header.size + count * hist_record.size]
+    words = array.array("L")
+    if words.itemsize != 8 or sys.byteorder != "little":
+        recs = [ hist_record.unpack_from(data, off)
+                 for off in xrange(0, len(data), hist_record.size) ]
+        return (next, [ [ r[i] for r in recs ] for i in range(6) ])
+    words.fromstring(data)
+    return (next, [ words[i::6] for i in range(6) ])
+
+def history_recent(times, next, since):
+    """returns the row numbers of records newer than since, oldest first,
+       found by bisection as records are appended in time order"""
+    n = len(times)
+    # the oldest record, once the ring has wrapped around
+    first = next % n if next > n else 0
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi) / 2
+        if times[(first + mid) % n] > since:
+            hi = mid
+        else:
+            lo = mid + 1
+    return [ (first + j) % n for j in xrange(lo, n) ]
+
+def history_fit(t, *ys):
+    """returns the least squares slopes over t of each column in ys"""
+    tm = float(sum(t)) / len(t)
+    dt = [ a - tm for a in t ]
+    d = sum(map(operator.mul, dt, dt))
+    if not d:
+        return [ 0.0 ] * len(ys)
+    # sum((t - tm) * (y - ym)) is sum((t - tm) * y), as sum(t - tm) is 0
+    return [ sum(map(operator.mul, dt, y)) / d for y in ys ]
+
+def history_growth(cols, rows, now):
+    """returns the growth_t of the samples in rows of the columns cols, None
+       if there aren't enough"""
+    keys, times, bc, bh, ic, ih = cols
+    if len(rows) < HISTORY_MIN_SAMPLES:
+        return None
+    t = [ times[i] for i in rows ]
+    if max(t) - min(t) < HISTORY_MIN_SPAN:
+        return None
+
+    brate, irate = history_fit(t, [ bc[i] for i in rows ],
+                               [ ic[i] for i in rows ])
+    # limits as of the latest sample
+    last = rows[t.index(max(t))]
+    bfull = ifull = None
+    if brate > 0 and bh[last]:
+        bfull = max(0.0, ((bh[last] << 10) - bc[last]) / brate -
+                         (now - times[last]))
+    if irate > 0 and ih[last]:
+        ifull = max(0.0, (ih[last] - ic[last]) / irate - (now - times[last]))
+    return growth_t(brate, irate, bfull, ifull)
+
+def history_update(samples, append = True):
+    """Takes a dictionary of (mount, type, id): ds_t of current usage.
+       Appends those last sampled over HISTORY_INTERVAL ago if append is
+       set.  Returns a dictionary of (mount, type, id): growth_t for those
+       with enough history."""
+    h = history_open()
+    if h is None:
+        return {}
+    fd, map = h
+    ret = {}
+    try:
+        now = int(time.time())
+        next, cols = history_columns(map)
+        wanted = dict([ (history_key(*k), k) for k in samples ])
+        # the recent row numbers of each sampled key, in one pass
+        rows = dict([ (k, []) for k in wanted ])
+        keys, times = cols[:2]
+        for i in history_recent(times, next, now - HISTORY_WINDOW):
+            if keys[i] in rows:
+                rows[keys[i]].append(i)
+
+        new = []
+        for k, key in wanted.items():
+            ds = tuple([ int(v) for v in samples[key] ])
+            if not rows[k] or \
+               max([ times[i] for i in rows[k] ]) <= now - HISTORY_INTERVAL:
+                new.append(hist_record.pack(k, now, *ds))
+            # fresh usage counts toward the fit, appended or not
+            if append:
+                n = len(cols[0])
+                for c, v in zip(cols, (k, now) + ds):
+                    c.append(v)
+                rows[k].append(n)
+            g = history_growth(cols, rows[k], now)
+            if g is not None:
+                ret[key] = g
+
+        # another du.py appending now can go first, don't wait on it
+        if append and new:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                new = []
+        if append and new:
+            # as of now that we hold the lock
+            next = hist_header.unpack_from(map, 0)[4]
+            for r in new:
+                off = hist_header.size + \
+                      (next % HISTORY_RECORDS) * hist_record.size
+                map[off:off + hist_record.size] = r
+                next += 1
+            # records first, so a reader never counts one not yet written
+            hist_header.pack_into(map, 0, HISTORY_MAGIC, HISTORY_VERSION,
+                                  hist_record.size, HISTORY_RECORDS, next)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        map.close()
+        os.close(fd)
+    return ret
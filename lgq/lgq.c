@@ -4,8 +4,11 @@
  *
  *  2013-03-03 Josh Samuelson
  *
- *  Outputs a python parsable data structure containing all the UIDs that
- *  are members of the calling process group(s).
+ *  Outputs a binary record stream containing the quota of all the UIDs
+ *  that are members of the calling process group(s): a struct lgq_header
+ *  followed by header.count struct lgq_record, in host byte order.  Each
+ *  record is written as soon as its quota is known so the reader can
+ *  start before lgq finishes.
  *
  *  How to build:
  *
@@ -23,13 +26,31 @@
  *  make
  *
  *  Must be SUID-root to function: chown root.root lgq ; chmod 4511 lgq
+ *
+ *  Usage: lgq [-j concurrency]
+ *
+ *  Member quotas are queried by up to "concurrency" threads at a time,
+ *  default LGQ_CONCURRENCY, at most MAX_CONCURRENCY.  A member whose quota
+ *  can't be queried is still reported, with the errno in its record.
+ *
+ *  Group members are the explicit members of each of the calling process
+ *  groups plus every user whose primary group it is.  The latter come
+ *  from PRIMARY_GID_INDEX, written by snapshot.py from cron, falling back
+ *  to a single pass over the passwd database when it isn't available.
+ *
+ *  "make lgq-test" builds a version without Lustre which takes the GIDs
+ *  from its arguments after any options and reports every member with an
+ *  empty quota, for exercising member enumeration, see bench/lgq_scale.sh.
  */
 
 #define _GNU_SOURCE
 #include <dirent.h>
 #include <errno.h>
 #include <fcntl.h>
+#include <grp.h>
+#include <pthread.h>
 #include <pwd.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
@@ -39,10 +60,14 @@
 #include <sys/types.h>
 #include <asm/ioctl.h>
 
+#ifdef LGQ_TEST
+#include "lgq_test.h"
+#else
 #define LUSTRE_UTILS
 #include <lustre_ioctl.h>
 
 #include "source_code.h"
+#endif
 
 #ifndef USRQUOTA
 #define USRQUOTA 0
@@ -51,14 +76,41 @@
 #define GRPQUOTA 1
 #endif  
 
-#define MAX_GROUP_MEMBERS 100
 struct grp_mbrs
 {
-    struct if_quotactl qctl[MAX_GROUP_MEMBERS];
-    unsigned int count;
+    struct if_quotactl *qctl;
+    unsigned int count,
+                 size;
 };
 
-#define MAX_SUPPLEMENTARY_GROUPS 20
+#ifndef PRIMARY_GID_INDEX
+#define PRIMARY_GID_INDEX "/util/opt/bin/hcc/du/snapshot/primary_gid"
+#endif
+
+#define LGQ_MAGIC "LGQ"
+#define LGQ_VERSION 2
+
+/* must match lgq_header and lgq_record in lquota.py */
+struct lgq_header
+{
+    char magic[4];
+    uint16_t version;
+    uint16_t record_size;
+    uint32_t count;
+} __attribute__((packed));
+
+struct lgq_record
+{
+    uint32_t qc_type;
+    uint32_t qc_id;
+    int32_t qc_errno;
+    uint64_t dqb_bhardlimit;
+    uint64_t dqb_bsoftlimit;
+    uint64_t dqb_curspace;
+    uint64_t dqb_ihardlimit;
+    uint64_t dqb_isoftlimit;
+    uint64_t dqb_curinodes;
+} __attribute__((packed));
 
 struct res_uid
 {
@@ -67,7 +119,29 @@ struct res_uid
           suid;
 };
 
+#ifndef LUSTRE_MOUNT_POINT
 #define LUSTRE_MOUNT_POINT "/lustre"
+#endif
+
+#define LGQ_CONCURRENCY 8
+#define MAX_CONCURRENCY 64
+
+#ifdef LGQ_TEST
+/* test build: every member has an empty quota */
+#define quotactl_ioctl(fd, qctl) 0
+#else
+#define quotactl_ioctl(fd, qctl) ioctl(fd, OBD_IOC_QUOTACTL, qctl)
+#endif
+
+/* shared by lquota() worker threads */
+struct lquota_work
+{
+    int fd;
+    struct grp_mbrs *gm;
+    unsigned int next,
+                 failed;
+    pthread_mutex_t lock;
+};
 
 #ifdef DEBUG
 void
@@ -79,7 +153,7 @@ uid_state(const char *func)
     {
         return;
     }
-    printf("%s: r:%u e:%u s:%u\n", func, u.ruid, u.euid, u.suid);
+    fprintf(stderr, "%s: r:%u e:%u s:%u\n", func, u.ruid, u.euid, u.suid);
 }
 #else
 void
@@ -89,14 +163,87 @@ uid_state(const char *func)
 }
 #endif
 
+void
+p_header(unsigned int count)
+{
+    struct lgq_header h;
+
+    memset(&h, 0, sizeof(h));
+    memcpy(h.magic, LGQ_MAGIC, sizeof(LGQ_MAGIC));
+    h.version = LGQ_VERSION;
+    h.record_size = sizeof(struct lgq_record);
+    h.count = count;
+
+    fwrite(&h, sizeof(h), 1, stdout);
+    fflush(stdout);
+}
+
+void
+p_if_quotactl(struct if_quotactl *qctl,
+              int err)
+{
+    struct lgq_record r;
+
+    r.qc_type = qctl->qc_type;
+    r.qc_id = qctl->qc_id;
+    r.qc_errno = err;
+    r.dqb_bhardlimit = qctl->qc_dqblk.dqb_bhardlimit;
+    r.dqb_bsoftlimit = qctl->qc_dqblk.dqb_bsoftlimit;
+    r.dqb_curspace = qctl->qc_dqblk.dqb_curspace;
+    r.dqb_ihardlimit = qctl->qc_dqblk.dqb_ihardlimit;
+    r.dqb_isoftlimit = qctl->qc_dqblk.dqb_isoftlimit;
+    r.dqb_curinodes = qctl->qc_dqblk.dqb_curinodes;
+
+    fwrite(&r, sizeof(r), 1, stdout);
+    fflush(stdout);
+}
+
+void *
+lquota_worker(void *arg)
+{
+    struct lquota_work *w = arg;
+    struct if_quotactl *qctl;
+    unsigned int idx;
+    int err;
+
+    for (;;)
+    {
+        pthread_mutex_lock(&w->lock);
+        idx = w->next++;
+        pthread_mutex_unlock(&w->lock);
+
+        if (idx >= w->gm->count)
+        {
+            break;
+        }
+
+        qctl = &w->gm->qctl[idx];
+        err = quotactl_ioctl(w->fd, qctl) < 0 ? errno : 0;
+
+        /* records go out whole and as soon as they're known */
+        pthread_mutex_lock(&w->lock);
+        if (err)
+        {
+            w->failed++;
+        }
+        p_if_quotactl(qctl, err);
+        pthread_mutex_unlock(&w->lock);
+    }
+
+    return NULL;
+}
+
 int
 lquota(char *lmnt,
        struct grp_mbrs *gm,
-       struct res_uid *u)
+       struct res_uid *u,
+       unsigned int concurrency)
 {
-    int fd,
-        rc = -1;
-    unsigned int idx;
+    int rc = -1;
+    unsigned int idx,
+                 nthr = 0;
+    pthread_t thr[MAX_CONCURRENCY];
+    struct lquota_work w;
     DIR *dp;
 
     dp = opendir(lmnt);
@@ -105,8 +252,20 @@ lquota(char *lmnt,
         return -1;
     }
 
-    fd = dirfd(dp);
+    memset(&w, 0, sizeof(w));
+    w.fd = dirfd(dp);
+    w.gm = gm;
+    pthread_mutex_init(&w.lock, NULL);
+
+    if (concurrency > gm->count)
+    {
+        concurrency = gm->count;
+    }
 
+    /*
+     * glibc applies setresuid() to every thread of the process, but threads
+     * are only started after and joined before the switch regardless.
+     */
     uid_state(__FUNCTION__);
     if (setresuid(-1, u->suid, -1) < 0)
     {
@@ -115,13 +274,26 @@ lquota(char *lmnt,
     }
     uid_state(__FUNCTION__);
 
-    for (idx = 0; idx < gm->count; idx++)
+    for (idx = 0; idx < concurrency; idx++)
     {
-        rc = ioctl(fd, OBD_IOC_QUOTACTL, &gm->qctl[idx]);
-        if (rc < 0)
-            continue;
+        if (pthread_create(&thr[nthr], NULL, lquota_worker, &w) == 0)
+        {
+            nthr++;
+        }
+    }
+    /* no threads to be had, do the work here */
+    if (!nthr)
+    {
+        lquota_worker(&w);
+    }
+    for (idx = 0; idx < nthr; idx++)
+    {
+        pthread_join(thr[idx], NULL);
     }
 
+    /* only fail outright if no member's quota could be had */
+    rc = (gm->count && w.failed == gm->count) ? -1 : 0;
+
     uid_state(__FUNCTION__);
     if (setresuid(-1, u->ruid, u->ruid) < 0)
     {
@@ -131,101 +303,299 @@ lquota(char *lmnt,
 
 out:
 
+    pthread_mutex_destroy(&w.lock);
     closedir(dp);
 
     return rc;
 }
 
-void
-p_if_quotactl(struct if_quotactl *qctl)
+int
+gm_add(struct grp_mbrs *gm,
+       uid_t uid)
 {
-    printf("if_quotactl(qc_type=%u,qc_id=%u,dqb_bhardlimit=%llu,"
-           "dqb_bsoftlimit=%llu,dqb_curspace=%llu,dqb_ihardlimit=%llu,"
-           "dqb_isoftlimit=%llu,dqb_curinodes=%llu)",
-           qctl->qc_type,
-           qctl->qc_id,
-           qctl->qc_dqblk.dqb_bhardlimit,
-           qctl->qc_dqblk.dqb_bsoftlimit,
-           qctl->qc_dqblk.dqb_curspace,
-           qctl->qc_dqblk.dqb_ihardlimit,
-           qctl->qc_dqblk.dqb_isoftlimit,
-           qctl->qc_dqblk.dqb_curinodes);
+    struct if_quotactl *q;
+
+    if (gm->count == gm->size)
+    {
+        gm->size = gm->size ? gm->size * 2 : 64;
+        q = realloc(gm->qctl, gm->size * sizeof(*q));
+        if (!q)
+        {
+            return -1;
+        }
+        gm->qctl = q;
+    }
+
+    q = &gm->qctl[gm->count++];
+    memset(q, 0, sizeof(*q));
+    q->qc_cmd = LUSTRE_Q_GETQUOTA;
+    q->qc_type = USRQUOTA;
+    q->qc_id = uid;
+
+    return 0;
 }
 
-void
-print(struct grp_mbrs *gm)
+int
+qctl_cmp(const void *a,
+         const void *b)
 {
-    int comma = 0;
-    unsigned int idx;
+    const struct if_quotactl *qa = a,
+                             *qb = b;
+
+    return (qa->qc_id > qb->qc_id) - (qa->qc_id < qb->qc_id);
+}
+
+int
+gid_cmp(const void *a,
+        const void *b)
+{
+    const gid_t *ga = a,
+                *gb = b;
+
+    return (*ga > *gb) - (*ga < *gb);
+}
 
-    printf("[");
-    for (idx = 0; idx < gm->count ; idx++)
+/* grow an NSS *_r buffer after ERANGE */
+int
+nss_grow(char **buf,
+         size_t *len)
+{
+    char *b;
+
+    b = realloc(*buf, *len * 2);
+    if (!b)
     {
-        if (comma)
-        {
-            printf(",");
-        }
-        else
-        {
-            comma = 1;
-        }
-        p_if_quotactl(&gm->qctl[idx]);
+        return -1;
     }
-    printf("]");
+    *buf = b;
+    *len *= 2;
+
+    return 0;
 }
 
 int
-get_group_members(struct grp_mbrs *gm)
+get_groups(gid_t **gid)
 {
     int rc,
-        idx;
-    struct passwd *p;
-    gid_t gid[MAX_SUPPLEMENTARY_GROUPS];
+        idx,
+        n;
 
-    memset(gm, 0, sizeof(*gm));
+    if ((rc = getgroups(0, NULL)) < 0)
+    {
+        return -1;
+    }
 
-    if ((rc = getgroups(MAX_SUPPLEMENTARY_GROUPS, gid)) <= 0)
+    /* room for the real GID, which getgroups() need not include */
+    *gid = malloc((rc + 1) * sizeof(gid_t));
+    if (!*gid)
     {
         return -1;
     }
 
-    setpwent();
-    while ((p = getpwent()) != NULL)
+    if ((rc = getgroups(rc, *gid)) < 0)
+    {
+        return -1;
+    }
+    (*gid)[rc++] = getgid();
+
+    qsort(*gid, rc, sizeof(gid_t), gid_cmp);
+    for (idx = 1, n = 1; idx < rc; idx++)
     {
-        for (idx = 0; idx < rc; idx++)
+        if ((*gid)[idx] != (*gid)[n - 1])
         {
-            if (p->pw_gid == gid[idx])
+            (*gid)[n++] = (*gid)[idx];
+        }
+    }
+
+    return n;
+}
+
+int
+add_explicit_members(struct grp_mbrs *gm,
+                     gid_t gid)
+{
+    static char *grbuf = NULL,
+                *pwbuf = NULL;
+    static size_t grlen = 1024,
+                  pwlen = 1024;
+    struct group grs,
+                 *gr;
+    struct passwd pws,
+                  *pw;
+    char **m;
+    int rc;
+
+    if (!grbuf && !(grbuf = malloc(grlen)))
+    {
+        return -1;
+    }
+    if (!pwbuf && !(pwbuf = malloc(pwlen)))
+    {
+        return -1;
+    }
+
+    while ((rc = getgrgid_r(gid, &grs, grbuf, grlen, &gr)) == ERANGE)
+    {
+        if (nss_grow(&grbuf, &grlen) < 0)
+        {
+            return -1;
+        }
+    }
+    if (rc || !gr)
+    {
+        /* unknown group, no explicit members */
+        return 0;
+    }
+
+    for (m = gr->gr_mem; *m; m++)
+    {
+        while ((rc = getpwnam_r(*m, &pws, pwbuf, pwlen, &pw)) == ERANGE)
+        {
+            if (nss_grow(&pwbuf, &pwlen) < 0)
             {
-                if (gm->count < MAX_GROUP_MEMBERS)
-                {
-                    gm->qctl[gm->count].qc_cmd = LUSTRE_Q_GETQUOTA;
-                    gm->qctl[gm->count].qc_type = USRQUOTA;
-                    gm->qctl[gm->count].qc_id = p->pw_uid;
-                    gm->count++;
-                }
-                else
+                return -1;
+            }
+        }
+        if (rc || !pw)
+        {
+            continue;
+        }
+        if (gm_add(gm, pw->pw_uid) < 0)
+        {
+            return -1;
+        }
+    }
+
+    return 0;
+}
+
+int
+add_primary_members(struct grp_mbrs *gm,
+                    gid_t *gid,
+                    int ngid)
+{
+    FILE *fp;
+    struct stat st;
+    struct passwd *p;
+    unsigned int g,
+                 uid;
+    gid_t k;
+
+    /* "gid uid" lines, only trusted if no one but root could write them */
+    fp = fopen(PRIMARY_GID_INDEX, "r");
+    if (fp)
+    {
+        if (fstat(fileno(fp), &st) == 0 &&
+            st.st_uid == 0 &&
+            !(st.st_mode & (S_IWGRP | S_IWOTH)))
+        {
+            while (fscanf(fp, "%u %u", &g, &uid) == 2)
+            {
+                k = g;
+                if (bsearch(&k, gid, ngid, sizeof(gid_t), gid_cmp) &&
+                    gm_add(gm, uid) < 0)
                 {
-                    break;
+                    fclose(fp);
+                    return -1;
                 }
             }
+            fclose(fp);
+            return 0;
+        }
+        fclose(fp);
+    }
+
+    setpwent();
+    while ((p = getpwent()) != NULL)
+    {
+        if (bsearch(&p->pw_gid, gid, ngid, sizeof(gid_t), gid_cmp) &&
+            gm_add(gm, p->pw_uid) < 0)
+        {
+            endpwent();
+            return -1;
         }
     }
     endpwent();
 
+    return 0;
+}
+
+int
+get_group_members(struct grp_mbrs *gm,
+                  gid_t *gid,
+                  int ngid)
+{
+    int idx;
+    unsigned int n;
+
+    memset(gm, 0, sizeof(*gm));
+
+    for (idx = 0; idx < ngid; idx++)
+    {
+        if (add_explicit_members(gm, gid[idx]) < 0)
+        {
+            return -1;
+        }
+    }
+
+    if (add_primary_members(gm, gid, ngid) < 0)
+    {
+        return -1;
+    }
+
     if (!gm->count)
     {
         return -1;
     }
 
+    /* a user can be both an explicit and a primary member of many groups */
+    qsort(gm->qctl, gm->count, sizeof(*gm->qctl), qctl_cmp);
+    for (idx = 1, n = 1; idx < gm->count; idx++)
+    {
+        if (gm->qctl[idx].qc_id != gm->qctl[n - 1].qc_id)
+        {
+            gm->qctl[n++] = gm->qctl[idx];
+        }
+    }
+    gm->count = n;
+
     return 0;
 }
 
+#ifdef LGQ_TEST
+/* test build: GIDs from the command line instead of getgroups() */
+int
+test_groups(int argc,
+            char **argv,
+            gid_t **gid)
+{
+    int idx;
+
+    *gid = malloc(argc * sizeof(gid_t));
+    if (!*gid)
+    {
+        return -1;
+    }
+    for (idx = 1; idx < argc; idx++)
+    {
+        (*gid)[idx - 1] = strtoul(argv[idx], NULL, 10);
+    }
+    qsort(*gid, argc - 1, sizeof(gid_t), gid_cmp);
+
+    return argc - 1;
+}
+#endif
+
 int
 main(int argc,
      char **argv)
 {
     struct res_uid u;
     struct grp_mbrs gm;
+    gid_t *gid;
+    int ngid,
+        opt;
+    unsigned int concurrency = LGQ_CONCURRENCY;
 
     uid_state(__FUNCTION__);
     if (getresuid(&u.ruid, &u.euid, &u.suid) < 0)
@@ -238,17 +608,48 @@ main(int argc,
     }
     uid_state(__FUNCTION__);
 
-    if (get_group_members(&gm) < 0)
+    while ((opt = getopt(argc, argv, "j:")) != -1)
+    {
+        switch (opt)
+        {
+            case 'j':
+                concurrency = strtoul(optarg, NULL, 10);
+                if (concurrency < 1)
+                {
+                    concurrency = 1;
+                }
+                else if (concurrency > MAX_CONCURRENCY)
+                {
+                    concurrency = MAX_CONCURRENCY;
+                }
+                break;
+            default:
+                fprintf(stderr, "usage: %s [-j concurrency]\n", argv[0]);
+                return -1;
+        }
+    }
+
+#ifdef LGQ_TEST
+    ngid = test_groups(argc - optind + 1, argv + optind - 1, &gid);
+#else
+    ngid = get_groups(&gid);
+#endif
+    if (ngid <= 0)
     {
         return -1;
     }
 
-    if (lquota(LUSTRE_MOUNT_POINT, &gm, &u) < 0)
+    if (get_group_members(&gm, gid, ngid) < 0)
     {
         return -1;
     }
 
-    print(&gm);
+    p_header(gm.count);
+
+    if (lquota(LUSTRE_MOUNT_POINT, &gm, &u, concurrency) < 0)
+    {
+        return -1;
+    }
 
     return 0;
 }
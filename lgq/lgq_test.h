@@ -0,0 +1,39 @@
+/*
+ *  lgq_test.h: stand-ins for the parts of lustre_ioctl.h lgq uses, for the
+ *  "make lgq-test" build which never talks to Lustre.
+ */
+
+#ifndef LGQ_TEST_H
+#define LGQ_TEST_H
+
+#include <stdint.h>
+
+#define LUSTRE_Q_GETQUOTA 0x800007
+
+/* any directory will do, quotactl_ioctl() never reaches it */
+#define LUSTRE_MOUNT_POINT "/"
+
+struct obd_dqblk
+{
+    uint64_t dqb_bhardlimit;
+    uint64_t dqb_bsoftlimit;
+    uint64_t dqb_curspace;
+    uint64_t dqb_ihardlimit;
+    uint64_t dqb_isoftlimit;
+    uint64_t dqb_curinodes;
+    uint64_t dqb_btime;
+    uint64_t dqb_itime;
+    uint32_t dqb_valid;
+    uint32_t dqb_padding;
+};
+
+struct if_quotactl
+{
+    uint32_t qc_cmd;
+    uint32_t qc_type;
+    uint32_t qc_id;
+    uint32_t qc_stat;
+    struct obd_dqblk qc_dqblk;
+};
+
+#endif
@@ -9,6 +9,7 @@ please see the following lustre source files for details:
 """
     
 import os
+import array
 import collections
 import fcntl
 import struct
@@ -27,6 +28,16 @@ fmt_obd_uuid = "40c"
 fmt_if_quotactl = "6I" + fmt_obd_dqinfo + fmt_obd_dqblk + \
                          fmt_obd_type + fmt_obd_uuid
 
+if_quotactl_struct = struct.Struct(fmt_if_quotactl)
+# fields after qc_cmd, qc_type, qc_id of a request, all zero
+if_quotactl_pad = tuple(([0] * 3) + ([0] * 4) + ([0] * 10) +
+                        (['\0'] * 16) + (['\0'] * 40))
+# offsets of qc_id and of the six obd_dqblk fields if_quotactl keeps
+if_quotactl_id = struct.Struct("I")
+IF_QUOTACTL_ID_OFFSET = struct.calcsize("2I")
+obd_dqblk_struct = struct.Struct("6L")
+OBD_DQBLK_OFFSET = struct.calcsize("6I" + fmt_obd_dqinfo + "0L")
+
 if_quotactl = collections.namedtuple("if_quotactl",
                                      [
                                        "qc_type",
@@ -39,26 +50,101 @@ if_quotactl = collections.namedtuple("if_quotactl",
                                        "dqb_curinodes"
                                      ])
 
+# lgq's binary output, must match struct lgq_header/lgq_record in lgq/lgq.c
+# magic, version, record size, record count
+LGQ_MAGIC = "LGQ\0"
+LGQ_VERSION = 2
+lgq_header = struct.Struct("=4sHHI")
+# qc_type, qc_id, errno (0 if the quota was collected) followed by the
+# remaining fields in if_quotactl order
+lgq_record = struct.Struct("=IIi6Q")
+
 def lquota_if_quotactl(q):
     """defines and returns a "if_quotactl" named tuple from passed in tuple"""
     return if_quotactl(q[1], q[2], q[10], q[11], q[12], q[13], q[14], q[15])
 
 def lquota_ioctl(fd, lq_type, lq_id):
     """calls lustre ioctl LL_IOC_QUOTACTL"""
-    if_quotactl = struct.pack(fmt_if_quotactl, LUSTRE_Q_GETQUOTA,
-                              lq_type, lq_id, 0, 0, 0,
-                              *(([0] * 4) + ([0] * 10) +
-                               (['\0'] * 16) + (['\0'] * 40)))
+    if_quotactl = if_quotactl_struct.pack(LUSTRE_Q_GETQUOTA, lq_type, lq_id,
+                                          *if_quotactl_pad)
     return fcntl.ioctl(fd, LL_IOC_QUOTACTL, if_quotactl)
 
-def lquota_get(lq_path, query_supplementary = False):
-    """returns Lustre quota information for the calling process UID/GID(s)"""
-    ret_lq = []
+class lquota_table(object):
+    """Quota of many IDs of one type in parallel arrays, one per
+       if_quotactl field, as lquota_get_many() returns them.  errno holds
+       0 for every ID whose quota was collected, the ioctl's errno with
+       zero usage otherwise.  Rows read as if_quotactl tuples."""
+
+    FIELDS = [ "qc_id", "dqb_bhardlimit", "dqb_bsoftlimit", "dqb_curspace",
+               "dqb_ihardlimit", "dqb_isoftlimit", "dqb_curinodes" ]
+
+    def __init__(self, qc_type):
+        self.qc_type = qc_type
+        for f in self.FIELDS:
+            setattr(self, f, array.array("L"))
+        self.errno = array.array("i")
+
+    def __len__(self):
+        return len(self.qc_id)
+
+    def __getitem__(self, i):
+        return if_quotactl(self.qc_type, self.qc_id[i],
+                           self.dqb_bhardlimit[i], self.dqb_bsoftlimit[i],
+                           self.dqb_curspace[i], self.dqb_ihardlimit[i],
+                           self.dqb_isoftlimit[i], self.dqb_curinodes[i])
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+def lquota_get_many(lq_path, lq_type, ids):
+    """Returns Lustre quota information for every UID (lq_type USRQUOTA) or
+       GID (GRPQUOTA) in ids as an lquota_table, normally as root.  One
+       request buffer is reused, filled in place by each ioctl."""
+    t = lquota_table(lq_type)
+    request = if_quotactl_struct.pack(LUSTRE_Q_GETQUOTA, lq_type, 0,
+                                      *if_quotactl_pad)
+    buf = bytearray(request)
+    zero = (0,) * 6
+    append = [ getattr(t, f).append for f in lquota_table.FIELDS[1:] ]
+
     fd = os.open(lq_path, os.O_RDONLY | os.O_NONBLOCK | os.O_DIRECTORY)
+    try:
+        for i in ids:
+            buf[:] = request
+            if_quotactl_id.pack_into(buf, IF_QUOTACTL_ID_OFFSET, i)
+            try:
+                fcntl.ioctl(fd, LL_IOC_QUOTACTL, buf, True)
+                q = obd_dqblk_struct.unpack_from(buf, OBD_DQBLK_OFFSET)
+                e = 0
+            except IOError, err:
+                q = zero
+                e = err.errno or -1
+            t.qc_id.append(i)
+            t.errno.append(e)
+            for a, v in zip(append, q):
+                a(v)
+    finally:
+        os.close(fd)
+
+    return t
+
+def lquota_get_user(fd, uid, gids):
+    """returns Lustre quota information for uid followed by every GID in
+       gids, primary first, from the Lustre directory open as fd"""
+    ret_lq = []
 
-    q = lquota_ioctl(fd, USRQUOTA, os.geteuid())
+    q = lquota_ioctl(fd, USRQUOTA, uid)
     ret_lq.append(lquota_if_quotactl(struct.unpack(fmt_if_quotactl, q)))
 
+    for g in gids:
+        q = lquota_ioctl(fd, GRPQUOTA, g)
+        ret_lq.append(lquota_if_quotactl(struct.unpack(fmt_if_quotactl, q)))
+
+    return ret_lq
+
+def lquota_get(lq_path, query_supplementary = False):
+    """returns Lustre quota information for the calling process UID/GID(s)"""
     # place primary GID at the start of the list
     gid = os.getgid()
     if query_supplementary:
@@ -69,13 +155,11 @@ def lquota_get(lq_path, query_supplementary = False):
         grps = list()
     grps.insert(0, gid)
 
-    for g in grps:
-        q = lquota_ioctl(fd, GRPQUOTA, g)
-        ret_lq.append(lquota_if_quotactl(struct.unpack(fmt_if_quotactl, q)))
-
-    os.close(fd)
-
-    return ret_lq
+    fd = os.open(lq_path, os.O_RDONLY | os.O_NONBLOCK | os.O_DIRECTORY)
+    try:
+        return lquota_get_user(fd, os.geteuid(), grps)
+    finally:
+        os.close(fd)
 
 if __name__ == "__main__":
     path = "/lustre"
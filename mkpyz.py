@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Builds du.py's login entry point, dulogin.py, into an executable zipapp.
+
+    mkpyz.py [-o du-login.pyz] [-p /usr/bin/python]
+
+The archive holds only bytecode, compiled by the python running mkpyz.py,
+so the interpreter it is run with must be the same version.  It runs with
+python -S: the login entry point needs nothing from site-packages and
+skipping site saves importing it, sysconfig and re at every login.
+"""
+
+import imp
+import marshal
+import os
+import stat
+import struct
+import sys
+import time
+import zipfile
+from optparse import OptionParser
+from StringIO import StringIO
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# every module du.py's modes may import
+PYZ_MODULES = [
+    "dulogin", "du", "render", "colors", "timings", "nodestate", "breaker",
+    "bucket", "probe", "collect", "snapshot", "qcache", "nsscache",
+    "rquota", "lquota", "bquota", "sunrpc", "duagent", "history", "walk",
+    "duapi", "watch",
+]
+
+PYZ_MAIN = """import sys
+import dulogin
+sys.exit(dulogin.main())
+"""
+
+def pyc(source, filename):
+    """returns the bytecode file for source, as py_compile writes it"""
+    code = compile(source, filename, "exec")
+    return imp.get_magic() + struct.pack("<I", int(time.time())) + \
+           marshal.dumps(code)
+
+def main():
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("-o", "--output", default = "du-login.pyz",
+                      help = "archive to write, default du-login.pyz")
+    parser.add_option("-p", "--python", default = "/usr/bin/python",
+                      help = "interpreter in the archive's #! line, default "
+                      "/usr/bin/python, must be the version running mkpyz.py")
+    (opts, args) = parser.parse_args()
+
+    buf = StringIO()
+    z = zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED)
+    for m in PYZ_MODULES:
+        path = os.path.join(SRC_DIR, m + ".py")
+        f = open(path)
+        try:
+            source = f.read()
+        finally:
+            f.close()
+        z.writestr(m + ".pyc", pyc(source, path))
+    z.writestr("__main__.pyc", pyc(PYZ_MAIN, "__main__.py"))
+    z.close()
+
+    tmp = opts.output + ".tmp"
+    f = open(tmp, "wb")
+    try:
+        f.write("#!{0} -S\n".format(opts.python))
+        f.write(buf.getvalue())
+    finally:
+        f.close()
+    os.chmod(tmp, stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP |
+                  stat.S_IROTH | stat.S_IXOTH)
+    os.rename(tmp, opts.output)
+
+if __name__ == "__main__":
+    main()
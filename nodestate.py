@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Node-local state shared by every du.py run on a node, e.g. mounts found
+hung by an earlier login.
+
+The state is a small JSON dictionary in NODESTATE_PATH on tmpfs, readable
+and writable by every user and serialized with flock(2).  Only root can
+create it, under /run, so no user can plant a file of their own there:
+"nodestate.py", or duagent.py, run at boot creates it, e.g. from
+tmpfiles.d or a systemd unit.  Without it runs go on without the state.
+Anyone on the node can still write to it, so readers must treat its
+contents as hints only: validate what is read and let entries expire.
+Anyone can also hold its lock, so it is only ever tried for,
+NODESTATE_LOCK_TRIES times, and a run finding it busy goes on without
+the state rather than wait.  A file owned by anyone but root or the
+caller is ignored, as another user could have created it unwritable to
+the rest.
+"""
+
+import fcntl
+import os
+import stat
+import time
+
+NODESTATE_PATH = "/run/hcc-du/state"
+# tries for the lock, NODESTATE_LOCK_WAIT seconds apart, holders only
+# keep it for a read or write of a few hundred bytes
+NODESTATE_LOCK_TRIES = 5
+NODESTATE_LOCK_WAIT = 0.01
+
+def nodestate_open(flags):
+    """returns a file descriptor of the state file, creating it shared
+       if needed, or None"""
+    try:
+        fd = os.open(NODESTATE_PATH, flags | os.O_NOFOLLOW, 0666)
+    except OSError:
+        return None
+    try:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode) or st.st_uid not in (0, os.getuid()):
+            os.close(fd)
+            return None
+        # umask leaves a new file unwritable to other users
+        if st.st_uid == os.getuid() and st.st_mode & 0666 != 0666:
+            os.fchmod(fd, 0666)
+    except OSError:
+        pass
+    return fd
+
+def nodestate_lock(fd, op):
+    """Takes flock(2) lock op on fd without blocking, trying a few times.
+       Returns False if it stayed busy."""
+    for i in range(NODESTATE_LOCK_TRIES):
+        try:
+            fcntl.flock(fd, op | fcntl.LOCK_NB)
+            return True
+        except IOError:
+            if i + 1 < NODESTATE_LOCK_TRIES:
+                time.sleep(NODESTATE_LOCK_WAIT)
+    return False
+
+def nodestate_load(fd):
+    """returns the state dictionary read from fd, empty if unreadable"""
+    # json is left to the runs which get this far, see du.py's imports
+    import json
+
+    data = ""
+    while True:
+        d = os.read(fd, 1 << 16)
+        if not d:
+            break
+        data += d
+    try:
+        state = json.loads(data)
+    except ValueError:
+        return {}
+    return state if isinstance(state, dict) else {}
+
+def nodestate_read():
+    """returns a snapshot of the node state dictionary"""
+    fd = nodestate_open(os.O_RDONLY)
+    if fd is None:
+        return {}
+    try:
+        # busy is as good as no state
+        if not nodestate_lock(fd, fcntl.LOCK_SH):
+            return {}
+        return nodestate_load(fd)
+    except (OSError, IOError):
+        return {}
+    finally:
+        os.close(fd)
+
+def nodestate_update(func):
+    """Calls func(state) with the node state dictionary locked against
+       other runs, writing back whatever func leaves in it.  Failures are
+       ignored, the state is only a hint."""
+    fd = nodestate_open(os.O_RDWR | os.O_CREAT)
+    if fd is None:
+        return
+    try:
+        if not nodestate_lock(fd, fcntl.LOCK_EX):
+            return
+        state = nodestate_load(fd)
+        func(state)
+        import json
+        data = json.dumps(state, sort_keys = True)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, data)
+    except (OSError, IOError):
+        pass
+    finally:
+        os.close(fd)
+
+def nodestate_create():
+    """creates the state file, and its directory, shared with every user,
+       for root to run at boot"""
+    dir = os.path.dirname(NODESTATE_PATH)
+    if not os.path.isdir(dir):
+        os.makedirs(dir, 0755)
+    fd = nodestate_open(os.O_RDWR | os.O_CREAT)
+    if fd is None:
+        raise OSError("can't create " + NODESTATE_PATH)
+    os.close(fd)
+
+if __name__ == "__main__":
+    import sys
+
+    try:
+        nodestate_create()
+    except OSError, e:
+        print >>sys.stderr, "nodestate.py: {0}".format(e)
+        sys.exit(1)
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Batched UID/GID name resolution backed by an on-disk cache.
+
+Network NSS backends (SSSD/LDAP) can take a round trip per lookup, so
+nss_resolve() looks each distinct ID up once and keeps the answers in the
+calling user's cache directory (see qcache.py) for NSS_TTL seconds.  The
+whole cache is dropped when /etc/passwd or /etc/group changes.  IDs
+without an entry are not cached, so new accounts show up at once.
+"""
+
+import collections
+import json
+import os
+import tempfile
+import time
+
+from grp import getgrgid
+from pwd import getpwuid
+
+from qcache import qcache_dir
+
+NSS_VERSION = 1
+NSS_FILE = "hcc-du.nss"
+NSS_TTL = 3600
+
+# files whose modification invalidates the cache
+NSS_FILES = [ "/etc/passwd", "/etc/group" ]
+
+# group_t namedtuple
+# The subset of a grp.struct_group used by du.py's display code.
+group_t = collections.namedtuple("group_t",
+                                 [
+                                    "gr_name",
+                                    "gr_gid"
+                                 ])
+
+def nss_mtimes():
+    """returns the modification times of NSS_FILES"""
+    ret = []
+    for f in NSS_FILES:
+        try:
+            ret.append(os.stat(f).st_mtime)
+        except OSError:
+            ret.append(None)
+    return ret
+
+def nss_load(path, mtimes):
+    """returns (users, groups) dictionaries cached in path, empty if the
+       cache is missing, stale or unreadable"""
+    try:
+        f = open(path)
+        try:
+            d = json.load(f)
+        finally:
+            f.close()
+        if d["version"] != NSS_VERSION or d["mtimes"] != mtimes:
+            return ({}, {})
+        now = time.time()
+        # JSON keys are strings and names come back unicode
+        users = dict([ (int(k), (v[0].encode("utf-8"), v[1], v[2]))
+                       for k, v in d["users"].items()
+                       if now - v[2] < NSS_TTL ])
+        groups = dict([ (int(k), (v[0].encode("utf-8"), v[1]))
+                        for k, v in d["groups"].items()
+                        if now - v[1] < NSS_TTL ])
+        return (users, groups)
+    except (IOError, OSError, ValueError, KeyError, TypeError, IndexError,
+            AttributeError):
+        return ({}, {})
+
+def nss_save(path, mtimes, users, groups):
+    """atomically replaces the cache in path"""
+    d = {
+        "version": NSS_VERSION,
+        "mtimes": mtimes,
+        "users": users,
+        "groups": groups,
+    }
+    dir, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix = name + ".", dir = dir)
+    try:
+        f = os.fdopen(fd, "w")
+        try:
+            json.dump(d, f)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+def nss_resolve(uids, gids):
+    """Resolves every UID in uids and every GID in gids, along with the
+       primary GIDs of those users.  Returns a dictionary of uid: (name,
+       primary gid) and one of gid: name, lacking IDs with no entry."""
+    dir = qcache_dir()
+    path = None if dir is None else os.path.join(dir, NSS_FILE)
+    mtimes = nss_mtimes()
+    if path is None:
+        users, groups = ({}, {})
+    else:
+        users, groups = nss_load(path, mtimes)
+
+    now = time.time()
+    changed = False
+    for uid in set(uids) - set(users.keys()):
+        try:
+            pwe = getpwuid(uid)
+        except KeyError:
+            continue
+        users[uid] = (pwe.pw_name, pwe.pw_gid, now)
+        changed = True
+
+    gids = set(gids)
+    for uid in uids:
+        if uid in users:
+            gids.add(users[uid][1])
+    for gid in gids - set(groups.keys()):
+        try:
+            gre = getgrgid(gid)
+        except KeyError:
+            continue
+        groups[gid] = (gre.gr_name, now)
+        changed = True
+
+    if changed and path is not None:
+        nss_save(path, mtimes, users, groups)
+
+    return (dict([ (u, tuple(users[u][:2])) for u in uids if u in users ]),
+            dict([ (g, groups[g][0]) for g in gids if g in groups ]))
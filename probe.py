@@ -0,0 +1,196 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Hung-mount-safe filesystem probes.
+
+statvfs(2)/stat(2) on a mount whose servers or storage targets stop
+answering block in uninterruptible sleep, and a process with a thread
+stuck that way can't exit, freezing the login it runs in.  Every probe
+here runs in a forked helper instead, which is killed and left behind
+for init to reap if it misses its deadline.
+
+Paths found hung are remembered in the node state for HUNG_TTL seconds so
+later runs on the node skip them without waiting.
+"""
+
+import fcntl
+import marshal
+import os
+import select
+import signal
+import struct
+import threading
+import time
+
+from collect import statvfs_t, stat_t, probe_mount as probe_mount_direct
+from nodestate import nodestate_read, nodestate_update
+from rquota import rquota_find_mount
+
+# seconds a path found hung is skipped by later runs on the node
+HUNG_TTL = 300
+
+# length prefix of a helper's reply
+probe_reply = struct.Struct("=I")
+
+class probe_error(EnvironmentError):
+    """Probe skipped or abandoned because its path is hung"""
+
+def probe_hung_valid(until, now):
+    """returns whether until is the expiry of a hung entry still in force,
+       at most HUNG_TTL away as probe_mark() would have written it"""
+    return isinstance(until, (int, long, float)) and \
+           now < until <= now + HUNG_TTL
+
+def probe_hung(path):
+    """returns True if a recent run found path hung"""
+    hung = nodestate_read().get("hung")
+    if not isinstance(hung, dict):
+        return False
+    return probe_hung_valid(hung.get(path), time.time())
+
+def probe_mark(path):
+    """records path as hung for HUNG_TTL seconds"""
+    def update(state):
+        hung = state.get("hung")
+        if not isinstance(hung, dict):
+            hung = state["hung"] = {}
+        now = time.time()
+        # drop expired and forged entries while here
+        for p in hung.keys():
+            if not probe_hung_valid(hung[p], now):
+                del hung[p]
+        hung[path] = now + HUNG_TTL
+    nodestate_update(update)
+
+def probe_child(wfd, func, args):
+    """runs in the helper, writes func(*args) or the OSError it raised to
+       wfd, never returns"""
+    try:
+        try:
+            ret = (0, func(*args))
+        except EnvironmentError, e:
+            ret = (1, (e.errno, e.strerror, e.filename))
+        data = marshal.dumps(ret)
+        data = probe_reply.pack(len(data)) + data
+        while data:
+            data = data[os.write(wfd, data):]
+    finally:
+        os._exit(0)
+
+def probe_call(path, deadline, func, *args):
+    """Returns func(*args) run in a forked helper, which must return
+       something marshal can serialize.  OSError raised by func is raised
+       here.  Raises probe_error if path is known to be hung or the helper
+       doesn't finish within deadline seconds."""
+    if probe_hung(path):
+        raise probe_error("{0} recently hung, skipped".format(path))
+
+    rfd, wfd = os.pipe()
+    for fd in (rfd, wfd):
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+    try:
+        pid = os.fork()
+    except OSError:
+        os.close(rfd)
+        os.close(wfd)
+        raise
+    if pid == 0:
+        os.close(rfd)
+        probe_child(wfd, func, args)
+    os.close(wfd)
+
+    # Helpers forked by other threads meanwhile share wfd, so the end of
+    # the reply is known from its length rather than from EOF.
+    data = ""
+    size = None
+    end = time.time() + deadline
+    try:
+        while size is None or len(data) < size:
+            wait = end - time.time()
+            if wait <= 0:
+                break
+            try:
+                if not select.select([ rfd ], [], [], wait)[0]:
+                    continue
+            except select.error:
+                continue
+            d = os.read(rfd, 1 << 16)
+            if not d:
+                break
+            data += d
+            if size is None and len(data) >= probe_reply.size:
+                size = probe_reply.size + \
+                       probe_reply.unpack_from(data)[0]
+    finally:
+        os.close(rfd)
+
+    done = size is not None and len(data) >= size
+    if not done and time.time() >= end:
+        # The kill lands once the syscall returns, if ever.  Not waiting
+        # on the helper leaves it to init once this process exits.
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+        probe_mark(path)
+        raise probe_error("{0} did not answer within {1} seconds"
+                          .format(path, deadline))
+
+    os.waitpid(pid, 0)
+    try:
+        if not done:
+            raise EOFError
+        status, ret = marshal.loads(data[probe_reply.size:])
+    except (EOFError, ValueError, TypeError):
+        raise probe_error("{0} probe helper failed".format(path))
+    if status:
+        raise OSError(*ret)
+    return ret
+
+def probe_mount_tuple(path):
+    """probe_mount() as plain tuples, which marshal can carry"""
+    svfs, st = probe_mount_direct(path)
+    return (tuple(svfs), tuple(st))
+
+def probe_mount(path, deadline):
+    """returns (statvfs_t, stat_t) for the mount point at path, probed in
+       a helper given deadline seconds"""
+    svfs, st = probe_call(path, deadline, probe_mount_tuple, path)
+    return (statvfs_t(*svfs), stat_t(*st))
+
+def probe_home_tuple(home):
+    """home mount discovery and probe_mount() of it as plain tuples"""
+    # no NSS lookups in the helper, another thread may have held their
+    # locks when it was forked
+    path = rquota_find_mount(home)
+    svfs, st = probe_mount_direct(path)
+    return (path, tuple(svfs), tuple(st))
+
+# probe_home() result shared by the threads asking for it
+home_lock = threading.Lock()
+home_result = []
+
+def probe_home(home, deadline, shared = None):
+    """Returns (mount point, statvfs_t, stat_t) of the mount holding the
+       calling user's home directory home, discovered and probed together
+       in one helper given deadline seconds.  Concurrent and later calls
+       passing the same list shared, home_result by default, share the
+       first call's result."""
+    if shared is None:
+        shared = home_result
+    home_lock.acquire()
+    try:
+        if not shared:
+            try:
+                path, svfs, st = probe_call(home, deadline,
+                                            probe_home_tuple, home)
+                shared.append((path, statvfs_t(*svfs), stat_t(*st)))
+            except EnvironmentError, e:
+                shared.append(e)
+        ret = shared[0]
+    finally:
+        home_lock.release()
+    if isinstance(ret, EnvironmentError):
+        raise ret
+    return ret
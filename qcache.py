@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Per-user on-disk cache of collected quota records and mount probes.
+
+The cache lives in $XDG_RUNTIME_DIR or /tmp/hcc-du-<uid>, which must be a
+directory owned by the calling user and not accessible to anyone else.
+Entries are keyed by mount ("home", "work", "common") and timestamped
+individually, the file is replaced atomically with rename(2).
+"""
+
+import errno
+import fcntl
+import json
+import os
+import stat
+import tempfile
+import time
+
+from collect import statvfs_t, stat_t
+from rquota import rquota_t
+from lquota import if_quotactl
+from bquota import bquota_t
+from breaker import BREAKER_OPEN
+from bucket import BUCKET_EMPTY
+
+CACHE_VERSION = 1
+CACHE_FILE = "hcc-du.quota"
+CACHE_LOCK = "hcc-du.refresh"
+
+# collect() result keys for each cached mount and its quota record type
+CACHE_MOUNTS = {
+    "home":   ("hmount", "hquota", rquota_t),
+    "work":   ("wmount", "wquota", if_quotactl),
+    "common": ("cmount", "cquota", bquota_t),
+}
+
+def qcache_dir():
+    """returns the calling user's cache directory, creating it if needed,
+       or None if it is missing or unsafe to use"""
+    uid = os.getuid()
+    path = os.environ.get("XDG_RUNTIME_DIR")
+    if not path:
+        path = "/tmp/hcc-du-{0}".format(uid)
+        try:
+            os.mkdir(path, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                return None
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    # only trust a real directory the user owns that no one else can write
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != uid or \
+       st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return None
+    return path
+
+def qcache_encode(c):
+    """returns a JSON-able dictionary of the mounts present in the collect()
+       result c"""
+    ret = {}
+    now = time.time()
+    for name, (mkey, qkey, qtype) in CACHE_MOUNTS.items():
+        # don't cache a mount that was unavailable this time around
+        if c.get(mkey) is None or c.get(qkey) is None or \
+           c.get(qkey) is BREAKER_OPEN or c.get(qkey) is BUCKET_EMPTY:
+            continue
+        svfs, st = c[mkey]
+        ret[name] = {
+            "time": now,
+            "svfs": list(svfs),
+            "stat": list(st),
+            "quota": [ None if q is None else list(q) for q in c[qkey] ],
+        }
+    return ret
+
+def qcache_decode(mounts, query_supplementary):
+    """returns a collect() shaped dictionary from cached mounts along with
+       the age of its oldest entry, or None if a mount is missing"""
+    ret = {}
+    oldest = time.time()
+    for name, (mkey, qkey, qtype) in CACHE_MOUNTS.items():
+        m = mounts.get(name)
+        if m is None:
+            return None
+        ret[mkey] = (statvfs_t(*m["svfs"]), stat_t(*m["stat"]))
+        ql = [ None if q is None else qtype(*q) for q in m["quota"] ]
+        ret[qkey] = ql if query_supplementary else ql[:2]
+        oldest = min(oldest, m["time"])
+    return (time.time() - oldest, ret)
+
+def qcache_read(query_supplementary = False):
+    """returns (age in seconds, collect() shaped dictionary) from the
+       calling user's cache, or None if there is no usable entry"""
+    path = qcache_dir()
+    if path is None:
+        return None
+    try:
+        f = open(os.path.join(path, CACHE_FILE))
+        try:
+            d = json.load(f)
+        finally:
+            f.close()
+        if d["version"] != CACHE_VERSION or d["uid"] != os.getuid():
+            return None
+        # a cache without supplementary groups can't answer for them
+        if query_supplementary and not d["sup"]:
+            return None
+        return qcache_decode(d["mounts"], query_supplementary)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+def qcache_write(c, query_supplementary = False):
+    """atomically writes the collect() result c to the calling user's
+       cache, keeping previous entries for any mount now unavailable"""
+    path = qcache_dir()
+    if path is None:
+        return
+
+    mounts = {}
+    try:
+        f = open(os.path.join(path, CACHE_FILE))
+        try:
+            d = json.load(f)
+        finally:
+            f.close()
+        # keep earlier entries only if they answer the same question
+        if d["version"] == CACHE_VERSION and \
+           d["sup"] == query_supplementary:
+            mounts = d["mounts"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    mounts.update(qcache_encode(c))
+
+    d = {
+        "version": CACHE_VERSION,
+        "uid": os.getuid(),
+        "sup": query_supplementary,
+        "mounts": mounts,
+    }
+
+    # mkstemp creates the file 0600
+    fd, tmp = tempfile.mkstemp(prefix = CACHE_FILE + ".", dir = path)
+    try:
+        f = os.fdopen(fd, "w")
+        try:
+            json.dump(d, f)
+        finally:
+            f.close()
+        os.rename(tmp, os.path.join(path, CACHE_FILE))
+    except (IOError, OSError):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+def qcache_detach():
+    """Forks a detached background process to refresh the cache.  Returns
+       True in that process, which must finish with os._exit(), False in
+       the caller.  Only one refresh per user runs at a time."""
+    path = qcache_dir()
+    if path is None:
+        return False
+
+    try:
+        lfd = os.open(os.path.join(path, CACHE_LOCK),
+                      os.O_WRONLY | os.O_CREAT, 0600)
+    except OSError:
+        return False
+    try:
+        fcntl.flock(lfd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        # someone else is already refreshing
+        os.close(lfd)
+        return False
+
+    try:
+        pid = os.fork()
+    except OSError:
+        os.close(lfd)
+        return False
+
+    if pid:
+        # the lock stays held by the refresh process's copy of lfd
+        os.close(lfd)
+        os.waitpid(pid, 0)
+        return False
+
+    # first child, start a new session and leave the grandchild to init
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+
+    null = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(null, fd)
+    os.close(null)
+
+    return True
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Prometheus exporter of user and group quotas, written for node_exporter's
+textfile collector.
+
+    qexport.py [-o output] [-u ids] [-g ids] [-l lustre] [-b beegfs]
+
+Collects the quota of every user and group in the ID sets, every passwd
+and group entry by default, on each NFS home mount, lustre and beegfs in
+one run.  It uses snapshot.py's bulk collection, CHUNK IDs per backend
+query.  Each chunk's samples are appended to a spool file per metric as
+they arrive, as the text format needs every metric's samples together,
+so memory stays bounded by a chunk.  The spools are then joined into a
+temporary file next to output, renamed over it.
+
+Besides the quota metrics, writes the seconds, records and failed
+chunks collected per mount and the duration of the whole run.  A chunk
+whose backend query fails is reported on stderr and skipped, so the
+other chunks and mounts are still exported.
+"""
+
+import os
+import sys
+import time
+
+from rquota import USRQUOTA, GRPQUOTA
+from snapshot import snapshot_scan
+
+EXPORT_PATH = "/var/lib/node_exporter/textfile_collector/hcc_du_quota.prom"
+
+# name, help, snap_record field and scale of each quota metric
+EXPORT_METRICS = [
+    ("hcc_du_quota_used_bytes", "Space used", 3, 1),
+    ("hcc_du_quota_soft_limit_bytes", "Space soft limit, 0 for none", 4,
+     1 << 10),
+    ("hcc_du_quota_hard_limit_bytes", "Space hard limit, 0 for none", 5,
+     1 << 10),
+    ("hcc_du_quota_used_inodes", "Files used", 7, 1),
+    ("hcc_du_quota_soft_limit_inodes", "Files soft limit, 0 for none", 8, 1),
+    ("hcc_du_quota_hard_limit_inodes", "Files hard limit, 0 for none", 9, 1),
+]
+
+EXPORT_TYPES = { USRQUOTA: "user", GRPQUOTA: "group" }
+
+def export_ids(spec):
+    """returns the set of IDs in spec, a comma separated list of IDs and
+       first-last ranges"""
+    ret = set()
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        if sep:
+            ret.update(xrange(int(first), int(last) + 1))
+        elif first:
+            ret.add(int(first))
+    return ret
+
+def export_label(value):
+    """returns value escaped as a label value"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"") \
+                     .replace("\n", "\\n")
+
+def export_family(out, name, help, samples):
+    """writes metric name's HELP and TYPE lines and the file of sample
+       lines samples to out"""
+    import shutil
+
+    out.write("# HELP {0} {1}\n# TYPE {0} gauge\n".format(name, help))
+    samples.seek(0)
+    shutil.copyfileobj(samples, out)
+
+def export(path, users, groups, lustre, beegfs):
+    """Atomically writes the quota metrics of users and groups, passwd and
+       group entries, to path.  Returns the number of records exported."""
+    import tempfile
+
+    start = time.time()
+    names = {
+        USRQUOTA: dict([ (p.pw_uid, p.pw_name) for p in users ]),
+        GRPQUOTA: dict([ (g.gr_gid, g.gr_name) for g in groups ]),
+    }
+    spools = [ tempfile.TemporaryFile() for m in EXPORT_METRICS ]
+    mounts = []
+    # mount number: [ seconds, records ]
+    stats = {}
+    # mount number: failed chunks
+    errors = {}
+    count = 0
+
+    t = time.time()
+    for idx, chunk in snapshot_scan(users, groups, lustre, beegfs, mounts,
+                                    errors):
+        stat = stats.setdefault(idx, [ 0.0, 0 ])
+        stat[0] += time.time() - t
+        stat[1] += len(chunk)
+        count += len(chunk)
+        mount = export_label(mounts[idx][0])
+        lines = [ [] for m in EXPORT_METRICS ]
+        for r in chunk:
+            qtype, id = r[1], r[2]
+            # users' primary groups may lack a group entry, named by ID
+            l = "{{mount=\"{0}\",type=\"{1}\",id=\"{2}\",name=\"{3}\"}}" \
+                .format(mount, EXPORT_TYPES[qtype], id,
+                        export_label(names[qtype].get(id, id)))
+            for i, (name, help, field, scale) in enumerate(EXPORT_METRICS):
+                lines[i].append("{0}{1} {2}\n".format(name, l,
+                                                       r[field] * scale))
+        for spool, l in zip(spools, lines):
+            spool.write("".join(l))
+        t = time.time()
+
+    fd, tmp = tempfile.mkstemp(prefix = "." + os.path.basename(path) + ".",
+                               dir = os.path.dirname(path) or ".")
+    try:
+        f = os.fdopen(fd, "w")
+        try:
+            for (name, help, field, scale), spool in zip(EXPORT_METRICS,
+                                                         spools):
+                export_family(f, name, help, spool)
+                spool.close()
+            f.write("# HELP hcc_du_quota_collect_seconds Seconds spent "
+                    "collecting each mount's quotas\n"
+                    "# TYPE hcc_du_quota_collect_seconds gauge\n")
+            for idx, (seconds, records) in sorted(stats.items()):
+                f.write("hcc_du_quota_collect_seconds{{mount=\"{0}\"}} "
+                        "{1:.6f}\n".format(export_label(mounts[idx][0]),
+                                           seconds))
+            f.write("# HELP hcc_du_quota_records Quota records collected on "
+                    "each mount\n"
+                    "# TYPE hcc_du_quota_records gauge\n")
+            for idx, (seconds, records) in sorted(stats.items()):
+                f.write("hcc_du_quota_records{{mount=\"{0}\"}} {1}\n"
+                        .format(export_label(mounts[idx][0]), records))
+            f.write("# HELP hcc_du_quota_collect_errors Chunks of IDs whose "
+                    "quotas couldn't be collected on each mount\n"
+                    "# TYPE hcc_du_quota_collect_errors gauge\n")
+            for idx in sorted(stats):
+                f.write("hcc_du_quota_collect_errors{{mount=\"{0}\"}} {1}\n"
+                        .format(export_label(mounts[idx][0]),
+                                errors.get(idx, 0)))
+            f.write("# HELP hcc_du_quota_export_seconds Seconds the whole "
+                    "export took\n"
+                    "# TYPE hcc_du_quota_export_seconds gauge\n"
+                    "hcc_du_quota_export_seconds {0:.6f}\n"
+                    .format(time.time() - start))
+        finally:
+            f.close()
+        os.chmod(tmp, 0644)
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+    return count
+
+if __name__ == "__main__":
+    import grp
+    import pwd
+    from optparse import OptionParser
+
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("-o", "--output", action = "store",
+                      default = EXPORT_PATH,
+                      help = "textfile to write, default " + EXPORT_PATH)
+    parser.add_option("-u", "--uids", action = "store", metavar = "IDS",
+                      help = "only export these users, e.g. 1000-1999,5000, "
+                      "default every passwd entry")
+    parser.add_option("-g", "--gids", action = "store", metavar = "IDS",
+                      help = "only export these groups and the users' "
+                      "primary groups, default every group entry")
+    parser.add_option("-l", "--lustre", action = "store", default = "/lustre",
+                      help = "lustre mount point, '' to skip, "
+                      "default /lustre")
+    parser.add_option("-b", "--beegfs", action = "store", default = "/common",
+                      help = "beegfs mount point, '' to skip, "
+                      "default /common")
+    (opts, args) = parser.parse_args()
+
+    users = pwd.getpwall()
+    groups = grp.getgrall()
+    try:
+        if opts.uids is not None:
+            uids = export_ids(opts.uids)
+            users = [ p for p in users if p.pw_uid in uids ]
+        if opts.gids is not None:
+            gids = export_ids(opts.gids)
+            groups = [ g for g in groups if g.gr_gid in gids ]
+    except ValueError, e:
+        parser.error(str(e))
+
+    try:
+        export(opts.output, users, groups, opts.lustre, opts.beegfs)
+    except (IOError, OSError), e:
+        print >>sys.stderr, "qexport.py: {0}".format(e)
+        sys.exit(1)
@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Admin bulk scan: who is over their warning percentages right now.
+
+    qscan.py [-s snapshot] [-c [-l lustre] [-b beegfs]] [-m mount]
+             [-t percent] [-u | -g]
+
+Loads every quota record of the cluster-wide snapshot (snapshot.py), or
+with -c collects them live, into columnar arrays: mount, type, id, used
+bytes, block limit, inodes and inode limit.  Every record is checked
+against du.py's user and group warning percentages, or -t's, in a few
+passes over whole columns rather than one qcheck() per caller.  Offenders
+are written most over first, one line each.
+"""
+
+import array
+import itertools
+import sys
+
+from du import QCHECK_TABLE
+from rquota import USRQUOTA, GRPQUOTA
+from snapshot import SNAPSHOT_PATH, snap_record
+
+# column name: field of a snap_record tuple
+SCAN_FIELDS = {
+    "mount": 0,
+    "type": 1,
+    "id": 2,
+    "bc": 3,        # used, bytes
+    "bh": 5,        # block hard limit, KB
+    "ic": 7,        # inodes used
+    "ih": 9,        # inode hard limit
+}
+
+# offender, one report line
+SCAN_FORMAT = "{0:<16} {1:<5} {2:<16} {3:>10} {4:>6.1f}% {5:>12} {6:>12} " \
+              "{7:>6.1f}% {8:>10} {9:>10}\n"
+SCAN_HEADER = "{0:<16} {1:<5} {2:<16} {3:>10} {4:>7} {5:>12} {6:>12} " \
+              "{7:>7} {8:>10} {9:>10}\n".format(
+                  "mount", "type", "name", "id", "block", "used KB",
+                  "limit KB", "inode", "inodes", "limit")
+
+def scan_columns_raw(data):
+    """returns the columns of the packed snap_records in the string data,
+       read as 64-bit words without unpacking record by record"""
+    words = array.array("L")
+    if words.itemsize != 8 or sys.byteorder != "little":
+        return scan_columns(snap_record.unpack_from(data, off)
+                            for off in xrange(0, len(data), snap_record.size))
+    words.fromstring(data)
+    # mount, type and id share the record's first word
+    stride = snap_record.size / 8
+    key = words[0::stride]
+    cols = {
+        "mount": array.array("L", [ k & 0xffff for k in key ]),
+        "type": array.array("L", [ (k >> 16) & 0xffff for k in key ]),
+        "id": array.array("L", [ k >> 32 for k in key ]),
+    }
+    for name, field in SCAN_FIELDS.items():
+        if field >= 3:
+            # the eight quota fields follow the key word in order
+            cols[name] = words[field - 2::stride]
+    return cols
+
+def scan_columns(records):
+    """returns the columns of snap_record tuples"""
+    cols = dict([ (name, array.array("L")) for name in SCAN_FIELDS ])
+    fields = sorted(SCAN_FIELDS.items(), key = lambda f: f[1])
+    for r in records:
+        for name, field in fields:
+            cols[name].append(r[field])
+    return cols
+
+def scan_snapshot(path):
+    """returns (mount paths, columns) of every record in the snapshot"""
+    from snapshot import snapshot
+
+    snap = snapshot(path)
+    try:
+        mounts = [ m.path for m in snap.mounts ]
+        cols = scan_columns_raw(snap.map[snap.record_off:snap.index_off])
+    finally:
+        snap.close()
+    return (mounts, cols)
+
+def scan_collect(lustre, beegfs):
+    """returns (mount paths, columns) of records collected live"""
+    import grp
+    import pwd
+    from snapshot import snapshot_collect
+
+    mounts, records = snapshot_collect(pwd.getpwall(), grp.getgrall(),
+                                       lustre, beegfs)
+    return ([ m[0] for m in mounts ], scan_columns(records))
+
+def scan_percent(used, limit, scale = 1):
+    """returns the column of used as a percentage of limit, 0 where there
+       is no limit"""
+    return [ 100.0 * u / (l * scale) if l else 0.0
+             for u, l in itertools.izip(used, limit) ]
+
+def scan_offenders(cols, wp, mount = None, qtype = None):
+    """Returns the row numbers of records whose block or inode usage is
+       over their type's warning percentages in wp, a dictionary of type:
+       (block, inode) fractions, most over first, along with the block
+       and inode percentage columns.  Only rows of mount number mount
+       and type qtype are considered, if given."""
+    bp = scan_percent(cols["bc"], cols["bh"], 1 << 10)
+    ip = scan_percent(cols["ic"], cols["ih"])
+    # thresholds by type, as percentages
+    wb = dict([ (t, 100.0 * w[0]) for t, w in wp.items() ])
+    wi = dict([ (t, 100.0 * w[1]) for t, w in wp.items() ])
+
+    rows = [ i for i, (t, b, n) in enumerate(itertools.izip(cols["type"],
+                                                             bp, ip))
+             if t in wb and (b > wb[t] or n > wi[t]) ]
+    if mount is not None:
+        m = cols["mount"]
+        rows = [ i for i in rows if m[i] == mount ]
+    if qtype is not None:
+        t = cols["type"]
+        rows = [ i for i in rows if t[i] == qtype ]
+    rows.sort(key = lambda i: max(bp[i], ip[i]), reverse = True)
+    return (rows, bp, ip)
+
+def scan_report(out, mounts, cols, rows, bp, ip):
+    """writes a line per offender row to the file out"""
+    import grp
+    import pwd
+
+    # the snapshot's IDs come from getpwall()/getgrall() too, and an ID
+    # missing from them would cost a scan of the databases each
+    names = {
+        USRQUOTA: dict([ (p.pw_uid, p.pw_name) for p in pwd.getpwall() ]),
+        GRPQUOTA: dict([ (g.gr_gid, g.gr_name) for g in grp.getgrall() ]),
+    }
+
+    out.write(SCAN_HEADER)
+    buf = []
+    for i in rows:
+        qtype = cols["type"][i]
+        id = cols["id"][i]
+        buf.append(SCAN_FORMAT.format(
+            mounts[cols["mount"][i]],
+            "user" if qtype == USRQUOTA else "group",
+            names[qtype].get(id, id), id,
+            bp[i], cols["bc"][i] >> 10, cols["bh"][i],
+            ip[i], cols["ic"][i], cols["ih"][i]))
+        if len(buf) >= 512:
+            out.write("".join(buf))
+            buf = []
+    out.write("".join(buf))
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("-s", "--snapshot", action = "store",
+                      default = SNAPSHOT_PATH,
+                      help = "snapshot to scan, default " + SNAPSHOT_PATH)
+    parser.add_option("-c", "--collect", action = "store_true",
+                      default = False,
+                      help = "collect every quota now instead, as root")
+    parser.add_option("-l", "--lustre", action = "store", default = "/lustre",
+                      help = "with -c, lustre mount point, '' to skip, "
+                      "default /lustre")
+    parser.add_option("-b", "--beegfs", action = "store", default = "/common",
+                      help = "with -c, beegfs mount point, '' to skip, "
+                      "default /common")
+    parser.add_option("-m", "--mount", action = "store",
+                      help = "only report records on this mount point")
+    parser.add_option("-t", "--threshold", action = "store", type = "float",
+                      metavar = "PERCENT",
+                      help = "report usage over PERCENT of any quota instead "
+                      "of du.py's warning percentages")
+    parser.add_option("-u", "--users", action = "store_const",
+                      dest = "qtype", const = USRQUOTA,
+                      help = "only report user quotas")
+    parser.add_option("-g", "--groups", action = "store_const",
+                      dest = "qtype", const = GRPQUOTA,
+                      help = "only report group quotas")
+    (opts, args) = parser.parse_args()
+
+    try:
+        if opts.collect:
+            mounts, cols = scan_collect(opts.lustre, opts.beegfs)
+        else:
+            mounts, cols = scan_snapshot(opts.snapshot)
+    except (IOError, OSError, ValueError), e:
+        print >>sys.stderr, "qscan.py: {0}".format(e)
+        sys.exit(1)
+
+    mount = None
+    if opts.mount is not None:
+        if opts.mount not in mounts:
+            print >>sys.stderr, "qscan.py: {0}: no such mount" \
+                                .format(opts.mount)
+            sys.exit(1)
+        mount = mounts.index(opts.mount)
+
+    if opts.threshold is not None:
+        wp = dict.fromkeys([ USRQUOTA, GRPQUOTA ],
+                           (opts.threshold / 100.0, opts.threshold / 100.0))
+    else:
+        wp = dict([ (t, QCHECK_TABLE[t][:2]) for t in (USRQUOTA, GRPQUOTA) ])
+
+    rows, bp, ip = scan_offenders(cols, wp, mount, opts.qtype)
+    scan_report(sys.stdout, mounts, cols, rows, bp, ip)
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Usage bar rendering for du.py's default output.
+
+The SGR escape sequences for every bar style are worked out once per run
+by bar_render, rather than by colors.color() for each piece of every bar.
+Bars are appended to a list which the caller joins and writes once.  With
+neither color nor reverse video there is nothing to escape and bars are
+plain text.
+"""
+
+import math
+
+SGR_RESET = "\x1b[0m"
+
+# If percent usage is <= val, use color/style for bar background
+BAR_LEVELS = [
+    (           65, "green",  "negative+underline"),
+    (           85, "yellow", "bold+negative+underline"),
+    (float("inf"), "red",    "blink+bold+negative+underline"),
+]
+
+BI_UNITS = [ "GB", "TB", "PB", "EB", "ZB", "YB" ]
+
+def sgr_prefix(bg = None, style = None):
+    """returns the escape sequence colors.color() starts text with for bg
+       and style, "" if there is none"""
+    # colors pulls in re, plain bars don't need it
+    from colors import COLORS, STYLES
+
+    sgr = []
+    if bg:
+        sgr.append(str(40 + COLORS.index(bg)))
+    if style:
+        for st in style.split("+"):
+            sgr.append(str(1 + STYLES.index(st)))
+    if not sgr:
+        return ""
+    return "\x1b[" + ";".join(sgr) + "m"
+
+def sgr_wrap(prefix, s):
+    """colors.color() with a precompiled prefix"""
+    if not prefix:
+        return s
+    return prefix + s + SGR_RESET
+
+class bar_render(object):
+    """Renders usage bars in the style du.py's options ask for"""
+
+    def __init__(self, opts):
+        self.fill = opts.fill
+        self.plain = opts.color != "a" and not opts.reverse
+        if self.plain:
+            return
+
+        # used portion prefix for each of BAR_LEVELS, or when none match
+        self.default_prefix = sgr_prefix(style = "underline")
+        self.levels = []
+        for val, bar_color, style in BAR_LEVELS:
+            self.levels.append((val,
+                sgr_prefix(bar_color if opts.color == "a" else None,
+                           style if opts.reverse else "underline")))
+
+        # the remainder is filled with the following style
+        self.fill_prefix = sgr_prefix(style = "underline") \
+                           if opts.color == "a" or opts.reverse else ""
+
+    def bar(self, out, txt = None, used = 0, total = 100, length = 30,
+            order = 30):
+        """Appends a bar graphic indicating disk usage to the list out"""
+
+        # Consider no quota as positive infinity
+        if total is None:
+            total = float("inf")
+
+        try:
+            percent = 100.0 * used / total
+        except ZeroDivisionError:
+            percent = 0.0
+
+        # Reduce the length to account for the two brackets on the ends
+        length = length - 2
+
+        # Num chars in bar which are marked used
+        try:
+            used_len = int(math.ceil(1.0 * length * used / total))
+        except ZeroDivisionError:
+            used_len = 0
+
+        # Space usage description
+        # Example: 10% (10 / 100GB)
+        if txt is None:
+            if order == 30:
+                ui = 0
+                ti = 0
+                while used >= 1024:
+                    used = used / 1024
+                    ui = ui + 1
+                while total >= 1024:
+                    total = total / 1024
+                    ti = ti + 1
+                txt = "{0:.1f}% ({1:g}{2}/{3:g}{4})".format(
+                    percent, round(used, 1), BI_UNITS[ui],
+                    round(total, 1), BI_UNITS[ti])
+            else:
+                txt = "{0:.1f}% ({1:g}/{2:g})".format(
+                    percent, round(used, 1), round(total, 1))
+
+        # Pad description to bar length
+        txt = txt.ljust(length)[:length]
+        utxt = txt[:used_len]
+        ftxt = txt[used_len:]
+        if self.fill:
+            utxt = utxt.replace(" ", "=")
+            ftxt = ftxt.replace(" ", "-")
+
+        if self.plain:
+            out.extend(("[", utxt, ftxt, "]"))
+            return
+
+        for val, prefix in self.levels:
+            if percent <= val:
+                break
+        else:
+            prefix = self.default_prefix
+        out.extend(("[", sgr_wrap(prefix, utxt),
+                    sgr_wrap(self.fill_prefix, ftxt), "]"))
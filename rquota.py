@@ -4,10 +4,14 @@
 import collections
 import operator
 import os
-import subprocess
 import sys
+import time
 import pwd
 
+# subprocess and sunrpc (socket, xdrlib) are imported where used, du.py
+# logins answered from its caches never need them
+from timings import timings_begin, timings_end, timings_call
+
 # used in rquota_t.type
 USRQUOTA = 0
 GRPQUOTA = 1
@@ -30,63 +34,304 @@ rquota_t = collections.namedtuple("rquota_t",
                                      "dqb_itime"
                                   ])
 
-def rquota_get(path, query_supplementary = False):
+QUOTA_BINARY = "/usr/bin/quota"
+
+# rquota protocol, see rquota.x in quota-tools
+RQUOTAPROG = 100011
+RQUOTAVERS = 1           # getquota_args: pathp, uid
+EXT_RQUOTAVERS = 2       # ext_getquota_args: pathp, type, id
+RQUOTAPROC_GETQUOTA = 1
+Q_OK = 1
+Q_NOQUOTA = 2
+Q_EPERM = 3
+
+# rpc.rquotad transport, port None asks the server's portmapper
+RQUOTA_PROTO = "udp"
+RQUOTA_PORT = None
+
+def rquota_parse(qstdout):
+    """Parses quota -v -p -w output into a list of rquota_t objects, one
+       per "Disk quotas for" block, from the first line of each."""
+    ret = []
+    # "Disk quotas for" line of the current block, split
+    lt = None
+    for l in qstdout.split("\n"):
+        if l.startswith("Disk quotas for"):
+            lt = l.split()
+            continue
+        ql = l.split()
+        # skip column headers and anything outside of a block
+        if lt is None or len(ql) < 9 or ql[0] == "Filesystem":
+            continue
+        ret.append(rquota_t(USRQUOTA if lt[3] == "user" else GRPQUOTA,
+                            int(lt[6].split(")")[0]),
+                            int(ql[1].split("*")[0]) * (1 << 10), # in bytes
+                            int(ql[2].split("*")[0]),
+                            int(ql[3].split("*")[0]),
+                            int(ql[4].split("*")[0]),
+                            int(ql[5].split("*")[0]),
+                            int(ql[6].split("*")[0]),
+                            int(ql[7].split("*")[0]),
+                            int(ql[8].split("*")[0])))
+        # one line per block
+        lt = None
+    return ret
+
+def rquota_get_binary(path, query_supplementary = False):
     """Calls out to the quota binary to collect user/group rpc.rquotad
        info on path.  Returns a list of rquota_t objects in order UID,
        GID, followed by supplemental GID(s) of the calling user."""
+    import subprocess
+
     # user quota list
     uql = []
     if type(path) is not str:
         return uql
     # see "man quota"
-    QUOTA = "/usr/bin/quota " \
-            "-F rpc -v -p -w -u -g -Q -f {0}".format(path).rsplit(" ")
+    QUOTA = "{0} -F rpc -v -p -w -u -g -Q -f {1}" \
+            .format(QUOTA_BINARY, path).rsplit(" ")
     # quota standard output read into string
+    t = timings_begin("quota")
     try:
         qstdout = subprocess.Popen(QUOTA,
                                    stdout = subprocess.PIPE,
                                    stderr = subprocess.STDOUT).communicate()[0]
     except:
         return uql
+    finally:
+        timings_end(t)
     uid = os.getuid()
     gid = os.getgid()
     # index 0 reserved for primary user quota
     uql.append(None)
     # index 1 reserved for primary group quota
     uql.append(None)
-    # split string blob into a list of lines
-    qlines = qstdout.split("\n")
-    for l in qlines:
-        if l.startswith("Disk quotas for"):
-            # info we're after is two lines later
-            qi = qlines.index(l) + 2
-            ql = qlines[qi].split()
-            lt = l.split()
-            qt = rquota_t(USRQUOTA if lt[3] == "user" else GRPQUOTA,
-                          int(lt[6].split(")")[0]),
-                          int(ql[1].split("*")[0]) * (1 << 10), # in bytes
-                          int(ql[2].split("*")[0]),
-                          int(ql[3].split("*")[0]),
-                          int(ql[4].split("*")[0]),
-                          int(ql[5].split("*")[0]),
-                          int(ql[6].split("*")[0]),
-                          int(ql[7].split("*")[0]),
-                          int(ql[8].split("*")[0]))
-            if lt[3] == "user":
-                if uid == qt.id:
-                    uql[0] = qt
-            elif lt[3] == "group":
-                if gid == qt.id:
-                    uql[1] = qt
-                elif query_supplementary:
-                    uql.append(qt)
+    for qt in rquota_parse(qstdout):
+        if qt.type == USRQUOTA:
+            if uid == qt.id:
+                uql[0] = qt
+        else:
+            if gid == qt.id:
+                uql[1] = qt
+            elif query_supplementary:
+                uql.append(qt)
     return [] if ((uql[0] is None) or (uql[1] is None)) else uql
 
+def rquota_mount_device(path):
+    """returns the "server:/export" device of the NFS mount at path, as
+       listed in quota's Filesystem column, or None"""
+    try:
+        f = open("/proc/mounts")
+        try:
+            for l in f:
+                m = l.split()
+                if len(m) > 1 and m[1] == path:
+                    return m[0]
+        finally:
+            f.close()
+    except IOError:
+        pass
+    return None
+
+def rquota_split_device(device):
+    """returns (host, export path) of an NFS "host:/export" device"""
+    if device.startswith("["):
+        # [ipv6]:/export
+        host, export = device[1:].split("]:", 1)
+    else:
+        host, export = device.split(":", 1)
+    return (host, export)
+
+def rquota_rpc_unpack(u, qtype, id):
+    """returns an rquota_t from a getquota_rslt Unpacker, None if the
+       server won't tell us"""
+    status = u.unpack_enum()
+    if status == Q_NOQUOTA:
+        return rquota_t(qtype, id, 0, 0, 0, 0, 0, 0, 0, 0)
+    if status != Q_OK:
+        return None
+    bsize = u.unpack_int()
+    u.unpack_bool()             # rq_active
+    bhardlimit = u.unpack_uint()
+    bsoftlimit = u.unpack_uint()
+    curblocks = u.unpack_uint()
+    fhardlimit = u.unpack_uint()
+    fsoftlimit = u.unpack_uint()
+    curfiles = u.unpack_uint()
+    btimeleft = u.unpack_uint()
+    ftimeleft = u.unpack_uint()
+    # as quota -p: grace as seconds since epoch, 0 if not running
+    now = int(time.time())
+    return rquota_t(qtype, id,
+                    curblocks * bsize,                  # in bytes
+                    bsoftlimit * bsize / (1 << 10),     # in KB
+                    bhardlimit * bsize / (1 << 10),
+                    now + btimeleft if btimeleft else 0,
+                    curfiles,
+                    fsoftlimit,
+                    fhardlimit,
+                    now + ftimeleft if ftimeleft else 0)
+
+def rquota_client(host, vers, clients):
+    """Returns an rpc_client for rpc.rquotad version vers on host, reusing
+       one kept in the dictionary clients if given.  None means host is
+       known not to serve vers."""
+    from sunrpc import rpc_client
+
+    if clients is not None and (host, vers) in clients:
+        return clients[(host, vers)]
+    c = rpc_client(host, RQUOTAPROG, vers, RQUOTA_PROTO, RQUOTA_PORT)
+    if clients is not None:
+        clients[(host, vers)] = c
+    return c
+
+def rquota_release(c, host, vers, clients, ok):
+    """closes c after a call unless it is kept in clients, forgetting it
+       if the call failed"""
+    if clients is not None and ok:
+        return
+    if clients is not None and clients.get((host, vers)) is c:
+        del clients[(host, vers)]
+    c.close()
+
+def rquota_rpc(host, export, queries, clients = None):
+    """Asks rpc.rquotad on host directly for export's quota, pipelining
+       every (type, id) in queries over one socket.  Returns a dictionary
+       of (type, id): rquota_t object.  Servers without the extended
+       protocol only answer for users.  Long-running callers pass a
+       dictionary clients to keep connections in between calls, which
+       must not be made concurrently for the same host."""
+    import xdrlib
+    from sunrpc import rpc_error, PROG_MISMATCH, PROG_UNAVAIL
+
+    ret = {}
+    try:
+        c = rquota_client(host, EXT_RQUOTAVERS, clients)
+    except rpc_error, e:
+        if e.stat != PROG_UNAVAIL:
+            raise
+        c = None
+        if clients is not None:
+            clients[(host, EXT_RQUOTAVERS)] = None
+
+    if c is not None:
+        ok = False
+        try:
+            args = []
+            for qtype, id in queries:
+                p = xdrlib.Packer()
+                p.pack_string(export)
+                p.pack_int(qtype)
+                p.pack_int(id)
+                args.append(p.get_buffer())
+            rs = c.calls(RQUOTAPROC_GETQUOTA, args)
+            ok = True
+        except rpc_error, e:
+            if e.stat != PROG_MISMATCH:
+                raise
+            rs = None
+        finally:
+            rquota_release(c, host, EXT_RQUOTAVERS, clients, ok)
+        if rs is not None:
+            for (qtype, id), u in zip(queries, rs):
+                q = rquota_rpc_unpack(u, qtype, id)
+                if q is not None:
+                    ret[(qtype, id)] = q
+            return ret
+        if clients is not None:
+            clients[(host, EXT_RQUOTAVERS)] = None
+
+    # version 1, users only
+    queries = [ (qtype, id) for qtype, id in queries if qtype == USRQUOTA ]
+    c = rquota_client(host, RQUOTAVERS, clients)
+    ok = False
+    try:
+        args = []
+        for qtype, id in queries:
+            p = xdrlib.Packer()
+            p.pack_string(export)
+            p.pack_int(id)
+            args.append(p.get_buffer())
+        rs = c.calls(RQUOTAPROC_GETQUOTA, args)
+        ok = True
+    finally:
+        rquota_release(c, host, RQUOTAVERS, clients, ok)
+    for (qtype, id), u in zip(queries, rs):
+        q = rquota_rpc_unpack(u, qtype, id)
+        if q is not None:
+            ret[(qtype, id)] = q
+    return ret
+
+def rquota_get(path, query_supplementary = False):
+    """Asks rpc.rquotad for user/group info on path.  Returns a list of
+       rquota_t objects in order UID, GID, followed by supplemental GID(s)
+       of the calling user.  Falls back to the quota binary if path isn't
+       an NFS mount."""
+    if type(path) is not str:
+        return []
+
+    # place primary GID at the start of the list
+    gid = os.getgid()
+    if query_supplementary:
+        grps = sorted(set(os.getgroups()) - set([ gid ]))
+    else:
+        grps = list()
+
+    uql = rquota_get_user(path, os.getuid(), [ gid ] + grps)
+    if uql is None:
+        return rquota_get_binary(path, query_supplementary)
+    return uql
+
+def rquota_get_user(path, uid, gids, clients = None):
+    """Asks rpc.rquotad for info on path for uid and every GID in gids,
+       primary first.  Returns a list of rquota_t objects in order UID,
+       GIDs, or None if path isn't an NFS mount.  clients is passed on to
+       rquota_rpc()."""
+    device = rquota_mount_device(path)
+    if device is None or ":" not in device:
+        return None
+
+    host, export = rquota_split_device(device)
+    return rquota_get_export(host, export, uid, gids, clients)
+
+def rquota_get_export(host, export, uid, gids, clients = None):
+    """Asks rpc.rquotad on host for info on export for uid and every GID
+       in gids, as rquota_get_user() does for a mounted path"""
+    qd = timings_call("rquotad " + host, rquota_rpc, host, export,
+                      [ (USRQUOTA, uid) ] +
+                      [ (GRPQUOTA, g) for g in gids ], clients)
+
+    # index 0 reserved for primary user quota, 1 for primary group quota
+    uql = [ qd.get((USRQUOTA, uid)), qd.get((GRPQUOTA, gids[0])) ]
+    for g in gids[1:]:
+        if (GRPQUOTA, g) in qd:
+            uql.append(qd[(GRPQUOTA, g)])
+    return [] if ((uql[0] is None) or (uql[1] is None)) else uql
+
+def rquota_get_ids(path, qtype, ids):
+    """Asks rpc.rquotad for info on path for every UID (qtype USRQUOTA)
+       or GID (GRPQUOTA) in ids, normally as root.  Returns a dictionary of
+       id: rquota_t object."""
+    ret = {}
+    if type(path) is not str or not ids:
+        return ret
+    device = rquota_mount_device(path)
+    if device is None or ":" not in device:
+        return ret
+    host, export = rquota_split_device(device)
+    for (t, id), q in rquota_rpc(host, export,
+                                 [ (qtype, i) for i in ids ]).items():
+        ret[id] = q
+    return ret
+
 def rquota_find_home_mount():
     """find the file system mount point that holds the home path for the
        calling user"""
     pwe = pwd.getpwuid(os.getuid())
-    path = pwe.pw_dir
+    return rquota_find_mount(pwe.pw_dir)
+
+def rquota_find_mount(path):
+    """find the file system mount point that holds path"""
     # stat home directory path
     shd = os.stat(path)
     # path components
@@ -0,0 +1,385 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Cluster-wide quota snapshot, collected in bulk by an admin from cron and
+looked up per user by du.py without contacting any quota server.
+
+File layout, all little-endian, fixed size records:
+    header      snap_header
+    mounts      snap_mount * header.mounts
+    records     snap_record * header.records
+    index       snap_slot * header.slots
+
+The index is an open addressing hash table of (mount, type, id) keys
+holding record number + 1, 0 for an empty slot, read through mmap so a
+lookup touches a handful of pages.
+
+Quota usage and limits are deliberately public on these clusters.  The
+snapshot is written mode 0644 so that du.py, running as each user, can
+mmap it, and every user's and group's records in it are readable by
+anyone on the node.  That discloses nothing rpc.rquotad, which answers
+GETQUOTA for any ID, or lfs quota don't already.  Sites treating quotas
+as private must not deploy the snapshot; du.py falls back to live
+queries without it.
+
+    snapshot.py [-o output] [-p primary gid index] [-l lustre mount]
+                [-b beegfs mount]
+"""
+
+import collections
+import mmap
+import os
+import struct
+import sys
+import time
+
+# tempfile (and with it random) is imported by the writers, readers in
+# du.py login shells never need it
+from collect import statvfs_t, stat_t, probe_mount
+from rquota import USRQUOTA, GRPQUOTA, rquota_t, rquota_get_ids
+from lquota import if_quotactl, lquota_get_many
+from bquota import bquota_t, call_beegfs_ctl
+
+SNAPSHOT_PATH = "/util/opt/bin/hcc/du/snapshot/quota.snap"
+# read by lgq, see PRIMARY_GID_INDEX in lgq/lgq.c
+PRIMARY_GID_INDEX = "/util/opt/bin/hcc/du/snapshot/primary_gid"
+SNAPSHOT_MAGIC = "HCCDUSNP"
+SNAPSHOT_VERSION = 1
+
+# snap_mount.kind, which backend collected the mount's records
+KIND_RQUOTA = 0
+KIND_LQUOTA = 1
+KIND_BQUOTA = 2
+
+# ids per quota/beegfs-ctl invocation when collecting
+CHUNK = 512
+
+# magic, version, record size, created, mounts, records, slots
+snap_header = struct.Struct("<8sHHdIII")
+# path, kind, st_uid, st_gid, f_bsize, f_blocks, f_bavail, f_files, f_favail
+snap_mount = struct.Struct("<256sIIIQQQQQ")
+# mount, type, id, curspace, bsoftlimit, bhardlimit, btime,
+#                  curinodes, isoftlimit, ihardlimit, itime
+snap_record = struct.Struct("<HHI8Q")
+snap_slot = struct.Struct("<I")
+
+# snap_mount, decoded
+mount_t = collections.namedtuple("mount_t",
+                                 [
+                                    "idx",
+                                    "path",
+                                    "kind",
+                                    "svfs",
+                                    "stat"
+                                 ])
+
+def snapshot_hash(mount, qtype, id):
+    """hash of a record key, mask with the slot count - 1"""
+    return (id * 2654435761 + ((mount << 1) | qtype) * 40503) & 0xffffffff
+
+def snapshot_record(mount, q):
+    """returns a snap_record tuple for an rquota_t, bquota_t or
+       if_quotactl q in mount number mount"""
+    if isinstance(q, if_quotactl):
+        return (mount, q.qc_type, q.qc_id,
+                q.dqb_curspace, q.dqb_bsoftlimit, q.dqb_bhardlimit, 0,
+                q.dqb_curinodes, q.dqb_isoftlimit, q.dqb_ihardlimit, 0)
+    return (mount, q.type, q.id,
+            q.dqb_curspace, q.dqb_bsoftlimit, q.dqb_bhardlimit, q.dqb_btime,
+            q.dqb_curinodes, q.dqb_isoftlimit, q.dqb_ihardlimit, q.dqb_itime)
+
+def snapshot_write(path, mounts, records, mode = 0644):
+    """Atomically writes a snapshot to path, world readable by default, see
+       above.  mounts is a list of (path, kind, statvfs_t, stat_t), records
+       a list of snap_record tuples whose mount number indexes mounts."""
+    import tempfile
+
+    slots = 1
+    while slots < 2 * len(records):
+        slots <<= 1
+    index = [ 0 ] * slots
+    mask = slots - 1
+    for n in range(len(records)):
+        h = snapshot_hash(*records[n][:3]) & mask
+        while index[h]:
+            h = (h + 1) & mask
+        index[h] = n + 1
+
+    fd, tmp = tempfile.mkstemp(prefix = os.path.basename(path) + ".",
+                               dir = os.path.dirname(path) or ".")
+    try:
+        f = os.fdopen(fd, "wb")
+        try:
+            f.write(snap_header.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                     snap_record.size, time.time(),
+                                     len(mounts), len(records), slots))
+            for (mp, kind, svfs, st) in mounts:
+                f.write(snap_mount.pack(mp, kind, st.st_uid, st.st_gid,
+                                        *svfs))
+            for r in records:
+                f.write(snap_record.pack(*r))
+            f.write(struct.pack("<{0}I".format(slots), *index))
+        finally:
+            f.close()
+        os.chmod(tmp, mode)
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+class snapshot(object):
+    """Read-only, mmap backed view of a snapshot file"""
+
+    def __init__(self, path):
+        f = open(path, "rb")
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        (magic, version, rsize, self.created,
+         nmounts, self.records, self.slots) = \
+            snap_header.unpack_from(self.map, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or \
+           rsize != snap_record.size:
+            self.map.close()
+            raise ValueError("{0}: not a version {1} snapshot"
+                             .format(path, SNAPSHOT_VERSION))
+
+        self.mounts = []
+        off = snap_header.size
+        for i in range(nmounts):
+            m = snap_mount.unpack_from(self.map, off)
+            self.mounts.append(mount_t(i, m[0].rstrip("\0"), m[1],
+                                       statvfs_t(*m[4:]),
+                                       stat_t(m[2], m[3])))
+            off += snap_mount.size
+        self.record_off = off
+        self.index_off = off + self.records * snap_record.size
+
+    def close(self):
+        self.map.close()
+
+    def mount(self, path):
+        """returns the mount_t for mount point path, or None"""
+        for m in self.mounts:
+            if m.path == path:
+                return m
+        return None
+
+    def mount_of(self, path, kind):
+        """returns the mount_t of the given kind holding path, the longest
+           matching mount point, or None"""
+        ret = None
+        for m in self.mounts:
+            if m.kind != kind:
+                continue
+            if path == m.path or path.startswith(m.path.rstrip("/") + "/"):
+                if ret is None or len(m.path) > len(ret.path):
+                    ret = m
+        return ret
+
+    def lookup(self, m, qtype, id):
+        """returns the quota record for id in mount_t m as the type the
+           mount's backend returns, or None"""
+        mask = self.slots - 1
+        h = snapshot_hash(m.idx, qtype, id) & mask
+        while True:
+            n = snap_slot.unpack_from(self.map,
+                                      self.index_off + h * snap_slot.size)[0]
+            if not n:
+                return None
+            r = snap_record.unpack_from(self.map, self.record_off +
+                                        (n - 1) * snap_record.size)
+            if r[0] == m.idx and r[1] == qtype and r[2] == id:
+                break
+            h = (h + 1) & mask
+
+        if m.kind == KIND_LQUOTA:
+            return if_quotactl(r[1], r[2], r[5], r[4], r[3], r[9], r[8], r[7])
+        elif m.kind == KIND_BQUOTA:
+            return bquota_t(*r[1:])
+        return rquota_t(*r[1:])
+
+    def get(self, m, uid, gid, grps):
+        """returns quota records for mount_t m in the order the backend
+           returns them, UID, GID followed by supplementary GIDs grps, or
+           None if the UID or GID isn't in the snapshot"""
+        ret = [ self.lookup(m, USRQUOTA, uid), self.lookup(m, GRPQUOTA, gid) ]
+        if ret[0] is None or ret[1] is None:
+            return None
+        for g in grps:
+            ret.append(self.lookup(m, GRPQUOTA, g))
+        return ret
+
+def snapshot_open(path = SNAPSHOT_PATH):
+    """returns a snapshot object for path, or None if it can't be read"""
+    try:
+        return snapshot(path)
+    except (IOError, OSError, ValueError, struct.error, mmap.error):
+        return None
+
+def nfs_mounts():
+    """returns a list of NFS mount points from /proc/mounts"""
+    ret = []
+    f = open("/proc/mounts")
+    try:
+        for l in f:
+            m = l.split()
+            if len(m) > 2 and m[2] in ("nfs", "nfs4"):
+                ret.append(m[1])
+    finally:
+        f.close()
+    return ret
+
+def chunks(ids):
+    """splits ids into lists of up to CHUNK ids"""
+    return [ ids[i:i + CHUNK] for i in range(0, len(ids), CHUNK) ]
+
+def primary_gid_write(path, users):
+    """Atomically writes lgq's "gid uid" index of users' primary groups"""
+    import tempfile
+
+    fd, tmp = tempfile.mkstemp(prefix = os.path.basename(path) + ".",
+                               dir = os.path.dirname(path) or ".")
+    try:
+        f = os.fdopen(fd, "w")
+        try:
+            for gid, uid in sorted(set([ (p.pw_gid, p.pw_uid)
+                                         for p in users ])):
+                f.write("{0} {1}\n".format(gid, uid))
+        finally:
+            f.close()
+        os.chmod(tmp, 0644)
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+def snapshot_scan(users, groups, lustre, beegfs, mounts, errors = None):
+    """Collects user and group quotas for every passwd entry in users and
+       group entry in groups on each NFS home mount, lustre and beegfs,
+       CHUNK IDs at a time.  Appends each mount collected to the list
+       mounts as (path, kind, statvfs_t, stat_t) and yields its number and
+       a list of snap_record tuples per chunk.  A chunk whose query fails
+       is reported on stderr and yielded without records, counted per
+       mount number in the dictionary errors if given, and the scan goes
+       on with the next."""
+    from sunrpc import rpc_error
+
+    uids = sorted(set([ p.pw_uid for p in users ]))
+    gids = sorted(set([ g.gr_gid for g in groups ] +
+                      [ p.pw_gid for p in users ]))
+
+    def add(path, kind):
+        try:
+            svfs, st = probe_mount(path)
+        except OSError, e:
+            print >>sys.stderr, "{0}: {1}".format(path, e.strerror)
+            return None
+        mounts.append((path, kind, svfs, st))
+        return len(mounts) - 1
+
+    def scan(idx, get, sets):
+        for qtype, ids in sets:
+            for c in chunks(ids):
+                try:
+                    records = get(idx, qtype, c)
+                except (EnvironmentError, IndexError, ValueError,
+                        rpc_error), e:
+                    print >>sys.stderr, "{0}: {1} quotas {2}-{3}: {4}" \
+                        .format(mounts[idx][0],
+                                "user" if qtype == USRQUOTA else "group",
+                                c[0], c[-1], e)
+                    if errors is not None:
+                        errors[idx] = errors.get(idx, 0) + 1
+                    records = []
+                yield (idx, records)
+
+    def rquota_records(idx, qtype, c):
+        return [ snapshot_record(idx, q) for q in
+                 rquota_get_ids(mounts[idx][0], qtype, c).values() ]
+
+    def lquota_records(idx, qtype, c):
+        t = lquota_get_many(lustre, qtype, c)
+        # skip IDs whose quota lustre wouldn't give
+        return [ (idx, qtype, t.qc_id[i],
+                  t.dqb_curspace[i], t.dqb_bsoftlimit[i],
+                  t.dqb_bhardlimit[i], 0,
+                  t.dqb_curinodes[i], t.dqb_isoftlimit[i],
+                  t.dqb_ihardlimit[i], 0)
+                 for i in xrange(len(t)) if not t.errno[i] ]
+
+    def bquota_records(idx, qtype, c):
+        return [ snapshot_record(idx, q) for q in
+                 call_beegfs_ctl(qtype, beegfs, c).values() ]
+
+    # users' quota only on the NFS mount holding their home, groups on all
+    homes = {}
+    nfs = nfs_mounts()
+    for p in users:
+        mp = None
+        for n in nfs:
+            if p.pw_dir == n or p.pw_dir.startswith(n.rstrip("/") + "/"):
+                if mp is None or len(n) > len(mp):
+                    mp = n
+        if mp is not None:
+            homes.setdefault(mp, set()).add(p.pw_uid)
+
+    for mp in sorted(homes.keys()):
+        idx = add(mp, KIND_RQUOTA)
+        if idx is None:
+            continue
+        for r in scan(idx, rquota_records,
+                      ((USRQUOTA, sorted(homes[mp])), (GRPQUOTA, gids))):
+            yield r
+
+    for path, kind, get in ((lustre, KIND_LQUOTA, lquota_records),
+                            (beegfs, KIND_BQUOTA, bquota_records)):
+        if path:
+            idx = add(path, kind)
+            if idx is not None:
+                for r in scan(idx, get, ((USRQUOTA, uids),
+                                         (GRPQUOTA, gids))):
+                    yield r
+
+def snapshot_collect(users, groups, lustre, beegfs):
+    """Collects user and group quotas for every passwd entry in users and
+       group entry in groups on each NFS home mount, lustre and beegfs.
+       Returns (mounts, records) as taken by snapshot_write."""
+    mounts = []
+    records = []
+    for idx, chunk in snapshot_scan(users, groups, lustre, beegfs, mounts):
+        records.extend(chunk)
+    return (mounts, records)
+
+if __name__ == "__main__":
+    import grp
+    import pwd
+    from optparse import OptionParser
+
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("-o", "--output", action = "store",
+                      default = SNAPSHOT_PATH,
+                      help = "snapshot file to write, default " +
+                      SNAPSHOT_PATH)
+    parser.add_option("-p", "--primary-gid-index", action = "store",
+                      default = PRIMARY_GID_INDEX,
+                      help = "lgq primary group index to write, '' to skip, "
+                      "default " + PRIMARY_GID_INDEX)
+    parser.add_option("-l", "--lustre", action = "store", default = "/lustre",
+                      help = "lustre mount point, '' to skip, "
+                      "default /lustre")
+    parser.add_option("-b", "--beegfs", action = "store", default = "/common",
+                      help = "beegfs mount point, '' to skip, "
+                      "default /common")
+    (opts, args) = parser.parse_args()
+
+    users = pwd.getpwall()
+    if opts.primary_gid_index:
+        primary_gid_write(opts.primary_gid_index, users)
+
+    mounts, records = snapshot_collect(users, grp.getgrall(),
+                                       opts.lustre, opts.beegfs)
+    snapshot_write(opts.output, mounts, records)
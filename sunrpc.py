@@ -0,0 +1,237 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Minimal ONC/Sun RPC v2 client, RFC 5531, over UDP or TCP.  Calls to one
+program are pipelined over a single socket: every request is sent before
+any reply is waited on and replies are matched back by xid.
+"""
+
+import os
+import random
+import select
+import socket
+import struct
+import time
+import xdrlib
+
+RPC_VERSION = 2
+
+# msg_type
+CALL = 0
+REPLY = 1
+
+# reply_stat
+MSG_ACCEPTED = 0
+MSG_DENIED = 1
+
+# accept_stat
+SUCCESS = 0
+PROG_UNAVAIL = 1
+PROG_MISMATCH = 2
+PROC_UNAVAIL = 3
+GARBAGE_ARGS = 4
+SYSTEM_ERR = 5
+
+# auth_flavor
+AUTH_NULL = 0
+AUTH_UNIX = 1
+
+PMAP_PROG = 100000
+PMAP_VERS = 2
+PMAP_PORT = 111
+PMAPPROC_GETPORT = 3
+
+IPPROTO = { "tcp": 6, "udp": 17 }
+
+# seconds to wait on all replies to a batch of calls
+RPC_TIMEOUT = 10.0
+# first UDP retransmit, doubling after each
+RPC_RETRY = 0.5
+
+class rpc_error(Exception):
+    """RPC level failure: timeout, rejected or unaccepted call"""
+
+    def __init__(self, msg, stat = None):
+        Exception.__init__(self, msg)
+        self.stat = stat
+
+def auth_unix():
+    """returns (flavor, body) AUTH_UNIX credentials of the calling process"""
+    p = xdrlib.Packer()
+    p.pack_uint(int(time.time()) & 0xffffffff)
+    p.pack_string(socket.gethostname()[:255])
+    p.pack_uint(os.getuid())
+    p.pack_uint(os.getgid())
+    p.pack_array(os.getgroups()[:16], p.pack_uint)
+    return (AUTH_UNIX, p.get_buffer())
+
+def call_packet(xid, prog, vers, proc, cred, args):
+    """returns a packed call message, args already XDR encoded"""
+    p = xdrlib.Packer()
+    p.pack_uint(xid)
+    p.pack_enum(CALL)
+    p.pack_uint(RPC_VERSION)
+    p.pack_uint(prog)
+    p.pack_uint(vers)
+    p.pack_uint(proc)
+    p.pack_enum(cred[0])
+    p.pack_opaque(cred[1])
+    p.pack_enum(AUTH_NULL)
+    p.pack_opaque("")
+    return p.get_buffer() + args
+
+def reply_unpacker(data):
+    """returns (xid, Unpacker positioned at the results) for a reply
+       message, raising rpc_error if the call wasn't successful"""
+    u = xdrlib.Unpacker(data)
+    xid = u.unpack_uint()
+    if u.unpack_enum() != REPLY:
+        raise rpc_error("not a reply")
+    if u.unpack_enum() != MSG_ACCEPTED:
+        raise rpc_error("call denied")
+    u.unpack_enum()
+    u.unpack_opaque()
+    stat = u.unpack_enum()
+    if stat != SUCCESS:
+        raise rpc_error("call not accepted, status {0}".format(stat), stat)
+    return (xid, u)
+
+class rpc_client(object):
+    """Client for one RPC program version on host, over a single socket"""
+
+    def __init__(self, host, prog, vers, proto = "udp", port = None,
+                 cred = None, timeout = RPC_TIMEOUT):
+        self.prog = prog
+        self.vers = vers
+        self.proto = proto
+        self.cred = cred or auth_unix()
+        self.timeout = timeout
+        self.xid = random.randint(0, 0xffffffff)
+
+        if port is None:
+            port = pmap_getport(host, prog, vers, proto, timeout)
+            if not port:
+                raise rpc_error("program {0} version {1} not registered "
+                                "on {2}".format(prog, vers, host),
+                                PROG_UNAVAIL)
+
+        socktype = socket.SOCK_STREAM if proto == "tcp" else socket.SOCK_DGRAM
+        family, socktype, pr, cn, addr = \
+            socket.getaddrinfo(host, port, 0, socktype)[0]
+        self.sock = socket.socket(family, socktype, pr)
+        self.sock.settimeout(timeout)
+        try:
+            # connected UDP only sees replies from the server
+            self.sock.connect(addr)
+        except:
+            self.sock.close()
+            raise
+        self.sock.setblocking(0)
+        self.buf = ""
+
+    def close(self):
+        self.sock.close()
+
+    def next_xid(self):
+        self.xid = (self.xid + 1) & 0xffffffff
+        return self.xid
+
+    def send_record(self, data):
+        """TCP record marking, one last fragment per message"""
+        data = struct.pack(">I", 0x80000000 | len(data)) + data
+        self.sock.setblocking(1)
+        try:
+            self.sock.sendall(data)
+        finally:
+            self.sock.setblocking(0)
+
+    def recv_records(self):
+        """returns the TCP messages now complete in the receive buffer"""
+        data = self.sock.recv(1 << 16)
+        if not data:
+            raise rpc_error("connection closed")
+        self.buf += data
+        ret = []
+        frag = ""
+        while len(self.buf) >= 4:
+            n = struct.unpack(">I", self.buf[:4])[0]
+            if len(self.buf) < 4 + (n & 0x7fffffff):
+                break
+            frag += self.buf[4:4 + (n & 0x7fffffff)]
+            self.buf = self.buf[4 + (n & 0x7fffffff):]
+            if n & 0x80000000:
+                ret.append(frag)
+                frag = ""
+        # keep a partial multi-fragment message for next time
+        if frag:
+            self.buf = struct.pack(">I", len(frag)) + frag + self.buf
+        return ret
+
+    def calls(self, proc, args):
+        """Calls proc once for every XDR encoded argument string in args,
+           all at once.  Returns a list of result Unpackers in args order.
+           Raises rpc_error if any call fails or times out."""
+        pending = {}
+        for i in range(len(args)):
+            xid = self.next_xid()
+            pending[xid] = (i, call_packet(xid, self.prog, self.vers, proc,
+                                           self.cred, args[i]))
+        results = [ None ] * len(args)
+
+        start = time.time()
+        retry = RPC_RETRY
+        resend = start
+        while pending:
+            now = time.time()
+            if now - start >= self.timeout:
+                raise rpc_error("timed out")
+            if now >= resend:
+                for i, packet in pending.values():
+                    if self.proto == "tcp":
+                        self.send_record(packet)
+                    else:
+                        self.sock.send(packet)
+                # TCP doesn't lose messages, only send them once
+                if self.proto == "tcp":
+                    resend = float("inf")
+                else:
+                    resend = now + retry
+                    retry *= 2
+            wait = min(resend, start + self.timeout) - now
+            if not select.select([ self.sock ], [], [], max(wait, 0))[0]:
+                continue
+
+            if self.proto == "tcp":
+                replies = self.recv_records()
+            else:
+                try:
+                    replies = [ self.sock.recv(1 << 16) ]
+                except socket.error:
+                    # e.g. ICMP port unreachable, retransmit covers it
+                    continue
+            for r in replies:
+                try:
+                    xid, u = reply_unpacker(r)
+                except (EOFError, struct.error):
+                    continue
+                if xid in pending:
+                    results[pending[xid][0]] = u
+                    del pending[xid]
+
+        return results
+
+def pmap_getport(host, prog, vers, proto = "udp", timeout = RPC_TIMEOUT):
+    """asks host's portmapper for the port of prog/vers over proto,
+       returns 0 if it isn't registered"""
+    p = xdrlib.Packer()
+    p.pack_uint(prog)
+    p.pack_uint(vers)
+    p.pack_uint(IPPROTO[proto])
+    p.pack_uint(0)
+    c = rpc_client(host, PMAP_PROG, PMAP_VERS, "udp", PMAP_PORT,
+                   (AUTH_NULL, ""), timeout)
+    try:
+        return c.calls(PMAPPROC_GETPORT, [ p.get_buffer() ])[0].unpack_uint()
+    finally:
+        c.close()
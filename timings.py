@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Per-phase wall clock timings of a du.py run: NSS lookups, home mount
+discovery, mount probes, backend calls, subprocesses and rendering.
+
+Timings are off unless timings_enable() was called, in which case every
+timings_begin()/timings_end() pair is recorded against a monotonic clock.
+While off both are a single test of a global, so instrumentation can stay
+in place site-wide.  Phases which never ended, e.g. a backend abandoned
+past its deadline, are reported with a null duration.
+"""
+
+import os
+import time
+
+# the running recorder, None while timings are off
+recorder = None
+
+def monotonic_clock():
+    """returns a function giving monotonic seconds, falling back to
+       time.time if the platform has no monotonic clock"""
+    if hasattr(time, "monotonic"):
+        return time.monotonic
+
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [ ("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long) ]
+
+    # CLOCK_MONOTONIC from linux/time.h
+    CLOCK_MONOTONIC = 1
+    for lib in (ctypes.util.find_library("c"), "librt.so.1"):
+        try:
+            clock_gettime = ctypes.CDLL(lib).clock_gettime
+            break
+        except (OSError, AttributeError, TypeError):
+            continue
+    else:
+        return time.time
+
+    clock_gettime.argtypes = [ ctypes.c_int, ctypes.POINTER(timespec) ]
+    def clock():
+        ts = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)):
+            return time.time()
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return clock
+
+class timings(object):
+    """Phases recorded during one run, as [name, start, end] lists"""
+
+    def __init__(self):
+        self.clock = monotonic_clock()
+        self.wall = time.time()
+        self.start = self.clock()
+        self.phases = []
+
+def timings_enable():
+    """starts recording phases"""
+    global recorder
+    recorder = timings()
+
+def timings_begin(name):
+    """Marks the start of phase name.  Returns a handle for timings_end(),
+       None while timings are off."""
+    if recorder is None:
+        return None
+    p = [ name, recorder.clock(), None ]
+    # list.append is atomic, backends record from their own threads
+    recorder.phases.append(p)
+    return p
+
+def timings_end(p):
+    """marks the end of the phase started by timings_begin()"""
+    if p is not None:
+        p[2] = recorder.clock()
+
+def timings_call(name, func, *args):
+    """returns func(*args), recorded as phase name"""
+    if recorder is None:
+        return func(*args)
+    p = timings_begin(name)
+    try:
+        return func(*args)
+    finally:
+        timings_end(p)
+
+def timings_record(mode):
+    """returns the JSON-able record of the run so far, phase start and
+       duration in milliseconds from the start of the run"""
+    now = recorder.clock()
+    ms = lambda t: round(1000.0 * t, 3)
+    return {
+        "time": recorder.wall,
+        "host": os.uname()[1],
+        "pid": os.getpid(),
+        "uid": os.getuid(),
+        "mode": mode,
+        "total": ms(now - recorder.start),
+        "phases": [ { "name": name,
+                      "start": ms(start - recorder.start),
+                      "duration": None if end is None else ms(end - start) }
+                    for name, start, end in list(recorder.phases) ],
+    }
+
+def timings_log(dest, record):
+    """Appends record as a single line of JSON to dest, either "syslog" or
+       the path of a log file.  Failures are ignored, logging must never
+       get in the way of a login."""
+    import json
+
+    line = json.dumps(record, sort_keys = True)
+    try:
+        if dest == "syslog":
+            import syslog
+            syslog.openlog("hcc-du", syslog.LOG_PID, syslog.LOG_USER)
+            syslog.syslog(syslog.LOG_INFO, line)
+            return
+        # one O_APPEND write keeps concurrent logins' lines whole
+        fd = os.open(dest, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, line + "\n")
+        finally:
+            os.close(fd)
+    except (OSError, IOError):
+        pass
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+Parallel directory usage walker behind "du.py -w DIR", showing which
+directories hold a user's blocks and inodes.
+
+A pool of WALK_WORKERS threads lists directories and lstat(2)s their
+entries.  Those calls are round trips to the Lustre MDS, and the GIL is
+released while they wait.  The walk stays on DIR's filesystem and doesn't
+follow symbolic links.  Like du(1), usage is allocated blocks.  Unlike
+du(1), hard links are counted once per link.
+
+Each directory's own usage is kept in a per-user index in the cache
+directory (see qcache.py), one file per walked root:
+    { "version": 1, "root": DIR, "dirs": {
+        relative path: [ inode, mtime, scanned, bytes, inodes, subdirs ] } }
+A rerun that finds a directory with the same inode and mtime reuses its
+entry and only lstat()s the directory itself, so walking an unchanged
+tree costs one stat per directory.  A file growing in place doesn't
+change its directory's mtime, so entries are rescanned anyway once
+WALK_MAX_AGE old.
+"""
+
+import collections
+import errno
+import heapq
+import json
+import os
+import stat
+import tempfile
+import time
+
+from qcache import qcache_dir
+
+WALK_VERSION = 1
+WALK_FILE = "hcc-du.walk"
+WALK_WORKERS = 8
+WALK_MAX_AGE = 86400
+# mtimes have a granularity of a second on some filesystems, a directory
+# changed this recently could change again without its mtime moving
+WALK_RACY = 2.0
+
+# walk_entry namedtuple
+# One directory's own usage, not counting its subdirectories.  mtime is
+# None if the entry must not be reused.
+walk_entry = collections.namedtuple("walk_entry",
+                                    [
+                                        "ino",
+                                        "mtime",
+                                        "scanned",
+                                        "bytes",
+                                        "inodes",
+                                        "subdirs"
+                                    ])
+
+def walk_index_path(root):
+    """returns the path of root's index in the calling user's cache
+       directory, None if there is none"""
+    import hashlib
+
+    dir = qcache_dir()
+    if dir is None:
+        return None
+    return os.path.join(dir, "{0}.{1}".format(
+        WALK_FILE, hashlib.sha1(root).hexdigest()[:16]))
+
+def walk_index_load(path, root):
+    """returns the dictionary of relative path: walk_entry indexed for root
+       in path, empty if it is missing, stale or unreadable"""
+    try:
+        f = open(path)
+        try:
+            d = json.load(f)
+        finally:
+            f.close()
+        if d["version"] != WALK_VERSION or d["root"] != root:
+            return {}
+        # names are bytes, stored as latin-1 to survive JSON
+        ret = {}
+        for rel, e in d["dirs"].items():
+            e = walk_entry(*e)
+            ret[rel.encode("latin-1")] = e._replace(
+                subdirs = [ n.encode("latin-1") for n in e.subdirs ])
+        return ret
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return {}
+
+def walk_index_save(path, root, entries):
+    """atomically replaces the index in path"""
+    d = {
+        "version": WALK_VERSION,
+        "root": root,
+        "dirs": entries,
+    }
+    dir, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix = name + ".", dir = dir)
+    try:
+        f = os.fdopen(fd, "w")
+        try:
+            # dumps() encodes in C, dump() in Python
+            f.write(json.dumps(d, encoding = "latin-1"))
+        finally:
+            f.close()
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+def walk_scan(path, st, dev, now):
+    """returns the walk_entry of directory path, st being its lstat()"""
+    bytes = st.st_blocks * 512
+    inodes = 1
+    subdirs = []
+    for name in os.listdir(path):
+        try:
+            s = os.lstat(os.path.join(path, name))
+        except OSError:
+            # removed since it was listed
+            continue
+        if stat.S_ISDIR(s.st_mode):
+            # another filesystem's usage isn't ours
+            if s.st_dev == dev:
+                subdirs.append(name)
+        else:
+            bytes += s.st_blocks * 512
+            inodes += 1
+    mtime = st.st_mtime if st.st_mtime < now - WALK_RACY else None
+    return walk_entry(st.st_ino, mtime, now, bytes, inodes, subdirs)
+
+def walk_tree(root, index = None, workers = WALK_WORKERS):
+    """Walks the directory tree root with workers threads, reusing the
+       index entries of directories unchanged since.  Returns a dictionary
+       of relative path: walk_entry, the number of entries reused and a
+       list of (path, error) for directories that couldn't be read."""
+    import Queue
+    import threading
+
+    if index is None:
+        index = {}
+    dev = os.lstat(root).st_dev
+    now = time.time()
+    entries = {}
+    errors = []
+    queue = Queue.Queue()
+
+    def work():
+        while True:
+            rel = queue.get()
+            if rel is None:
+                return
+            try:
+                path = os.path.join(root, rel)
+                st = os.lstat(path)
+                e = index.get(rel)
+                if e is None or e.mtime != st.st_mtime or \
+                   e.ino != st.st_ino or now - e.scanned >= WALK_MAX_AGE:
+                    e = walk_scan(path, st, dev, now)
+                entries[rel] = e
+                for name in e.subdirs:
+                    queue.put(os.path.join(rel, name))
+            except OSError, e:
+                errors.append((os.path.join(root, rel),
+                               e.strerror or errno.errorcode.get(e.errno)))
+            finally:
+                queue.task_done()
+
+    threads = [ threading.Thread(target = work) for i in range(workers) ]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    queue.put("")
+    queue.join()
+    for t in threads:
+        queue.put(None)
+    reused = len([ rel for rel, e in entries.items() if index.get(rel) is e ])
+    return (entries, reused, errors)
+
+def walk_totals(entries):
+    """returns a dictionary of relative path: (bytes, inodes) of each
+       directory's whole subtree"""
+    totals = {}
+    # a subdirectory's path is longer than its parent's
+    for rel in sorted(entries, key = len, reverse = True):
+        e = entries[rel]
+        bytes, inodes = e.bytes, e.inodes
+        for name in e.subdirs:
+            t = totals.get(os.path.join(rel, name))
+            if t is not None:
+                bytes += t[0]
+                inodes += t[1]
+        totals[rel] = (bytes, inodes)
+    return totals
+
+def walk_size(bytes):
+    """returns bytes as a short human readable size"""
+    for unit in "BKMGT":
+        if bytes < 1024 or unit == "T":
+            break
+        bytes /= 1024.0
+    if unit == "B":
+        return "{0} B".format(int(bytes))
+    return "{0:.1f} {1}".format(bytes, unit)
+
+def walk_report(out, root, totals, top):
+    """writes the top directories of totals by bytes and by inodes to the
+       file out"""
+    for title, idx, fmt in (("disk usage", 0, walk_size),
+                            ("file count", 1, str)):
+        out.write("\nLargest directories by {0}\n".format(title))
+        rows = heapq.nlargest(top, totals.items(),
+                              key = lambda t: t[1][idx])
+        out.write("".join([ "{0:>12}  {1}\n".format(
+                                fmt(t[idx]),
+                                os.path.join(root, rel) if rel else root)
+                            for rel, t in rows ]))
+
+def walk(root, top = 10, use_index = True, workers = WALK_WORKERS):
+    """Walks root, reports its top directories to stdout and updates its
+       index.  Returns the walk_tree() result."""
+    import sys
+
+    root = os.path.abspath(root)
+    path = walk_index_path(root)
+    index = {}
+    if use_index and path is not None:
+        index = walk_index_load(path, root)
+
+    entries, reused, errors = walk_tree(root, index, workers)
+    # an unchanged tree has nothing new to save
+    if path is not None and not (reused == len(entries) == len(index)):
+        walk_index_save(path, root, entries)
+
+    walk_report(sys.stdout, root, walk_totals(entries), top)
+    if errors:
+        sys.stdout.write("\n{0} directories could not be read, e.g. {1}: "
+                         "{2}\n".format(len(errors), *errors[0]))
+    return (entries, reused, errors)
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""
+du.py --watch, the calling user's usage bars kept up to date on the
+terminal until interrupted, in place of "watch du.py".  The poll
+intervals are set in du.py, which imports this module only for --watch.
+
+Every poll is answered by one du_session (see duapi.py), keeping the
+Lustre directory open and rpc.rquotad connections up, in one process.
+The snapshot and per-user cache are bypassed, being minutes old.
+
+Polls come WATCH_MIN_INTERVAL seconds apart while usage changes, and back
+off by WATCH_BACKOFF after each poll finding it unchanged, up to
+WATCH_MAX_INTERVAL.  None starts sooner than WATCH_MIN_INTERVAL after the
+last, so watching can't hammer the quota servers, and the backends'
+node-wide rate limits (see bucket.py) apply as ever.  A backend shed for
+want of a token keeps showing its last usage.
+
+The whole frame is drawn once, and again when the terminal is resized or
+bar lines come or go.  Otherwise only the cells, a label or one mount's
+bar, whose text or style changed are rewritten, each at its own cursor
+position, along with the status line under the bars.
+"""
+
+import signal
+import sys
+import time
+
+from du import WATCH_MIN_INTERVAL, WATCH_MAX_INTERVAL, WATCH_BACKOFF
+
+# ECMA-48 control sequences, positions counting from 1
+CSI_HOME_CLEAR = "\x1b[H\x1b[2J"
+CSI_POSITION = "\x1b[{0};{1}H"
+CSI_CLEAR_LINE = "\x1b[K"
+CSI_HIDE_CURSOR = "\x1b[?25l"
+CSI_SHOW_CURSOR = "\x1b[?25h"
+
+def watch_interval(interval, changed):
+    """returns the seconds from the start of a poll to the next, after
+       interval seconds since the one before and usage found changed or
+       not"""
+    if changed:
+        return WATCH_MIN_INTERVAL
+    return max(WATCH_MIN_INTERVAL,
+               min(WATCH_MAX_INTERVAL, interval * WATCH_BACKOFF))
+
+class watch_screen(object):
+    """The terminal du.py --watch draws on, and what each cell shows"""
+
+    def __init__(self, opts, out):
+        from render import bar_render
+
+        self.out = out
+        self.br = bar_render(opts)
+        # (rows, columns, label width, bar lines) of the frame on screen
+        self.layout = None
+        # (row, column): text
+        self.cells = {}
+
+    def draw(self, rows, columns, lines, status):
+        """draws the bar lines, as display_lines() returns them, and the
+           status line, rewriting only the cells which changed"""
+        from du import DISPLAY_MOUNTS, display_header, equal_split
+
+        wm = len(max([ l[0] for l in lines ], key = len))
+        p3cw = equal_split(columns - wm - 2, 3)
+
+        cells = { (1, 1): display_header(DISPLAY_MOUNTS, wm, p3cw)[:-1] }
+        for r, (label, type, id, u) in enumerate(lines):
+            cells[(r + 2, 1)] = "{0:-<{width}.{width}}>".format(
+                label, width = wm + 1)
+            col = wm + 3
+            for m in range(len(p3cw)):
+                bar = []
+                self.br.bar(bar, *u[3][m], length = p3cw[m])
+                cells[(r + 2, col)] = "".join(bar)
+                col += p3cw[m]
+
+        out = []
+        layout = (rows, columns, wm, len(lines))
+        if layout != self.layout:
+            out.append(CSI_HOME_CLEAR)
+            self.cells = {}
+        for pos in sorted(cells):
+            if cells[pos] != self.cells.get(pos):
+                out.append(CSI_POSITION.format(*pos) + cells[pos])
+        out.append(CSI_POSITION.format(len(lines) + 3, 1) + CSI_CLEAR_LINE +
+                   status[:columns])
+        self.out.write("".join(out))
+        self.out.flush()
+        self.layout = layout
+        self.cells = cells
+
+def watch(opts):
+    """Polls the calling user's usage and redraws it until interrupted,
+       returns du.py's exit status"""
+    from du import BUCKET_EMPTY, getpwuid, getgrgid, getuid, \
+                   get_window_size, display_lines, gather_stats
+    from duapi import du_session, query_gids
+
+    pwe = getpwuid(getuid())
+    gre = getgrgid(pwe.pw_gid)
+    gids = query_gids(pwe, opts.sup)
+
+    session = du_session(use_snapshot = False)
+    screen = watch_screen(opts, sys.stdout)
+    # SIGWINCH cuts the sleep between polls short to redraw
+    resized = []
+    winch = signal.signal(signal.SIGWINCH,
+                          lambda signum, frame: resized.append(signum))
+    sys.stdout.write(CSI_HIDE_CURSOR)
+
+    c = None
+    usage = None
+    interval = WATCH_MIN_INTERVAL
+    try:
+        while True:
+            start = time.time()
+            last, c = c, session.collect(pwe, gids, opts.sup)
+            if last is not None:
+                for key in ("hquota", "wquota", "cquota"):
+                    if c[key] is BUCKET_EMPTY:
+                        c[key] = last[key]
+
+            rows, columns = get_window_size()
+            lines = display_lines(opts, rows, columns, pwe, gre,
+                                  *gather_stats(c))
+            # each line's label and ds_t per mount
+            last, usage = usage, [ (l[0], l[3][1]) for l in lines ]
+            if last is not None:
+                interval = watch_interval(interval, usage != last)
+            status = "Updated {0}, next in {1:.0f}s, Ctrl-C to quit" \
+                     .format(time.strftime("%H:%M:%S"), interval)
+            del resized[:]
+            screen.draw(rows, columns, lines, status)
+
+            while True:
+                left = start + interval - time.time()
+                if left <= 0:
+                    break
+                time.sleep(left)
+                if resized:
+                    del resized[:]
+                    rows, columns = get_window_size()
+                    screen.draw(rows, columns, lines, status)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGWINCH, winch)
+        sys.stdout.write(CSI_SHOW_CURSOR + "\n")
+        sys.stdout.flush()
+        session.close()
+    return 0